@@ -1,12 +1,48 @@
-import julian
+import math
 import datetime
-import dateutil.tz
+
+# julian, dateutil and the optional numpy are imported on first use; together they take longer to import than the rest of Bantu.
+_julian = None
+_numpy = False      # None once found missing.
 
 DEFAULT_DATETIME_FORMAT = '"%Y-%m-%d %H:%M:%S.%f"'
 DEFAULT_JULIAN_FORMAT = 'jd'
 
+JULIAN_FORMAT_OFFSETS = {'jd': 0, 'mjd': 2400000.5, 'rjd': 2400000}
+ORDINAL_TO_JDN = 1721425            # date.toordinal() + ORDINAL_TO_JDN is the Julian Day Number of a Gregorian date.
+MICROSECONDS_PER_DAY = 86400000000
+
+# MIN_JULIAN <= jd < MAX_JULIAN is the range from_julian can turn into a datetime (datetime.min up to the day after datetime.max).
+MIN_JULIAN = ORDINAL_TO_JDN + 0.5
+MAX_JULIAN = datetime.datetime.max.toordinal() + ORDINAL_TO_JDN + 0.5
+
+_DATETIME_EPOCH = datetime.datetime(1, 1, 1)
+
+def _get_julian():
+    
+    global _julian
+    if _julian is None:
+        import julian
+        _julian = julian
+    
+    return _julian
+
+def _get_numpy():
+    
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    
+    return _numpy
+
 def get_timezone_diff() -> int:
 
+    import dateutil.tz
+    
     localtz = dateutil.tz.tzlocal()
     localoffset = localtz.utcoffset(datetime.datetime.now(localtz))
     
@@ -25,20 +61,73 @@ def is_valid_dt_format(datetime_str, format=DEFAULT_DATETIME_FORMAT) -> bool:
 
 def to_julian(dt) -> float:
     
-    return julian.to_jd(dt, fmt=DEFAULT_JULIAN_FORMAT)
+    return _get_julian().to_jd(dt, fmt=DEFAULT_JULIAN_FORMAT)
 
 def from_julian(jul, format=DEFAULT_JULIAN_FORMAT) -> datetime.datetime:
     '''Format jd or mjd'''
-    return julian.from_jd(jul, fmt=format)
+    return _get_julian().from_jd(jul, fmt=format)
 
 def is_julian(jul, format=DEFAULT_JULIAN_FORMAT) -> bool:
-
-    try:
-        dt = from_julian(jul, format)
-    except:
+    '''True if jul is a number from_julian can turn into a datetime. A range check, no conversion is attempted.'''
+    if isinstance(jul, bool) or not isinstance(jul, (int, float)):
         return False
     
-    return isinstance(dt, datetime.datetime)
+    jul += JULIAN_FORMAT_OFFSETS.get(format.lower(), math.nan)
+    
+    return MIN_JULIAN <= jul < MAX_JULIAN
+
+def _to_julian(dt, offset) -> float:
+    
+    # Same operations, in the same order, as julian.to_jd so the results are bit-identical.
+    jd = dt.toordinal() + ORDINAL_TO_JDN + (dt.hour - 12) / 24 + dt.minute / 1440 + dt.second / 86400 + dt.microsecond / 86400000000
+    
+    return jd - offset if offset else jd
+
+def _from_julian(jul, offset) -> datetime.datetime:
+    
+    jul = jul + offset if offset else jul
+    jdn = math.floor(jul + 0.5)
+    microseconds = int((jul + 0.5 - jdn) * (1e6*24*3600))     # Truncated like julian.from_jd.
+    
+    return _DATETIME_EPOCH + datetime.timedelta(days=jdn - ORDINAL_TO_JDN - 1, microseconds=microseconds)
+
+def to_julian_many(dts, format=DEFAULT_JULIAN_FORMAT) -> list:
+    '''to_julian for a whole column chunk. None values are kept as None.'''
+    # No NumPy path: turning datetime objects into datetime64 costs more than this arithmetic.
+    offset = JULIAN_FORMAT_OFFSETS[format.lower()]
+    
+    return [None if dt is None else _to_julian(dt, offset) for dt in dts]
+
+def from_julian_many(juls, format=DEFAULT_JULIAN_FORMAT) -> list:
+    '''from_julian for a whole column chunk. None values are kept as None.'''
+    offset = JULIAN_FORMAT_OFFSETS[format.lower()]
+    
+    numpy = _get_numpy() if len(juls) >= 16 else None
+    if numpy is None:
+        return [None if jul is None else _from_julian(jul, offset) for jul in juls]
+    
+    present = [i for i, jul in enumerate(juls) if jul is not None]
+    
+    jul = numpy.array([juls[i] for i in present] if len(present) < len(juls) else juls, dtype=numpy.float64)
+    if offset:
+        jul = jul + offset
+    if not numpy.all((jul >= MIN_JULIAN) & (jul < MAX_JULIAN)):
+        # Out of datetime's range (or NaN): datetime64 would take it and tolist() return ints. The scalar path raises as from_julian does.
+        return [None if jul is None else _from_julian(jul, offset) for jul in juls]
+    jdn = numpy.floor(jul + 0.5)
+    microseconds = ((jul + 0.5 - jdn) * (1e6*24*3600)).astype(numpy.int64)
+    
+    days = jdn.astype(numpy.int64) - (datetime.date(1970, 1, 1).toordinal() + ORDINAL_TO_JDN)
+    dts = (days * MICROSECONDS_PER_DAY + microseconds).astype('datetime64[us]').tolist()
+    
+    if len(present) == len(juls):
+        return dts
+    
+    result = [None] * len(juls)
+    for i, dt in zip(present, dts):
+        result[i] = dt
+        
+    return result
 
 def main():
 
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Run from the repository root:  python -m benchmarks.import_time
+# Startup cost of the CLI, measured in fresh interpreters. Exits with status 1 when a measured import exceeds its
+# budget or loads one of LAZY_MODULES, which only the code paths using them may import.
+
+LAZY_MODULES = ('pymssql', 'julian', 'dateutil', 'numpy')
+
+# Module imported -> budget in milliseconds, on top of the bare interpreter startup.
+DEFAULT_BUDGETS_MS = {
+    'main': 25,
+    'sql.DataClone': 100,
+    'sql.SchemaClone': 100,
+    'sql.DataSnapshot': 100
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+'''
+
+def probe(module) -> dict:
+    '''Imports module in a fresh interpreter; returns the import time and the LAZY_MODULES it loaded.'''
+    code = _PROBE.format(module=module, lazy=LAZY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output)
+
+def startup_seconds(args) -> float:
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, check=False)
+    return time.perf_counter() - start
+
+def run(repeat, budgets) -> dict:
+
+    results = []
+    for module, budget_ms in budgets.items():
+        probes = [probe(module) for _ in range(repeat)]
+        median_ms = statistics.median(p['seconds'] for p in probes) * 1000
+        loaded = sorted({name for p in probes for name in p['loaded']})
+
+        results.append({'module': module, 'median_ms': round(median_ms, 2), 'budget_ms': budget_ms, 'lazy_modules_loaded': loaded,
+                        'ok': median_ms <= budget_ms and not loaded})
+
+    interpreter_ms = statistics.median(startup_seconds(['-c', 'pass']) for _ in range(repeat)) * 1000
+    help_ms = statistics.median(startup_seconds(['main.py', '--help']) for _ in range(repeat)) * 1000
+
+    return {'interpreter_ms': round(interpreter_ms, 2), 'main_help_ms': round(help_ms, 2), 'results': results,
+            'ok': all(result['ok'] for result in results)}
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Import time of the CLI and its backends against per-module budgets.")
+    parser.add_argument("-repeat", type=int, default=5, help="Fresh interpreters per measurement; the median is reported")
+    parser.add_argument("-budget", type=str, nargs='+', default=[], help="MODULE=MILLISECONDS overriding a default budget, or adding one")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for item in args.budget:
+        module, _, budget_ms = item.partition('=')
+        budgets[module] = float(budget_ms)
+
+    report = run(args.repeat, budgets)
+    print(json.dumps(report, indent=2))
+
+    for result in report['results']:
+        if not result['ok']:
+            print(f"{result['module']}: {result['median_ms']} ms (budget {result['budget_ms']} ms), "
+                  f"lazy modules loaded: {result['lazy_modules_loaded'] or 'none'}", file=sys.stderr)
+
+    sys.exit(0 if report['ok'] else 1)
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bdatetime.bdatetime import to_julian, from_julian, to_julian_many, from_julian_many
+from sql.DataClone import DataClone
+from sql.SchemaClone import SchemaClone
+
+from benchmarks.sqlserver_standin import sqlserver_standin
+
+# Run from the repository root:  python -m benchmarks.migration_throughput -tables 8 -rows 50000 -output results.json
+# SQL Server legs write into benchmarks.sqlserver_standin, so the suite runs offline and measures Bantu alone.
+
+COLUMN_TYPES = ('TEXT', 'REAL', 'NUMERIC', 'BLOB')      # REAL columns hold Julian dates, as cloned SQL Server dates do.
+JULIAN_EPOCH = 2451545.0                                # 2000-01-01 12:00
+
+SERVER = 'standin'
+DATABASE = 'BantuBench'
+
+def parse_column_mix(items) -> dict:
+    '''['TEXT=2', 'REAL=1'] -> {'TEXT': 2, 'REAL': 1}'''
+    mix = {}
+    for item in items:
+        column_type, _, count = item.partition('=')
+        column_type = column_type.upper()
+        if column_type not in COLUMN_TYPES:
+            raise ValueError(f"Column type must be one of {COLUMN_TYPES}, got {column_type}")
+        mix[column_type] = int(count or 1)
+
+    return mix
+
+def _value(column_type, i, rnd):
+
+    if column_type == 'TEXT':
+        return f'text-{i}-{rnd.random():.6f}'
+    if column_type == 'REAL':
+        return JULIAN_EPOCH + rnd.uniform(0, 9000)
+    if column_type == 'NUMERIC':
+        return round(rnd.uniform(-1e6, 1e6), 2)
+    return rnd.randbytes(32) if hasattr(rnd, 'randbytes') else bytes(rnd.getrandbits(8) for _ in range(32))
+
+def create_database(path, num_of_tables, num_of_rows, column_mix, fk_depth, seed=0) -> int:
+    '''Synthetic SQLite database of num_of_tables tables with num_of_rows rows each. Tables form chains of fk_depth
+    foreign keys: every table but the first of a chain references the one before it. Returns the total row count.'''
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+
+    columns = [(f'{column_type.title()}{n}', column_type) for column_type, count in column_mix.items() for n in range(count)]
+
+    for t in range(num_of_tables):
+        table = f'Bench{t}'
+        parent = f'Bench{t - 1}' if fk_depth and t % (fk_depth + 1) else None
+
+        definitions = ['"Id" INTEGER NOT NULL']
+        definitions += [f'"{name}" {column_type} NULL' for name, column_type in columns]
+        if parent:
+            definitions.append('"ParentId" INTEGER NULL')
+        definitions.append('PRIMARY KEY("Id" AUTOINCREMENT)')
+        if parent:
+            definitions.append(f'FOREIGN KEY("ParentId") REFERENCES "{parent}"("Id")')
+        cursor.execute(f'CREATE TABLE "{table}" ({", ".join(definitions)})')
+
+        names = [name for name, _ in columns] + (['ParentId'] if parent else [])
+        sql = f'INSERT INTO "{table}" ({", ".join(f"{chr(34)}{name}{chr(34)}" for name in names)}) VALUES ({", ".join(["?"] * len(names))})'
+
+        def rows():
+            for i in range(num_of_rows):
+                row = [_value(column_type, i, rnd) for _, column_type in columns]
+                if parent:
+                    row.append(rnd.randint(1, num_of_rows))
+                yield row
+
+        cursor.executemany(sql, rows())
+        conn.commit()
+
+    conn.close()
+
+    return num_of_tables * num_of_rows
+
+def measure(func, trace_memory=True) -> dict:
+    '''Times func(), then, with trace_memory, runs it again under tracemalloc for its peak memory; tracing slows the
+    code down too much for the timing to be taken in the same run. func returns the number of rows it processed.'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        rows = func()
+        seconds = time.perf_counter() - start
+
+        peak = None
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                func()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+    return {'rows': rows, 'seconds': round(seconds, 4), 'rows_per_sec': round(rows / seconds, 1) if seconds and rows else None,
+            'peak_memory_bytes': peak}
+
+def run(args) -> dict:
+
+    column_mix = parse_column_mix(args.column_mix)
+    results = []
+
+    def record(stage, result):
+        result = {'stage': stage, **result}
+        results.append(result)
+        print(f"{stage:<48} {result['rows']:>10} rows {result['seconds']:>9.3f}s "
+              f"{result['rows_per_sec'] or 0:>12.0f} rows/s {(result['peak_memory_bytes'] or 0) / 2**20:>8.2f} MiB", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as dirname:
+        sqlite_path = os.path.join(dirname, 'bench.db')
+
+        start = time.perf_counter()
+        total_rows = create_database(sqlite_path, args.tables, args.rows, column_mix, args.fk_depth, args.seed)
+        print(f"Generated {total_rows} rows in {time.perf_counter() - start:.1f}s.", file=sys.stderr)
+
+        with sqlserver_standin() as server:
+            def schema_clone():
+                server.tables.clear()
+                server.primary_keys.clear()
+                SchemaClone.sqlite_to_sqlserver(sqlite_path, SERVER, DATABASE)
+                return 0
+
+            def data_clone(**kwargs):
+                def copy():
+                    server.reset_counters()
+                    DataClone.sqlite_to_sqlserver(sqlite_path, SERVER, DATABASE, jobs=args.jobs, **kwargs)
+                    return sum(server.rows_written.values())
+                return copy
+
+            def add_constraints():
+                SchemaClone.sqlite_to_sqlserver_add_constraints(sqlite_path, SERVER, DATABASE)
+                return 0
+
+            record('SchemaClone.sqlite_to_sqlserver', measure(schema_clone, args.memory))
+            record('DataClone.sqlite_to_sqlserver batched', measure(data_clone(bulk_copy_threshold=None), args.memory))
+            record('DataClone.sqlite_to_sqlserver bulk_copy', measure(data_clone(bulk_copy_threshold=0), args.memory))
+            record('SchemaClone.sqlite_to_sqlserver_add_constraints', measure(add_constraints, args.memory))
+
+    rnd = random.Random(args.seed)
+    dts = [datetime.datetime(2000, 1, 1) + datetime.timedelta(seconds=rnd.randrange(0, 10**9)) for _ in range(args.converter_values)]
+    juls = [to_julian(dt) for dt in dts]
+
+    def scalar(func, values):
+        def convert():
+            for val in values:
+                func(val)
+            return len(values)
+        return convert
+
+    def vectorized(func, values):
+        def convert():
+            return len(func(values))
+        return convert
+
+    record('bdatetime.to_julian', measure(scalar(to_julian, dts), args.memory))
+    record('bdatetime.to_julian_many', measure(vectorized(to_julian_many, dts), args.memory))
+    record('bdatetime.from_julian', measure(scalar(from_julian, juls), args.memory))
+    record('bdatetime.from_julian_many', measure(vectorized(from_julian_many, juls), args.memory))
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform()},
+        'parameters': {'tables': args.tables, 'rows': args.rows, 'column_mix': column_mix, 'fk_depth': args.fk_depth,
+                       'jobs': args.jobs, 'converter_values': args.converter_values, 'seed': args.seed},
+        'results': results
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Throughput and peak memory of the migration stages on a synthetic SQLite database.")
+    parser.add_argument("-tables", type=int, default=8, help="Number of tables")
+    parser.add_argument("-rows", type=int, default=20_000, help="Rows per table")
+    parser.add_argument("-column-mix", type=str, nargs='+', default=['TEXT=2', 'REAL=2', 'NUMERIC=1', 'BLOB=1'], help="TYPE=COUNT columns per table")
+    parser.add_argument("-fk-depth", type=int, default=2, help="Length of the foreign key chains between tables (0: no foreign keys)")
+    parser.add_argument("-jobs", type=int, default=1, help="DataClone jobs")
+    parser.add_argument("-converter-values", type=int, default=200_000, help="Values converted by the bdatetime benchmarks")
+    parser.add_argument("-seed", type=int, default=0, help="Random seed of the generated data")
+    parser.add_argument("-no-memory", dest="memory", action="store_false", help="Skip the tracemalloc pass of every stage")
+    parser.add_argument("-output", type=str, help="JSON results file (default: stdout)")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,183 @@
+import re
+import threading
+from contextlib import contextmanager
+
+from sql.sqlserver import connectionimpl as sqlserver_connection
+from sql.sqlserver import schemaimpl as sqlserver_schema
+
+# Offline stand-in for the SQL Server side of a migration: a DB-API connection that keeps the tables created through
+# it, answers the catalog queries of sql.sqlserver.schemaimpl from them and consumes, counts and discards written rows.
+# The benchmarks time Bantu's own work (catalog reads, conversion, batching, statement building), not a server.
+
+_CREATE_TABLE = re.compile(r"CREATE TABLE \[dbo\]\.\[(?P<table>[^\]]+)\] \((?P<body>.*?)\n\);", re.S)
+_COLUMN = re.compile(r"^\t\[(?P<name>[^\]]+)\] (?P<type>[\w]+)(?:\((?P<length>[^)]*)\))?\s*(?P<identity>IDENTITY\(1,1\))?\s*(?P<null>NOT NULL|NULL)")
+_PRIMARY_KEY = re.compile(r"CONSTRAINT \[[^\]]+\] PRIMARY KEY CLUSTERED \(\[(?P<column>[^\]]+)\]")
+_ADD_PRIMARY_KEY = re.compile(r"ALTER TABLE \[dbo\]\.\[(?P<table>[^\]]+)\] ADD CONSTRAINT \[[^\]]+\] PRIMARY KEY CLUSTERED \(\[(?P<column>[^\]]+)\]")
+_OBJECT_ID = re.compile(r"OBJECT_ID\(N'dbo\.(?P<table>[^']+)', N'U'\)")
+_INSERT = re.compile(r"INSERT INTO \[(?P<table>[^\]]+)\]")
+
+class StandInServer:
+    '''State shared by every connection to the stand-in: tables created, rows written per table and statements run.'''
+
+    def __init__(self):
+
+        self.tables = {}            # Table -> [(name, data type, length, nullable, identity)]
+        self.primary_keys = {}
+        self.rows_written = {}
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def connect(self, *args, **kwargs):
+
+        return StandInConnection(self)
+
+    def reset_counters(self):
+
+        with self._lock:
+            self.rows_written.clear()
+            self.statements = 0
+
+    def add_rows(self, table, count):
+
+        with self._lock:
+            self.rows_written[table] = self.rows_written.get(table, 0) + count
+
+    def execute(self, sql) -> list:
+        '''Applies DDL found in sql and returns the result rows of the catalog query it is, if any.'''
+        with self._lock:
+            self.statements += 1
+
+            for match in _CREATE_TABLE.finditer(sql):
+                columns = []
+                for line in match.group('body').split('\n'):
+                    column = _COLUMN.match(line)
+                    if column:
+                        columns.append((column.group('name'), column.group('type'), column.group('length'), column.group('null') == 'NULL',
+                                        column.group('identity') is not None))
+                    primary_key = _PRIMARY_KEY.search(line)
+                    if primary_key:
+                        self.primary_keys[match.group('table')] = primary_key.group('column')
+                self.tables[match.group('table')] = columns
+
+            for match in _ADD_PRIMARY_KEY.finditer(sql):
+                self.primary_keys[match.group('table')] = match.group('column')
+
+            return self._query(sql)
+
+    def _query(self, sql) -> list:
+
+        if 'DB_ID(' in sql:
+            return [(1, )]
+
+        match = _OBJECT_ID.search(sql)
+        if match and sql.lstrip().startswith('SELECT OBJECT_ID'):
+            return [(1 if match.group('table') in self.tables else None, )]
+
+        if 'FROM sys.tables' in sql and 'sys.indexes' not in sql:
+            return [(table, ) for table in self.tables]
+
+        if 'INFORMATION_SCHEMA.COLUMNS' in sql:
+            return [(table, name, i + 1, 'YES' if nullable else 'NO', data_type, -1 if length == 'max' else None, None)
+                    for table, columns in sorted(self.tables.items())
+                    for i, (name, data_type, length, nullable, identity) in enumerate(columns)]
+
+        if "CONSTRAINT_TYPE='PRIMARY KEY'" in sql:
+            return sorted(self.primary_keys.items())
+
+        return []
+
+    def has_identity(self, table) -> bool:
+
+        return any(column[4] for column in self.tables.get(table, ()))
+
+class StandInCursor:
+
+    def __init__(self, server):
+
+        self._server = server
+        self._rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+
+        if 'sys.identity_columns' in sql:
+            self._rows = [(1 if self._server.has_identity(params[0].split('.', 1)[-1]) else 0, )]
+        else:
+            self._rows = self._server.execute(sql)
+        self.rowcount = len(self._rows)
+
+    def executemany(self, sql, seq_of_params):
+
+        count = sum(1 for _ in seq_of_params)
+        match = _INSERT.search(sql)
+        if match:
+            self._server.add_rows(match.group('table'), count)
+        self._rows = []
+        self.rowcount = count
+
+    def fetchone(self):
+
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+
+        self._rows = []
+
+class StandInConnection:
+
+    def __init__(self, server):
+
+        self._server = server
+
+    def cursor(self):
+
+        return StandInCursor(self._server)
+
+    def bulk_copy(self, table_name, elements, column_ids=None, batch_size=1000, tablock=False, check_constraints=False, fire_triggers=False):
+
+        self._server.add_rows(table_name, sum(1 for _ in elements))
+
+    def autocommit(self, status):
+
+        pass
+
+    def commit(self):
+
+        pass
+
+    def rollback(self):
+
+        pass
+
+    def close(self):
+
+        pass
+
+@contextmanager
+def sqlserver_standin(server=None):
+    '''Routes the SQL Server connections Bantu opens to a StandInServer for the duration of the block.'''
+    server = server or StandInServer()
+    patched = [(sqlserver_connection, 'get_trusted_connection'), (sqlserver_connection, 'get_connection'),
+               (sqlserver_schema, 'get_trusted_connection'), (sqlserver_schema, 'get_connection')]
+    saved = [(module, name, getattr(module, name)) for module, name in patched]
+
+    # Pooled connections opened before or during the block must not outlive the patch.
+    sqlserver_connection.close_pools()
+    for module, name in patched:
+        setattr(module, name, server.connect)
+    try:
+        yield server
+    finally:
+        sqlserver_connection.close_pools()
+        for module, name, func in saved:
+            setattr(module, name, func)
@@ -0,0 +1,70 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import tracemalloc
+
+from sql.sqlite import dataimpl as sqlite_data
+
+TABLE = 'StreamBench'
+
+def create_database(path, num_of_rows):
+
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute(f'CREATE TABLE "{TABLE}" ("Id" INTEGER NOT NULL, "Name" TEXT NULL, "Amount" REAL NULL, "Note" TEXT NULL, PRIMARY KEY("Id" AUTOINCREMENT))')
+    cursor.executemany(f'INSERT INTO "{TABLE}" ("Name", "Amount", "Note") VALUES (?, ?, ?)',
+                       ((f'name-{i}', i * 1.5, 'x' * 200) for i in range(num_of_rows)))
+    conn.commit()
+
+    return conn
+
+def measure(func) -> tuple:
+
+    tracemalloc.start()
+    try:
+        count = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return count, peak
+
+def run(num_of_rows, batch_size):
+
+    with tempfile.TemporaryDirectory() as dirname:
+        conn = create_database(os.path.join(dirname, 'bench.db'), num_of_rows)
+
+        def fetch_all():
+            rows = sqlite_data.select_all(conn, TABLE)
+            return len(rows)
+
+        def stream():
+            count = 0
+            for rows in sqlite_data.iter_rows(conn, TABLE, batch_size):
+                count += len(rows)
+            return count
+
+        results = {}
+        results['select_all'] = measure(fetch_all)
+        results['iter_rows'] = measure(stream)
+        conn.close()
+
+    return results
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Peak memory of select_all vs. iter_rows on a synthetic SQLite table.")
+    parser.add_argument("-rows", type=int, nargs='+', default=[10_000, 100_000, 400_000], help="Table sizes to measure")
+    parser.add_argument("-batch-size", type=int, default=sqlite_data.DEFAULT_BATCH_SIZE, help="iter_rows batch size")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'reader':>12} {'peak MiB':>10}")
+    for num_of_rows in args.rows:
+        for reader, (count, peak) in run(num_of_rows, args.batch_size).items():
+            assert count == num_of_rows
+            print(f"{num_of_rows:>10} {reader:>12} {peak / 2**20:>10.2f}")
+
+if __name__ == '__main__':
+
+    main()
@@ -1,33 +1,114 @@
 import argparse
 
-from sql.SchemaClone import SchemaClone
-from sql.DataClone import DataClone
+from sql.incremental import parse_modified_columns
+from sql.subsetting import parse_subset
     
 
 def execute(source_db_type: str, dest_db_type: str, 
             mssql_trusted: bool = True, mssql_server_name: str = None, mssql_database_name: str = None, mssql_username: str = None, mssql_password: str = None,
-            sqlite_path: str = None, schema_clone: bool = True, data_clone: bool = False):
+            sqlite_path: str = None, schema_clone: bool = True, data_clone: bool = False, one_by_one: bool = False, jobs: int = 1,
+            partitions: int = 4, partition_threshold: int = 1000000, resume: bool = False, checkpoint: bool = False, checkpoint_path: str = None,
+            bulk_copy_tables: list = None, bulk_copy_threshold: int = 100000, tablock: bool = False, defer_indexes: bool = False,
+            incremental: bool = False, modified_columns: dict = None, verify: bool = False, repair: bool = False,
+            metrics_path: str = None, export_dir: str = None, import_dir: str = None, lob_inline_limit: int = 1 << 20, 
+            subset=None):
+    
+    # Imported here rather than at startup, so --help and argument errors return without loading the backends.
+    from sql.SchemaClone import SchemaClone
+    from sql.DataClone import DataClone
+    from sql.DataSync import DataSync
+    from sql.DataVerify import DataVerify
+    from sql.DataSnapshot import DataSnapshot
+    from sql.CheckpointJournal import CheckpointJournal
+    from sql.metrics import Metrics, get_metrics, set_metrics
+    from sql.sqlite import connectionimpl as sqlite_connection
+    from sql.sqlserver import connectionimpl as sqlserver_connection
     
     if not mssql_trusted:
         raise NotImplementedError("SQL-Server connection without trusted-connection is not implemented yet.")
+    
+    journal = None
+    if incremental or (data_clone and (checkpoint or checkpoint_path)) or resume:
+        # Only asked for: checkpointing reads every table in primary key order. --resume continues from the journal
+        # instead of starting over; incremental syncs keep their watermarks in it.
+        migration = f"{source_db_type}:{mssql_server_name}/{mssql_database_name} -> {dest_db_type}:{sqlite_path}"
+        journal = CheckpointJournal(checkpoint_path or f"{sqlite_path}.checkpoint", migration, resume)
+    
+    metrics_file = None
+    if metrics_path:
+        metrics_file = open(metrics_path, 'a')
+        set_metrics(Metrics(metrics_file))
+    
+    def is_done(step):
+        return journal is not None and journal.resuming and journal.is_step_done(step)
+    
+    def mark_done(step):
+        if journal is not None:
+            journal.mark_step_done(step)
+    
+    try:
+        if export_dir:
+            if source_db_type == "mssql":
+                DataSnapshot.export_sqlserver(mssql_server_name, mssql_database_name, export_dir)
+            else:
+                DataSnapshot.export_sqlite(sqlite_path, export_dir)
         
-    if source_db_type == "mssql" and dest_db_type == "sqlite":
-        if schema_clone:
-            SchemaClone.sqlserver_to_sqlite(sqlserver_name=mssql_server_name, sqlserver_database=mssql_database_name, 
-                                            sqlserver_username=mssql_username, sqlserver_password=mssql_password, 
-                                            sqlite_path=sqlite_path, mssql_trusted=False)
-        if data_clone:
-            DataClone.sqlserver_to_sqlite(mssql_server_name, mssql_database_name, sqlite_path)
+        elif import_dir:
+            if dest_db_type == "mssql":
+                DataSnapshot.import_sqlserver(import_dir, mssql_server_name, mssql_database_name, bulk_copy_threshold=bulk_copy_threshold, tablock=tablock)
+            else:
+                DataSnapshot.import_sqlite(import_dir, sqlite_path)
         
-    elif source_db_type == "sqlite" and dest_db_type == "mssql":
-        if schema_clone:
-            SchemaClone.sqlite_to_sqlserver(sqlite_path, mssql_server_name, mssql_database_name)
-        if data_clone:
-            DataClone.sqlite_to_sqlserver(sqlite_path, mssql_server_name, mssql_database_name)
-            SchemaClone.sqlite_to_sqlserver_add_constraints(sqlite_path, mssql_server_name, mssql_database_name)
+        elif source_db_type == "mssql" and dest_db_type == "sqlite":
+            if schema_clone and not is_done("schema"):
+                SchemaClone.sqlserver_to_sqlite(sqlserver_name=mssql_server_name, sqlserver_database=mssql_database_name, 
+                                                sqlserver_username=mssql_username, sqlserver_password=mssql_password, 
+                                                sqlite_path=sqlite_path, mssql_trusted=False, defer_indexes=defer_indexes)
+                mark_done("schema")
+            if incremental:
+                DataSync.sqlserver_to_sqlite(mssql_server_name, mssql_database_name, sqlite_path, journal, modified_columns)
+            elif data_clone:
+                DataClone.sqlserver_to_sqlite(mssql_server_name, mssql_database_name, sqlite_path, jobs=jobs, 
+                                              partitions=partitions, partition_threshold=partition_threshold, journal=journal, 
+                                              lob_limit=lob_inline_limit, subset=subset)
+                if not is_done("constraints"):
+                    SchemaClone.sqlserver_to_sqlite_add_constraints(sqlserver_name=mssql_server_name, sqlserver_database=mssql_database_name, 
+                                                                    sqlserver_username=mssql_username, sqlserver_password=mssql_password, 
+                                                                    sqlite_path=sqlite_path, mssql_trusted=False)
+                    mark_done("constraints")
+            if verify:
+                DataVerify.sqlserver_to_sqlite(mssql_server_name, mssql_database_name, sqlite_path, repair=repair)
+            
+        elif source_db_type == "sqlite" and dest_db_type == "mssql":
+            if schema_clone and not is_done("schema"):
+                SchemaClone.sqlite_to_sqlserver(sqlite_path, mssql_server_name, mssql_database_name, defer_indexes=defer_indexes)
+                mark_done("schema")
+            if incremental:
+                DataSync.sqlite_to_sqlserver(sqlite_path, mssql_server_name, mssql_database_name, journal, modified_columns)
+            elif data_clone:
+                DataClone.sqlite_to_sqlserver(sqlite_path, mssql_server_name, mssql_database_name, one_by_one=one_by_one, jobs=jobs, 
+                                              partitions=partitions, partition_threshold=partition_threshold, journal=journal, 
+                                              bulk_copy_tables=bulk_copy_tables or (), bulk_copy_threshold=bulk_copy_threshold, tablock=tablock, 
+                                              lob_limit=lob_inline_limit, subset=subset)
+                if not is_done("constraints"):
+                    SchemaClone.sqlite_to_sqlserver_add_constraints(sqlite_path, mssql_server_name, mssql_database_name, defer_indexes=defer_indexes)
+                    mark_done("constraints")
+            if verify:
+                DataVerify.sqlite_to_sqlserver(sqlite_path, mssql_server_name, mssql_database_name, repair=repair)
 
-    else:
-        print("No-clone option selected.")
+        else:
+            print("No-clone option selected.")
+    finally:
+        sqlite_connection.close_pools()
+        sqlserver_connection.close_pools()
+        if journal is not None:
+            journal.close()
+        if metrics_file is not None:
+            metrics = get_metrics()
+            metrics.event('summary', **metrics.summary())
+            print(metrics.report())
+            metrics_file.close()
+            set_metrics(Metrics(enabled=False))
 
 def main():
     
@@ -52,6 +133,31 @@ def main():
     
     optional_args_parser.add_argument("-schema-clone", action="store_true", default=False, help="Clone schema")
     optional_args_parser.add_argument("-data-clone", action="store_true", default=False, help="Clone data")
+    optional_args_parser.add_argument("-one-by-one", action="store_true", default=False, help="Insert SQL Server rows one by one (slow fallback writer)")
+    optional_args_parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of tables copied concurrently, each worker with its own connections")
+    optional_args_parser.add_argument("-partitions", type=int, default=4, help="Number of primary key ranges a large table is split into")
+    optional_args_parser.add_argument("-partition-threshold", type=int, default=1000000, help="Row count above which a table is split into primary key ranges")
+    optional_args_parser.add_argument("-bulk-copy-tables", type=str, nargs="*", help="Tables always loaded into SQL Server through bulk copy")
+    optional_args_parser.add_argument("-bulk-copy-threshold", type=int, default=100000, help="Row count from which a table is loaded into SQL Server through bulk copy (0: every table)")
+    optional_args_parser.add_argument("-tablock", action="store_true", default=False, help="Lock the whole table during SQL Server bulk copies (minimal logging)")
+    optional_args_parser.add_argument("-defer-indexes", action="store_true", default=False, help="Load into tables without primary keys and indexes and build them after the data load")
+    optional_args_parser.add_argument("-incremental", action="store_true", default=False, help="Copy only the rows added or changed since the last sync, upserting them on the primary key")
+    optional_args_parser.add_argument("-modified-columns", type=str, nargs="*", help="Table=Column pairs naming the modified-at column an incremental sync tracks")
+    optional_args_parser.add_argument("-verify", action="store_true", default=False, help="Compare source and destination by key range checksums and report the differing rows")
+    optional_args_parser.add_argument("-repair", action="store_true", default=False, help="With -verify, re-sync the differing rows")
+    optional_args_parser.add_argument("-metrics-path", type=str, help="Append per-table metrics as JSON lines to this file and print a summary at the end")
+    optional_args_parser.add_argument("-export-dir", type=str, help="Export every table of the source database into snapshot files in this directory instead of migrating")
+    optional_args_parser.add_argument("-import-dir", type=str, help="Load the snapshot files in this directory into the destination database instead of migrating")
+    optional_args_parser.add_argument("-lob-inline-limit", type=int, default=1 << 20, help="Size in bytes above which BLOB and (max) text values are streamed in chunks after their rows (-1: never)")
+    optional_args_parser.add_argument("-include-tables", type=str, nargs="*", help="Copy only the tables matching these patterns (e.g. Sales*)")
+    optional_args_parser.add_argument("-exclude-tables", type=str, nargs="*", help="Do not copy the tables matching these patterns")
+    optional_args_parser.add_argument("-columns", type=str, nargs="*", help="Table=Column1,Column2 projections; the other columns are copied as NULL")
+    optional_args_parser.add_argument("-where", type=str, nargs="*", help="Table=Condition pairs; a condition in the source database's SQL the copied rows must satisfy")
+    optional_args_parser.add_argument("-sample", type=str, nargs="*", help="Percent of the rows of every table, or Table=Percent, picked by primary key hash")
+    optional_args_parser.add_argument("-no-fk-closure", dest="fk_closure", action="store_false", help="Do not add the tables and rows the copied rows reference")
+    optional_args_parser.add_argument("--resume", action="store_true", default=False, help="Skip the tables an interrupted run completed and continue the others from their last checkpoint")
+    optional_args_parser.add_argument("-checkpoint", action="store_true", default=False, help="Keep a checkpoint journal, so that an interrupted data clone can be continued with --resume")
+    optional_args_parser.add_argument("-checkpoint-path", type=str, help="Checkpoint journal file; implies -checkpoint (default: the SQLite path + .checkpoint)")
     
     try:
         args = parser.parse_args()
@@ -64,7 +170,27 @@ def main():
                 sqlite_path=args.sqlite_path, 
                 mssql_trusted=args.mssql_trusted,
                 schema_clone=args.schema_clone, 
-                data_clone=args.data_clone)
+                data_clone=args.data_clone,
+                one_by_one=args.one_by_one,
+                jobs=args.jobs,
+                partitions=args.partitions,
+                partition_threshold=args.partition_threshold,
+                resume=args.resume,
+                checkpoint=args.checkpoint,
+                checkpoint_path=args.checkpoint_path,
+                bulk_copy_tables=args.bulk_copy_tables,
+                bulk_copy_threshold=args.bulk_copy_threshold,
+                tablock=args.tablock,
+                defer_indexes=args.defer_indexes,
+                incremental=args.incremental,
+                modified_columns=parse_modified_columns(args.modified_columns),
+                verify=args.verify,
+                repair=args.repair,
+                metrics_path=args.metrics_path,
+                export_dir=args.export_dir,
+                import_dir=args.import_dir,
+                lob_inline_limit=args.lob_inline_limit if args.lob_inline_limit >= 0 else None,
+                subset=parse_subset(args.include_tables, args.exclude_tables, args.columns, args.where, args.sample, args.fk_closure))
         
     except Exception as error:
         print(f"ArgParse Error | {error}")
@@ -0,0 +1,133 @@
+import datetime
+import decimal
+import sqlite3
+import threading
+import uuid
+
+from sql.Interfaces import Checkpoint, Watermark
+
+PARTIAL = 'partial'
+DONE = 'done'
+
+WHOLE_TABLE = ''        # Part name of a table copied as one stream; key ranges are named by part_name.
+
+def part_name(key_range) -> str:
+
+    return WHOLE_TABLE if not key_range else f'{key_range[0]}..{key_range[1]}'
+
+# Key types sqlite3 cannot store natively, kept as text with their type name so they are read back unchanged.
+_KEY_TYPES = {
+    'datetime': datetime.datetime.fromisoformat,
+    'date': datetime.date.fromisoformat,
+    'time': datetime.time.fromisoformat,
+    'Decimal': decimal.Decimal,
+    'UUID': uuid.UUID
+}
+
+def _to_journal_key(key) -> tuple:
+    '''(value, type name or None)'''
+    if key is None or isinstance(key, (int, float, str, bytes)):
+        return key, None
+
+    name = type(key).__name__
+    if name not in _KEY_TYPES:
+        raise TypeError(f'Cannot checkpoint a primary key of type {name}')
+
+    return (key.isoformat() if isinstance(key, (datetime.date, datetime.time)) else str(key)), name
+
+def _from_journal_key(value, name):
+
+    return _KEY_TYPES[name](value) if name else value
+
+class CheckpointJournal:
+    '''Progress of a migration in a small local SQLite file: the status of every table (or key range of a table),
+    the last primary key committed into the destination and the number of source rows read.
+    Every write is committed at once, so the journal survives the interrupted run it describes.
+    Watermarks of incremental syncs are kept across runs of the same migration.'''
+
+    def __init__(self, path, migration: str, resume=False):
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)       # Written by the worker threads.
+        self._conn.execute("CREATE TABLE IF NOT EXISTS [Migration] ([Key] TEXT PRIMARY KEY, [Value] TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS [Checkpoint] ([TableName] TEXT NOT NULL, [Part] TEXT NOT NULL, [Status] TEXT NOT NULL, "
+                           "[LastKey], [LastKeyType] TEXT, [RowsRead] INTEGER NOT NULL, [Updated] TEXT, PRIMARY KEY ([TableName], [Part]))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS [Watermark] ([TableName] TEXT PRIMARY KEY, [Strategy] TEXT NOT NULL, [ColumnName] TEXT NOT NULL, "
+                           "[Value], [ValueType] TEXT, [Updated] TEXT)")
+
+        row = self._conn.execute("SELECT [Value] FROM [Migration] WHERE [Key] = 'migration'").fetchone()
+        self.resuming = resume and row is not None and row[0] == migration
+
+        if resume and not self.resuming:
+            print(f'Checkpoint journal {path} does not describe this migration; starting over.')
+
+        if row is None or row[0] != migration:
+            self._conn.execute("DELETE FROM [Watermark]")
+
+        if not self.resuming:
+            self._conn.execute("DELETE FROM [Checkpoint]")
+            self._conn.execute("DELETE FROM [Migration]")
+            self._conn.execute("INSERT INTO [Migration] ([Key], [Value]) VALUES ('migration', ?)", (migration, ))
+
+    def get(self, table, part=WHOLE_TABLE):
+
+        with self._lock:
+            row = self._conn.execute("SELECT [TableName], [Part], [Status], [LastKey], [LastKeyType], [RowsRead] FROM [Checkpoint] WHERE [TableName] = ? AND [Part] = ?",
+                                     (table, part)).fetchone()
+
+        if not row:
+            return None
+
+        return Checkpoint(row[0], row[1], row[2], _from_journal_key(row[3], row[4]), row[5])
+
+    def is_done(self, table, part=WHOLE_TABLE) -> bool:
+
+        checkpoint = self.get(table, part)
+
+        return checkpoint is not None and checkpoint.STATUS == DONE
+
+    def save(self, table, last_key, rows_read, part=WHOLE_TABLE):
+        '''Records that every source row up to last_key (or the first rows_read rows, for tables without a primary key) is committed.'''
+        self._write(table, part, PARTIAL, last_key, rows_read)
+
+    def complete(self, table, rows_read, part=WHOLE_TABLE):
+
+        self._write(table, part, DONE, None, rows_read)
+
+    def _write(self, table, part, status, last_key, rows_read):
+
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO [Checkpoint] ([TableName], [Part], [Status], [LastKey], [LastKeyType], [RowsRead], [Updated]) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (table, part, status, *_to_journal_key(last_key), rows_read, datetime.datetime.now().isoformat()))
+
+    def is_step_done(self, step) -> bool:
+        '''Steps are the parts of a migration other than table data, e.g. 'schema' and 'constraints'.'''
+        with self._lock:
+            row = self._conn.execute("SELECT [Value] FROM [Migration] WHERE [Key] = ?", (f'step:{step}', )).fetchone()
+
+        return row is not None and row[0] == DONE
+
+    def mark_step_done(self, step):
+
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO [Migration] ([Key], [Value]) VALUES (?, ?)", (f'step:{step}', DONE))
+
+    def get_watermark(self, table):
+
+        with self._lock:
+            row = self._conn.execute("SELECT [TableName], [Strategy], [ColumnName], [Value], [ValueType] FROM [Watermark] WHERE [TableName] = ?", (table, )).fetchone()
+
+        if not row:
+            return None
+
+        return Watermark(row[0], row[1], row[2], _from_journal_key(row[3], row[4]))
+
+    def save_watermark(self, table, strategy, column, value):
+        '''Records that every source row of table up to value of column is in the destination.'''
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO [Watermark] ([TableName], [Strategy], [ColumnName], [Value], [ValueType], [Updated]) VALUES (?, ?, ?, ?, ?, ?)",
+                               (table, strategy, column, *_to_journal_key(value), datetime.datetime.now().isoformat()))
+
+    def close(self):
+
+        self._conn.close()
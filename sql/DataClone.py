@@ -1,88 +1,658 @@
 import codecs
-import pymssql
+import contextlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sql.CheckpointJournal import part_name, WHOLE_TABLE, PARTIAL, DONE
+from sql.DeferredTables import DeferredTables
+from sql.Interfaces import Checkpoint
+from sql.converters import build_batch_converter, get_converter, SQLITE, SQLSERVER
+from sql.lobs import plan_lob_columns, copy_large_values, DEFAULT_LOB_INLINE_LIMIT
+from sql.metrics import get_metrics
+from sql.scheduling import build_dependency_graph, run_in_dependency_order, iter_concurrently, run_pipeline
 
 from sql.sqlite import connectionimpl as sqlite_connection
 from sql.sqlite import schemaimpl as sqlite_schema
 from sql.sqlite import dataimpl as sqlite_data
 
 from sql.sqlserver import connectionimpl as sqlserver_connection
+from sql.sqlserver.connectionimpl import pymssql
 from sql.sqlserver import schemaimpl as sqlserver_schema
 from sql.sqlserver import dataimpl as sqlserver_data
 
-class DataClone:
+class _WorkerConnections:
+    '''One (source, destination) connection pair per worker thread, opened on first use and closed together.'''
+    
+    def __init__(self, connect, close):
+        
+        self._connect = connect
+        self._close = close
+        self._local = threading.local()
+        self._pairs = []
+        self._lock = threading.Lock()
+    
+    def get(self):
+        
+        pair = getattr(self._local, 'pair', None)
+        if pair is None:
+            pair = self._local.pair = self._connect()
+            with self._lock:
+                self._pairs.append(pair)
+        
+        return pair
+    
+    def close_all(self):
+        
+        for pair in self._pairs:
+            self._close(*pair)
+        self._pairs.clear()
+
+class _TableCheckpoints:
+    '''Progress of one table (and of its key ranges), kept in memory and written to the CheckpointJournal when there is one.
+    Resumes from the journal of an interrupted run, or from the positions of an earlier, deferred attempt in this run.'''
+    
+    def __init__(self, journal, table, pk, source_columns, dest_columns, dest_dialect, resume_from=None):
+        
+        self._journal = journal
+        self._table = table
+        self._pk = pk
+        self._resume_from = resume_from     # Part -> Checkpoint, from DeferredTables.
+        self.enabled = journal is not None      # Keys are checkpointed, which needs rows read in primary key order.
+        self._key_index = None
+        self._to_dest_key = None
+        self._offsets = {}      # Part -> rows read by earlier runs or attempts.
+        self._positions = {}    # Part -> Checkpoint of the last commit.
+        
+        names = [column.COLUMN_NAME for column in source_columns]
+        if self.enabled and pk and pk in names:
+            self._key_index = names.index(pk)
+            dest_types = {column.COLUMN_NAME: column.DATA_TYPE for column in dest_columns}
+            self._to_dest_key = get_converter(source_columns[self._key_index].DATA_TYPE, dest_types.get(pk), dest_dialect)
+    
+    def _is_resuming(self) -> bool:
+        
+        return self._resume_from is not None or bool(self._journal and self._journal.resuming)
+    
+    def _get(self, part):
+        
+        if self._resume_from is not None:
+            return self._resume_from.get(part)
+        
+        return self._journal.get(self._table, part)
+    
+    def is_done(self) -> bool:
+        
+        return bool(self._journal and self._journal.resuming and self._journal.is_done(self._table))
+    
+    def is_partial(self) -> bool:
+        '''True when an earlier run or attempt copied part of the table as one stream; it is continued the same way.'''
+        if not self._is_resuming():
+            return False
+        
+        checkpoint = self._get(WHOLE_TABLE)
+        
+        return checkpoint is not None and checkpoint.STATUS == PARTIAL
+    
+    def positions(self) -> dict:
+        '''Part -> Checkpoint of everything committed so far; what a later attempt resumes from.'''
+        return dict(self._positions)
+    
+    def _dest_key(self, key):
+        
+        return self._to_dest_key(key) if self._to_dest_key and key is not None else key
+    
+    def resume(self, data_dest, conn_dest, key_range=None) -> tuple:
+        '''(skip, after_key, offset) to continue key_range, or the whole table, from its last checkpoint. Destination rows
+        committed after that checkpoint are deleted first, so nothing is inserted twice.'''
+        part = part_name(key_range)
+        self._offsets[part] = 0
+        
+        if not self._is_resuming():
+            return False, None, 0
+        
+        checkpoint = self._get(part)
+        dest_range = tuple(map(self._dest_key, key_range)) if key_range else None
+        
+        if checkpoint is None:
+            if self._key_index is not None or not key_range:
+                data_dest.delete_rows(conn_dest, self._table, dest_range, pk=self._pk)
+            return False, None, 0
+        
+        self._positions[part] = checkpoint
+        if checkpoint.STATUS == DONE:
+            return True, None, 0
+        
+        self._offsets[part] = checkpoint.ROWS_READ
+        if checkpoint.LAST_KEY is not None:
+            data_dest.delete_rows(conn_dest, self._table, dest_range, self._dest_key(checkpoint.LAST_KEY), pk=self._pk)
+            return False, checkpoint.LAST_KEY, 0
+        
+        # Without a checkpointed key the position is the number of source rows read, relying on the scan order being repeatable.
+        return False, None, checkpoint.ROWS_READ
+    
+    def save(self, key_range, rows_read, last_row):
+        '''Records the commit of the first rows_read rows read by this attempt from key_range, the last being last_row.'''
+        part = part_name(key_range)
+        rows_read += self._offsets.get(part, 0)
+        last_key = last_row[self._key_index] if self._key_index is not None else None
+        self._positions[part] = Checkpoint(self._table, part, PARTIAL, last_key, rows_read)
+        
+        if self._journal:
+            self._journal.save(self._table, last_key, rows_read, part)
+    
+    def _rows_read(self, part) -> int:
+        
+        position = self._positions.get(part)
+        
+        return position.ROWS_READ if position else self._offsets.get(part, 0)
     
-    def sqlserver_to_sqlite(sqlserver_name, sqlserver_database, sqlite_path):
+    def complete(self, key_range=None):
+        
+        part = part_name(key_range)
+        rows_read = self._rows_read(part)
+        self._positions[part] = Checkpoint(self._table, part, DONE, None, rows_read)
+        
+        if self._journal:
+            self._journal.complete(self._table, rows_read, part)
+    
+    def complete_table(self):
+        
+        if self._journal:
+            self._journal.complete(self._table, sum(position.ROWS_READ for part, position in self._positions.items() if part != WHOLE_TABLE))
+
+class _CommitTracker:
+    '''Feeds converted (key_range, rows, last_row) batches, of one key range or interleaved from several, to a streaming
+    writer as one stream of rows and turns its on_commit(rows_read, last_row) calls into checkpoints of the last source
+    row committed from each range; converted rows may carry keys in the destination's representation.'''
+    
+    def __init__(self, checkpoints):
+        
+        self._checkpoints = checkpoints
+        self._batches = deque()     # (rows read once the batch is written, its key range, rows read from that range, its last source row)
+        self._rows_read = 0
+        self._range_rows = {}       # Key range -> rows read from it.
+    
+    def rows(self, items):
+        
+        for key_range, rows, last_row in items:
+            self._rows_read += len(rows)
+            self._range_rows[key_range] = self._range_rows.get(key_range, 0) + len(rows)
+            self._batches.append((self._rows_read, key_range, self._range_rows[key_range], last_row))
+            yield from rows
+    
+    def on_commit(self, rows_read, last_row):
+        
+        committed = {}
+        while self._batches and self._batches[0][0] <= rows_read:
+            _, key_range, range_rows, last_source_row = self._batches.popleft()
+            committed[key_range] = (range_rows, last_source_row)
+        
+        # A commit inside a batch is checkpointed at the end of the previous one.
+        for key_range, (range_rows, last_source_row) in committed.items():
+            self._checkpoints.save(key_range, range_rows, last_source_row)
+
+def _skip_rows(batches, offset):
+    '''Drops the first offset rows of a stream of row batches.'''
+    for rows in batches:
+        if offset >= len(rows):
+            offset -= len(rows)
+            continue
         
-        conn_src = sqlserver_connection.get_trusted_connection(sqlserver_name, sqlserver_database)
-        conn_dest = sqlite_connection.get_connection(sqlite_path)
+        yield rows[offset:] if offset else rows
+        offset = 0
+
+DEFAULT_PARTITIONS = 4
+DEFAULT_PARTITION_THRESHOLD = 1000000      # Tables with more rows are copied as concurrent primary key ranges.
+
+class DataClone:
+    
+    def sqlserver_to_sqlite(sqlserver_name, sqlserver_database, sqlite_path, batch_size=sqlserver_data.DEFAULT_BATCH_SIZE, bulk_load=True, jobs=1,
+                            partitions=DEFAULT_PARTITIONS, partition_threshold=DEFAULT_PARTITION_THRESHOLD, journal=None, 
+                            lob_limit=DEFAULT_LOB_INLINE_LIMIT, subset=None):
+        '''LOB values longer than lob_limit (None: no limit) are streamed in chunks after their rows (sql.lobs).
+        subset (sql.subsetting.Subset) limits the tables, columns and rows copied.'''
+        conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
         
         if not conn_src:
             print(f'Cannot connect into server: {sqlserver_name}, database{sqlserver_database}')
             return
         
-        tables = sqlserver_schema.get_tables(conn_src)
-        for table in tables:
-            rows = sqlserver_data.select_all(conn_src, table)
-            if rows and len(rows) > 0:
-                if sqlite_schema.is_table_exists(conn_dest, table):
-                    num_of_rows = sqlite_data.insert_many(conn_dest, table, rows)
-                    print(f"{num_of_rows} rows inserted into {table}.")
+        conn_dest = sqlite_connection.get_connection(sqlite_path)      # Not pooled: the bulk load pragmas must not outlive the copy.
+        
+        previous_pragmas = None
+        if bulk_load:
+            previous_pragmas = sqlite_connection.enable_bulk_load(conn_dest)
+        
+        def open_source():
+            return sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        
+        staged = []
+        try:
+            tables = [table for table in sqlserver_schema.get_tables(conn_src) if sqlite_schema.is_table_exists(conn_dest, table)]
+            filters = DataClone._plan_subset(subset, tables, sqlserver_schema, sqlserver_data, conn_src, staged)
+            if subset:
+                tables = [table for table in tables if table in filters]
+            
+            if jobs > 1:
+                def connect():
+                    conn_dest = sqlite_connection.get_connection(sqlite_path, check_same_thread=False)     # Closed by the main thread.
+                    sqlite_connection.apply_session_pragmas(conn_dest)      # Waits out the other workers' writes.
+                    if bulk_load:
+                        sqlite_connection.enable_bulk_load(conn_dest)
+                    return open_source(), conn_dest
+                
+                def close(conn_src, conn_dest):
+                    sqlserver_connection.release_connection(conn_src)
+                    sqlite_connection.close_connection(conn_dest)
+                
+                write_lock = threading.Lock()       # SQLite allows one writer at a time; workers overlap their reads.
+                workers = _WorkerConnections(connect, close)
                 
+                def task(table):
+                    return DataClone._copy_table_to_sqlite(*workers.get(), table, batch_size, write_lock, open_source, partitions, partition_threshold, journal, 
+                                                           lob_limit, filters.get(table))
+                
+                graph = build_dependency_graph(tables, lambda table: sqlserver_schema.get_foreign_keys(conn_src, table))
+                try:
+                    run_in_dependency_order(graph, task, jobs)
+                finally:
+                    workers.close_all()
+            else:
+                for table in tables:
+                    DataClone._copy_table_to_sqlite(conn_src, conn_dest, table, batch_size, None, open_source, partitions, partition_threshold, journal, lob_limit, 
+                                                    filters.get(table))
+        finally:
+            if previous_pragmas:
+                sqlite_connection.disable_bulk_load(conn_dest, previous_pragmas)
+            if staged:
+                sqlserver_data.drop_staged_keys(conn_src, staged)
+            sqlserver_connection.release_connection(conn_src)
+            sqlite_connection.close_connection(conn_dest)
     
-    def sqlite_to_sqlserver(sqlite_path, sqlserver_name, sqlserver_database):
+    @staticmethod
+    def _plan_key_ranges(data, conn, table, partitions, partition_threshold):
+        '''Primary key ranges to copy concurrently, or None when table is small or cannot be split.'''
+        if partitions < 2 or data.count_rows(conn, table) < partition_threshold:
+            return None
+        
+        key_ranges = data.get_key_ranges(conn, table, partitions)
+        if not key_ranges or len(key_ranges) < 2:
+            return None
+        
+        return key_ranges
+    
+    @staticmethod
+    def _plan_subset(subset, tables, schema, data, conn_src, staged) -> dict:
+        '''{table: Table_Filter} of the tables subset copies, or {} without a subset. The names of the tables keys are
+        staged in are added to staged, to be dropped with data.drop_staged_keys once the copy ends.'''
+        if not subset:
+            return {}
+        
+        def stage_keys(table, columns, condition):
+            name = data.stage_keys(conn_src, table, columns, condition)
+            staged.append(name)
+            return name
+        
+        with get_metrics().timed(None, 'metadata'):
+            filters = subset.plan(tables, lambda table: schema.get_foreign_keys(conn_src, table), lambda table: schema.get_primary_key(conn_src, table), 
+                                  lambda table: schema.get_columns(conn_src, table), data.build_key_hash, stage_keys)
+        print(f"Subset: {len(filters)} of {len(tables)} tables.")
+        
+        return filters
+    
+    @staticmethod
+    def _plan_lobs(source_columns, source_pk, source_dialect, dest_columns, dest_pk, dest_dialect, lob_limit, table_filter=None) -> tuple:
+        '''LOB columns to stream (sql.lobs.plan_lob_columns), found by the primary key; none when the destination has no
+        primary key yet to find the rows by, e.g. tables whose keys are built after the load. Omitted columns are left out.'''
+        if lob_limit is None or not source_pk or source_pk != dest_pk:
+            return ()
+        
+        lob_columns = plan_lob_columns(source_columns, source_dialect, dest_columns, dest_dialect, source_pk)
+        if table_filter:
+            lob_columns = tuple((name, is_text) for name, is_text in lob_columns if name not in table_filter.OMITTED_COLUMNS)
+        
+        return lob_columns
+    
+    @staticmethod
+    def _copy_table_to_sqlite(conn_src, conn_dest, table, batch_size, write_lock=None, open_source=None, 
+                              partitions=1, partition_threshold=DEFAULT_PARTITION_THRESHOLD, journal=None, lob_limit=None, table_filter=None) -> bool:
+        
+        condition, omitted_columns = (table_filter.CONDITION, table_filter.OMITTED_COLUMNS) if table_filter else (None, ())
+        source_columns = sqlserver_schema.get_columns(conn_src, table)
+        dest_columns = sqlite_schema.get_columns(conn_dest, table)
+        pk = sqlserver_schema.get_primary_key(conn_src, table)
+        checkpoints = _TableCheckpoints(journal, table, pk, source_columns, dest_columns, SQLITE)
+        if checkpoints.is_done():
+            print(f"{table} was copied by an earlier run.")
+            return True
+        
+        metrics = get_metrics()
+        metrics.table_started(table)
+        try:
+            key_ranges = None
+            if open_source and not checkpoints.is_partial():
+                key_ranges = DataClone._plan_key_ranges(sqlserver_data, conn_src, table, partitions, partition_threshold)
+            
+            lob_columns = DataClone._plan_lobs(source_columns, pk, SQLSERVER, dest_columns, sqlite_schema.get_primary_key(conn_dest, table), SQLITE, 
+                                               lob_limit, table_filter)
+            lob_names = [name for name, is_text in lob_columns]
+            
+            def read(conn, key_range, after_key, offset):
+                for rows in _skip_rows(sqlserver_data.iter_rows(conn, table, batch_size, key_range, after_key, ordered=checkpoints.enabled, 
+                                                                lob_columns=lob_names, lob_limit=lob_limit, condition=condition, 
+                                                                omitted_columns=omitted_columns), offset):
+                    yield key_range, rows
+            
+            if key_ranges:
+                # Ranges are read concurrently, each on its own connection, and written by this thread alone.
+                def reader(key_range, after_key, offset):
+                    def read_range():
+                        conn = open_source()
+                        try:
+                            yield from read(conn, key_range, after_key, offset)
+                        finally:
+                            sqlserver_connection.release_connection(conn)
+                    return read_range
+                
+                readers = []
+                for key_range in key_ranges:
+                    with write_lock or contextlib.nullcontext():       # Resuming deletes the rows written after the checkpoint.
+                        skip, after_key, offset = checkpoints.resume(sqlite_data, conn_dest, key_range)
+                    if not skip:
+                        readers.append(reader(key_range, after_key, offset))
+                
+                batches = iter_concurrently(readers, queue_size=2 * len(readers)) if readers else ()
+            else:
+                with write_lock or contextlib.nullcontext():
+                    skip, after_key, offset = checkpoints.resume(sqlite_data, conn_dest)
+                batches = read(conn_src, None, after_key, offset)
+            
+            convert_rows = build_batch_converter(source_columns, dest_columns, SQLITE)
+            
+            def convert(item):
+                key_range, rows = item
+                return key_range, convert_rows(rows), rows[-1]
+            
+            num_of_rows = 0
+            tracker = _CommitTracker(checkpoints)
+            
+            def write(items):
+                # One stream of rows, so the writer's batch sizes are not bounded by the batches read. The lock is taken
+                # per batch written, leaving the other workers to write while this one waits for rows.
+                nonlocal num_of_rows
+                num_of_rows = sqlite_data.insert_batched(conn_dest, table, tracker.rows(items), batch_size, on_commit=tracker.on_commit, 
+                                                         lock=write_lock)
+            
+            timings = run_pipeline(batches, convert, write)
+            metrics.add_seconds(table, 'read', timings.read)
+            metrics.add_seconds(table, 'convert', timings.convert)
+            
+            if lob_columns:
+                with write_lock or contextlib.nullcontext(), metrics.timed(table, 'write'):
+                    num_of_values = copy_large_values(sqlserver_data, conn_src, sqlite_data, conn_dest, table, lob_columns, pk, lob_limit, 
+                                                      condition=condition)
+                if num_of_values:
+                    print(f"{num_of_values} large values streamed into {table}.")
+            
+            for key_range in key_ranges or (None, ):
+                checkpoints.complete(key_range)
+            if key_ranges:
+                checkpoints.complete_table()
+            
+            if num_of_rows > 0:
+                print(f"{num_of_rows} rows inserted into {table}. {timings}")
+        finally:
+            metrics.table_finished(table)
         
-        conn_src = sqlite_connection.get_connection(sqlite_path)
-        conn_dest = sqlserver_connection.get_trusted_connection(sqlserver_name, sqlserver_database)
+        return True
+    
+    def sqlite_to_sqlserver(sqlite_path, sqlserver_name, sqlserver_database, batch_size=sqlite_data.DEFAULT_BATCH_SIZE,
+                            commit_every=sqlserver_data.DEFAULT_COMMIT_EVERY, one_by_one=False, jobs=1,
+                            partitions=DEFAULT_PARTITIONS, partition_threshold=DEFAULT_PARTITION_THRESHOLD, journal=None,
+                            bulk_copy_tables=(), bulk_copy_threshold=sqlserver_data.DEFAULT_BULK_COPY_THRESHOLD, tablock=False, 
+                            lob_limit=DEFAULT_LOB_INLINE_LIMIT, subset=None):
+        '''Tables named in bulk_copy_tables, or with at least bulk_copy_threshold rows (None: never), are loaded through bulk copy.
+        LOB values longer than lob_limit (None: no limit) are streamed in chunks after their rows (sql.lobs).
+        subset (sql.subsetting.Subset) limits the tables, columns and rows copied.'''
+        conn_src = sqlite_connection.acquire_connection(sqlite_path)      # Read by the pipeline's reader thread.
         
         if not conn_src:
             print(f'Cannot connect into source Sqlite database: {sqlite_path}')
             return
         
-        tables = sqlite_schema.get_tables(conn_src)
-        for table in tables:
-            rows = sqlite_data.select_all(conn_src, table)
-            if rows and len(rows) > 0:
-                if sqlserver_schema.is_table_exists(conn_dest, table):
-                    
-                    try:
-                        sqlserver_schema.enable_identity_insert(conn_dest, table, True)
-                        num_of_rows = sqlserver_data.insert_one_by_one(conn_dest, table, rows)
-                        # num_of_rows = sqlserver_data.insert_many(conn_dest, table, rows)
-                        print(f"{num_of_rows} rows inserted into {table}.")
-                        sqlserver_schema.enable_identity_insert(conn_dest, table, False)
-                    
-                    except pymssql.exceptions.OperationalError as o_error:
-                        msg = codecs.decode(o_error.args[1])
-                        print(msg)
-                        
-                        match o_error.args[0]:
-                            case 173:
-                                # (173, b"The definition for column 'Data' must include a data type.DB-Lib error message 20018, severity 15:\nGeneral SQL Server error: Check messages from the SQL Server\n")
-                                break
-                            case 545:
-                                sqlserver_data.CREATION_DEQUE.append((table, rows), )
-                                # (545, b"Explicit value must be specified for identity column in table 'CurrencyMovement' either when IDENTITY_INSERT is set to ON or when a replication user is inserting into a NOT FOR REPLICATION identity column.DB-Lib error message 20018, severity 16:\n
-                            case 1767:
-                                # (1767, b"Foreign key 'None' references invalid table 'dbo.Publisher'.DB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\nDB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\n")
-                                sqlserver_data.CREATION_DEQUE.append((table, rows), )
-                                continue
-                            case 2714:
-                                # (2714, b"There is already an object named 'None' in the database.DB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\nDB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\n")
-                                continue
-                            case 3902:
-                                # ("Cannot commit transaction: (3902, b'The COMMIT TRANSACTION request has no corresponding BEGIN TRANSACTION.DB-Lib error message 20018, severity 16:\\nGeneral SQL Server error: Check messages from the SQL Server\\n')",)
-                                break
-                            case _:
-                                break
-                        
-                    except pymssql.exceptions.ProgrammingError as p_error:
-                        # sqlserver.CREATION_DEQUE.append((build_create_script, table), )
-                        print(p_error)
-                        # if p_error.args[0] > 0:
-                        #     pass
-                        
-                    except pymssql.exceptions.IntegrityError as i_error:
-                        print(i_error)
-                        
-                    except Exception as error:
-                        print(error)
+        conn_dest = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        
+        def connect():
+            return (sqlite_connection.acquire_connection(sqlite_path), 
+                    sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database))
+        
+        staged = []
+        try:
+            tables = [table for table in sqlite_schema.get_tables(conn_src) if sqlserver_schema.is_table_exists(conn_dest, table)]
+            filters = DataClone._plan_subset(subset, tables, sqlite_schema, sqlite_data, conn_src, staged)
+            if subset:
+                tables = [table for table in tables if table in filters]
+            graph = build_dependency_graph(tables, lambda table: sqlite_schema.get_foreign_keys(conn_src, table))
+            deferred = DeferredTables()
+            
+            def copy(conn_src, conn_dest, table, resume_from=None):
+                return DataClone._copy_table_to_sqlserver(conn_src, conn_dest, table, batch_size, commit_every, one_by_one, 
+                                                          connect, partitions, partition_threshold, journal, 
+                                                          bulk_copy_tables, bulk_copy_threshold, tablock, deferred, resume_from, lob_limit, 
+                                                          filters.get(table))
+            
+            if jobs > 1:
+                workers = _WorkerConnections(connect, DataClone._release)
+                
+                # Foreign keys are added by SchemaClone.sqlite_to_sqlserver_add_constraints after the load, which validates them.
+                try:
+                    run_in_dependency_order(graph, lambda table: copy(*workers.get(), table), jobs)
+                finally:
+                    workers.close_all()
+            else:
+                for table in tables:
+                    if not copy(conn_src, conn_dest, table):
+                        break
+            
+            # Deferred tables are retried, referenced tables first, for as long as a pass gets at least one of them through.
+            while len(deferred):
+                retried = deferred.pop_all(graph)
+                for table, positions in retried:
+                    copy(conn_src, conn_dest, table, positions)
+                
+                if deferred.errors().keys() == {table for table, positions in retried}:
+                    print(f"Tables not copied: {deferred.errors()}")
+                    break
+            
+        finally:
+            if staged:
+                sqlite_data.drop_staged_keys(conn_src, staged)
+            DataClone._release(conn_src, conn_dest)
+    
+    @staticmethod
+    def _release(conn_src, conn_dest):
+        '''Returns a pooled (SQLite, SQL Server) connection pair.'''
+        sqlite_connection.release_connection(conn_src)
+        sqlserver_connection.release_connection(conn_dest)
+    
+    @staticmethod
+    def _use_bulk_copy(conn_src, table, bulk_copy_tables, bulk_copy_threshold) -> bool:
+        
+        if table in bulk_copy_tables:
+            return True
+        
+        return bulk_copy_threshold is not None and sqlite_data.count_rows(conn_src, table) >= bulk_copy_threshold
+    
+    @staticmethod
+    def _write_to_sqlserver(conn_dest, table, rows, batch_size, commit_every, source_columns, on_commit, bulk_copy=False, tablock=False) -> int:
+        '''Bulk copy keeps identity values by itself; the batched writer needs IDENTITY_INSERT around it.'''
+        if bulk_copy:
+            return sqlserver_data.insert_bulk(conn_dest, table, rows, batch_size, commit_every, tablock, source_columns, on_commit)
+        
+        sqlserver_schema.enable_identity_insert(conn_dest, table, True)
+        num_of_rows = sqlserver_data.insert_batched(conn_dest, table, rows, batch_size, commit_every, source_columns=source_columns, on_commit=on_commit)
+        sqlserver_schema.enable_identity_insert(conn_dest, table, False)
+        
+        return num_of_rows
+    
+    @staticmethod
+    def _pipe_to_sqlserver(conn_dest, table, batches, source_columns, batch_size, commit_every, checkpoints, key_range=None, 
+                           bulk_copy=False, tablock=False) -> tuple:
+        '''Writes batches of SQLite rows through a read/convert/write pipeline. Returns (rows written, StageTimings).'''
+        convert_rows = build_batch_converter(source_columns, sqlserver_schema.get_columns(conn_dest, table), SQLSERVER)
+        tracker = _CommitTracker(checkpoints)
+        num_of_rows = 0
+        
+        def write(items):
+            nonlocal num_of_rows
+            num_of_rows = DataClone._write_to_sqlserver(conn_dest, table, tracker.rows(items), batch_size, commit_every, None, tracker.on_commit, 
+                                                        bulk_copy, tablock)
+        
+        timings = run_pipeline(batches, lambda rows: (key_range, convert_rows(rows), rows[-1]), write)
+        get_metrics().add_seconds(table, 'read', timings.read)
+        get_metrics().add_seconds(table, 'convert', timings.convert)
+        
+        return num_of_rows, timings
+    
+    @staticmethod
+    def _copy_range_to_sqlserver(connect, table, key_range, batch_size, commit_every, checkpoints, bulk_copy=False, tablock=False, 
+                                 lob_names=(), lob_limit=None, condition=None, omitted_columns=()) -> int:
+        
+        conn_src, conn_dest = connect()
+        try:
+            skip, after_key, offset = checkpoints.resume(sqlserver_data, conn_dest, key_range)
+            if skip:
+                return 0
+            
+            batches = _skip_rows(sqlite_data.iter_rows(conn_src, table, batch_size, key_range, after_key, ordered=checkpoints.enabled, 
+                                                       lob_columns=lob_names, lob_limit=lob_limit, condition=condition, 
+                                                       omitted_columns=omitted_columns), offset)
+            num_of_rows, timings = DataClone._pipe_to_sqlserver(conn_dest, table, batches, sqlite_schema.get_columns(conn_src, table), batch_size, commit_every, 
+                                                                checkpoints, key_range, bulk_copy, tablock)
+            checkpoints.complete(key_range)
+            print(f"{table} [{key_range[0]}..{key_range[1]}]: {timings}")
+            return num_of_rows
+        finally:
+            DataClone._release(conn_src, conn_dest)
+    
+    @staticmethod
+    def _copy_table_to_sqlserver(conn_src, conn_dest, table, batch_size, commit_every, one_by_one, 
+                                 connect=None, partitions=1, partition_threshold=DEFAULT_PARTITION_THRESHOLD, journal=None, 
+                                 bulk_copy_tables=(), bulk_copy_threshold=None, tablock=False, deferred=None, resume_from=None, 
+                                 lob_limit=None, table_filter=None) -> bool:
+        '''Returns False when the error means the remaining tables should not be copied. Tables failing with an error
+        another table's copy may clear are handed to deferred with their position; resume_from continues such a table.'''
+        checkpoints = None
+        condition, omitted_columns = (table_filter.CONDITION, table_filter.OMITTED_COLUMNS) if table_filter else (None, ())
+        metrics = get_metrics()
+        metrics.table_started(table)
+        try:
+            source_columns = sqlite_schema.get_columns(conn_src, table)
+            dest_columns = sqlserver_schema.get_columns(conn_dest, table)
+            pk = sqlite_schema.get_primary_key(conn_src, table)
+            checkpoints = _TableCheckpoints(journal, table, pk, source_columns, dest_columns, SQLSERVER, resume_from)
+            if checkpoints.is_done():
+                print(f"{table} was copied by an earlier run.")
+                return True
+            
+            lob_columns = DataClone._plan_lobs(source_columns, pk, SQLITE, dest_columns, sqlserver_schema.get_primary_key(conn_dest, table), SQLSERVER, 
+                                               lob_limit, table_filter)
+            lob_names = [name for name, is_text in lob_columns]
+            
+            def copy_lobs():
+                if lob_columns:
+                    with metrics.timed(table, 'write'):
+                        num_of_values = copy_large_values(sqlite_data, conn_src, sqlserver_data, conn_dest, table, lob_columns, pk, lob_limit, 
+                                                          condition=condition)
+                    if num_of_values:
+                        print(f"{num_of_values} large values streamed into {table}.")
+            
+            bulk_copy = not one_by_one and DataClone._use_bulk_copy(conn_src, table, bulk_copy_tables, bulk_copy_threshold)
+            key_ranges = None
+            if connect and not one_by_one and not checkpoints.is_partial():
+                key_ranges = DataClone._plan_key_ranges(sqlite_data, conn_src, table, partitions, partition_threshold)
+            
+            if key_ranges:
+                # Every range gets its own connection pair and is written concurrently.
+                with ThreadPoolExecutor(max_workers=len(key_ranges)) as executor:
+                    num_of_rows = sum(executor.map(lambda key_range: DataClone._copy_range_to_sqlserver(connect, table, key_range, batch_size, commit_every, checkpoints, 
+                                                                                                        bulk_copy, tablock, lob_names, lob_limit, 
+                                                                                                        condition, omitted_columns), 
+                                                   key_ranges))
+                copy_lobs()
+                checkpoints.complete_table()
+                if num_of_rows > 0:
+                    print(f"{num_of_rows} rows inserted into {table} in {len(key_ranges)} key ranges.")
+                return True
+            
+            skip, after_key, offset = checkpoints.resume(sqlserver_data, conn_dest)
+            batches = _skip_rows(sqlite_data.iter_rows(conn_src, table, batch_size, after_key=after_key, ordered=checkpoints.enabled, 
+                                                       lob_columns=lob_names, lob_limit=lob_limit, condition=condition, 
+                                                       omitted_columns=omitted_columns), offset)
+            
+            num_of_rows = 0
+            timings = None
+            if one_by_one:      # Slow fallback: one statement and one commit per row.
+                sqlserver_schema.enable_identity_insert(conn_dest, table, True)
+                rows_read = 0
+                for rows in batches:
+                    num_of_rows += sqlserver_data.insert_one_by_one(conn_dest, table, rows, source_columns=source_columns)
+                    rows_read += len(rows)
+                    checkpoints.save(None, rows_read, rows[-1])
+                sqlserver_schema.enable_identity_insert(conn_dest, table, False)
+            else:
+                num_of_rows, timings = DataClone._pipe_to_sqlserver(conn_dest, table, batches, source_columns, batch_size, commit_every, checkpoints, 
+                                                                    None, bulk_copy, tablock)
+            if num_of_rows > 0:
+                print(f"{num_of_rows} rows {'bulk copied' if bulk_copy else 'inserted'} into {table}." + (f" {timings}" if timings else ""))
+            copy_lobs()
+            checkpoints.complete()
+        
+        except pymssql.exceptions.OperationalError as o_error:
+            msg = codecs.decode(o_error.args[1])
+            print(msg)
+            metrics.error(table, msg)
+            
+            match o_error.args[0]:
+                case 173:
+                    # (173, b"The definition for column 'Data' must include a data type.DB-Lib error message 20018, severity 15:\nGeneral SQL Server error: Check messages from the SQL Server\n")
+                    return False
+                case 545:
+                    if deferred is not None:
+                        deferred.defer(table, 545, checkpoints.positions() if checkpoints else {})
+                        metrics.retry(table, 545)
+                    # (545, b"Explicit value must be specified for identity column in table 'CurrencyMovement' either when IDENTITY_INSERT is set to ON or when a replication user is inserting into a NOT FOR REPLICATION identity column.DB-Lib error message 20018, severity 16:\n
+                case 1767:
+                    # (1767, b"Foreign key 'None' references invalid table 'dbo.Publisher'.DB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\nDB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\n")
+                    if deferred is not None:
+                        deferred.defer(table, 1767, checkpoints.positions() if checkpoints else {})
+                        metrics.retry(table, 1767)
+                case 2714:
+                    # (2714, b"There is already an object named 'None' in the database.DB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\nDB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\n")
+                    pass
+                case 3902:
+                    # ("Cannot commit transaction: (3902, b'The COMMIT TRANSACTION request has no corresponding BEGIN TRANSACTION.DB-Lib error message 20018, severity 16:\\nGeneral SQL Server error: Check messages from the SQL Server\\n')",)
+                    return False
+                case _:
+                    return False
+        
+        except pymssql.exceptions.ProgrammingError as p_error:
+            # sqlserver.CREATION_DEQUE.append((build_create_script, table), )
+            print(p_error)
+            metrics.error(table, p_error)
+            # if p_error.args[0] > 0:
+            #     pass
+        
+        except pymssql.exceptions.IntegrityError as i_error:
+            print(i_error)
+            metrics.error(table, i_error)
+        
+        except Exception as error:
+            print(error)
+            metrics.error(table, error)
+        
+        finally:
+            metrics.table_finished(table)
+        
+        return True
@@ -0,0 +1,150 @@
+import os
+
+from sql.converters import SQLITE, SQLSERVER
+from sql.metrics import get_metrics
+from sql.scheduling import build_dependency_graph, dependency_order
+from sql.snapshots import SnapshotWriter, SnapshotReader, snapshot_path, list_snapshots, DEFAULT_CHUNK_ROWS
+
+from sql.sqlite import connectionimpl as sqlite_connection
+from sql.sqlite import schemaimpl as sqlite_schema
+from sql.sqlite import dataimpl as sqlite_data
+
+from sql.sqlserver import connectionimpl as sqlserver_connection
+from sql.sqlserver import schemaimpl as sqlserver_schema
+from sql.sqlserver import dataimpl as sqlserver_data
+
+class DataSnapshot:
+    '''Offline migration: export writes every table of a database into a snapshot file (sql.snapshots), import loads
+    a directory of them into either database, so extraction and load can run at different times and places.
+    Tables missing from the destination are created from the snapshot headers when the snapshots come from the
+    other database; snapshots of the same database type need the schema in place.'''
+
+    def export_sqlserver(sqlserver_name, sqlserver_database, directory, chunk_rows=DEFAULT_CHUNK_ROWS) -> dict:
+
+        conn = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        if not conn:
+            print(f'Cannot connect into server: {sqlserver_name}, database{sqlserver_database}')
+            return {}
+
+        try:
+            return DataSnapshot._export(sqlserver_schema, sqlserver_data, conn, SQLSERVER, directory, chunk_rows)
+        finally:
+            sqlserver_connection.release_connection(conn)
+
+    def export_sqlite(sqlite_path, directory, chunk_rows=DEFAULT_CHUNK_ROWS) -> dict:
+
+        conn = sqlite_connection.acquire_connection(sqlite_path)
+        if not conn:
+            print(f'Cannot connect into source Sqlite database: {sqlite_path}')
+            return {}
+
+        try:
+            return DataSnapshot._export(sqlite_schema, sqlite_data, conn, SQLITE, directory, chunk_rows)
+        finally:
+            sqlite_connection.release_connection(conn)
+
+    def import_sqlite(directory, sqlite_path, batch_size=sqlite_data.DEFAULT_BATCH_SIZE, bulk_load=True) -> dict:
+
+        conn = sqlite_connection.get_connection(sqlite_path)      # Not pooled: the bulk load pragmas must not outlive the load.
+        previous_pragmas = sqlite_connection.enable_bulk_load(conn) if bulk_load else None
+
+        def create_table(snapshot):
+            if snapshot.dialect != SQLSERVER:
+                return False
+            script = sqlite_schema.build_create_table_script(conn, snapshot.table, snapshot.columns, snapshot.primary_key, snapshot.foreign_keys)
+            sqlite_schema.exec_create_tables(conn, [script])
+            return True
+
+        def load(snapshot, source_columns):
+            rows = (row for chunk in snapshot.iter_chunks() for row in chunk)
+            return sqlite_data.insert_batched(conn, snapshot.table, rows, batch_size, source_columns=source_columns)
+
+        try:
+            return DataSnapshot._import(directory, SQLITE, lambda table: sqlite_schema.is_table_exists(conn, table), create_table, load)
+        finally:
+            if previous_pragmas:
+                sqlite_connection.disable_bulk_load(conn, previous_pragmas)
+            sqlite_connection.close_connection(conn)
+
+    def import_sqlserver(directory, sqlserver_name, sqlserver_database, batch_size=sqlite_data.DEFAULT_BATCH_SIZE,
+                         commit_every=sqlserver_data.DEFAULT_COMMIT_EVERY, bulk_copy_threshold=sqlserver_data.DEFAULT_BULK_COPY_THRESHOLD,
+                         tablock=False) -> dict:
+        '''Snapshots with at least bulk_copy_threshold rows (None: never) are loaded through bulk copy. Foreign keys are
+        not created; SchemaClone.sqlite_to_sqlserver_add_constraints adds them after the load.'''
+        conn = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        if not conn:
+            print(f'Cannot connect into database: {sqlserver_database} in SQL Server: {sqlserver_name}')
+            return {}
+
+        def create_table(snapshot):
+            if snapshot.dialect != SQLITE:
+                return False
+            script = sqlserver_schema.build_create_table_script(snapshot.table, snapshot.columns, snapshot.primary_key, (), build_fk_constraints=False)
+            sqlserver_schema.exec_scripts(conn, [script])
+            return True
+
+        def load(snapshot, source_columns):
+            rows = (row for chunk in snapshot.iter_chunks() for row in chunk)
+            if bulk_copy_threshold is not None and snapshot.num_of_rows >= bulk_copy_threshold:
+                return sqlserver_data.insert_bulk(conn, snapshot.table, rows, batch_size, commit_every, tablock, source_columns)
+
+            sqlserver_schema.enable_identity_insert(conn, snapshot.table, True)
+            num_of_rows = sqlserver_data.insert_batched(conn, snapshot.table, rows, batch_size, commit_every, source_columns=source_columns)
+            sqlserver_schema.enable_identity_insert(conn, snapshot.table, False)
+            return num_of_rows
+
+        try:
+            return DataSnapshot._import(directory, SQLSERVER, lambda table: sqlserver_schema.is_table_exists(conn, table), create_table, load)
+        finally:
+            sqlserver_connection.release_connection(conn)
+
+    @staticmethod
+    def _export(schema, data, conn, dialect, directory, chunk_rows) -> dict:
+        '''Returns the number of rows exported per table.'''
+        os.makedirs(directory, exist_ok=True)
+        metrics = get_metrics()
+        exported = {}
+
+        for table in schema.get_tables(conn):
+            metrics.table_started(table)
+            with SnapshotWriter(snapshot_path(directory, table), table, dialect, schema.get_columns(conn, table),
+                                schema.get_primary_key(conn, table), schema.get_foreign_keys(conn, table)) as writer:
+                for rows in data.iter_rows(conn, table, chunk_rows):
+                    with metrics.batch(table, rows):
+                        writer.write_chunk(rows)
+
+            exported[table] = writer.num_of_rows
+            print(f"{writer.num_of_rows} rows of {table} exported to {writer.path}.")
+            metrics.table_finished(table)
+
+        return exported
+
+    @staticmethod
+    def _import(directory, dialect, is_table_exists, create_table, load) -> dict:
+        '''Loads the snapshots in directory, referenced tables first. Returns the number of rows imported per table.'''
+        snapshots = {}
+        try:
+            for path in list_snapshots(directory):
+                snapshot = SnapshotReader(path)
+                snapshots[snapshot.table] = snapshot
+
+            graph = build_dependency_graph(list(snapshots), lambda table: snapshots[table].foreign_keys)
+            metrics = get_metrics()
+            imported = {}
+
+            for table in dependency_order(graph):
+                snapshot = snapshots[table]
+                if not is_table_exists(table) and not create_table(snapshot):
+                    print(f"{table}: not in the destination; create the schema first.")
+                    continue
+
+                metrics.table_started(table)
+                source_columns = snapshot.columns if snapshot.dialect != dialect else None      # Values already in destination types.
+                imported[table] = load(snapshot, source_columns)
+                print(f"{imported[table]} rows imported into {table} from {snapshot.path}.")
+                metrics.table_finished(table)
+
+            return imported
+        finally:
+            for snapshot in snapshots.values():
+                snapshot.close()
@@ -0,0 +1,103 @@
+from sql.converters import SQLITE, SQLSERVER
+from sql.incremental import choose_watermark, ROWVERSION
+from sql.scheduling import build_dependency_graph, dependency_order
+
+from sql.sqlite import connectionimpl as sqlite_connection
+from sql.sqlite import schemaimpl as sqlite_schema
+from sql.sqlite import dataimpl as sqlite_data
+
+from sql.sqlserver import connectionimpl as sqlserver_connection
+from sql.sqlserver import schemaimpl as sqlserver_schema
+from sql.sqlserver import dataimpl as sqlserver_data
+
+class DataSync:
+    '''Incremental copies into a destination loaded by DataClone: only the rows above each table's watermark (its
+    largest integer key, rowversion or modified-at value at the previous sync) are read, and they are upserted on the
+    primary key. The watermarks are kept in the CheckpointJournal. Deleted rows are not detected; tables without a
+    watermark are copied in full.'''
+
+    def sqlserver_to_sqlite(sqlserver_name, sqlserver_database, sqlite_path, journal, modified_columns=None, batch_size=sqlserver_data.DEFAULT_BATCH_SIZE):
+
+        conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        if not conn_src:
+            print(f'Cannot connect into server: {sqlserver_name}, database{sqlserver_database}')
+            return
+
+        conn_dest = sqlite_connection.acquire_connection(sqlite_path)
+
+        try:
+            tables = [table for table in sqlserver_schema.get_tables(conn_src) if sqlite_schema.is_table_exists(conn_dest, table)]
+            graph = build_dependency_graph(tables, lambda table: sqlserver_schema.get_foreign_keys(conn_src, table))
+
+            for table in dependency_order(graph):
+                DataSync._sync_table(sqlserver_data, conn_src, sqlserver_schema.get_columns(conn_src, table), sqlserver_schema.get_primary_key(conn_src, table), SQLSERVER,
+                                     sqlite_data, conn_dest, table, journal, (modified_columns or {}).get(table), batch_size)
+        finally:
+            sqlserver_connection.release_connection(conn_src)
+            sqlite_connection.release_connection(conn_dest)
+
+    def sqlite_to_sqlserver(sqlite_path, sqlserver_name, sqlserver_database, journal, modified_columns=None, batch_size=sqlite_data.DEFAULT_BATCH_SIZE):
+
+        conn_src = sqlite_connection.acquire_connection(sqlite_path)
+        if not conn_src:
+            print(f'Cannot connect into source Sqlite database: {sqlite_path}')
+            return
+
+        conn_dest = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+
+        try:
+            tables = [table for table in sqlite_schema.get_tables(conn_src) if sqlserver_schema.is_table_exists(conn_dest, table)]
+            graph = build_dependency_graph(tables, lambda table: sqlite_schema.get_foreign_keys(conn_src, table))
+
+            for table in dependency_order(graph):
+                DataSync._sync_table(sqlite_data, conn_src, sqlite_schema.get_columns(conn_src, table), sqlite_schema.get_primary_key(conn_src, table), SQLITE,
+                                     sqlserver_data, conn_dest, table, journal, (modified_columns or {}).get(table), batch_size)
+        finally:
+            sqlite_connection.release_connection(conn_src)
+            sqlserver_connection.release_connection(conn_dest)
+
+    @staticmethod
+    def _get_upper_bound(data_src, conn_src, table, strategy, column):
+
+        if strategy == ROWVERSION:
+            return data_src.get_max_value(conn_src, table, column, rowversion=True)
+
+        return data_src.get_max_value(conn_src, table, column)
+
+    @staticmethod
+    def _sync_table(data_src, conn_src, source_columns, pk, source_dialect, data_dest, conn_dest, table, journal,
+                    modified_column=None, batch_size=sqlite_data.DEFAULT_BATCH_SIZE) -> int:
+        '''Upserts the rows of table changed since its watermark and moves the watermark. Returns the number of rows written.'''
+        strategy, column = choose_watermark(source_columns, pk, modified_column, source_dialect)
+
+        if not pk:
+            # Nothing to upsert on: the table is reloaded.
+            data_dest.delete_rows(conn_dest, table)
+            rows = (row for rows in data_src.iter_rows(conn_src, table, batch_size) for row in rows)
+            num_of_rows = data_dest.insert_batched(conn_dest, table, rows, batch_size, source_columns=source_columns)
+            print(f"{table}: no primary key, {num_of_rows} rows reloaded.")
+            return num_of_rows
+
+        # The upper bound is read before the rows, so rows written during the sync are left for the next one.
+        high = DataSync._get_upper_bound(data_src, conn_src, table, strategy, column) if strategy else None
+
+        watermark = journal.get_watermark(table)
+        low = None
+        if watermark and (watermark.STRATEGY, watermark.COLUMN_NAME) == (strategy, column):
+            low = watermark.VALUE
+
+        if (strategy and high is None) or (low is not None and high is not None and high <= low):
+            print(f"{table}: up to date.")
+            return 0
+
+        key_range = (low, high) if low is not None else None
+        rows = (row for rows in data_src.iter_rows(conn_src, table, batch_size, key_range, low, key_column=column) for row in rows)
+        num_of_rows = data_dest.upsert_batched(conn_dest, table, rows, pk, batch_size, source_columns)
+
+        if strategy:
+            journal.save_watermark(table, strategy, column, high)
+
+        mode = f"{strategy} watermark [{column}]" if strategy else "full copy, no watermark"
+        print(f"{table}: {num_of_rows} rows upserted ({mode}).")
+
+        return num_of_rows
@@ -0,0 +1,284 @@
+import math
+
+from sql.checksums import build_canonicalizer, digest_kinds, digest_rows
+from sql.converters import build_batch_converter, get_converter, SQLITE, SQLSERVER
+from sql.scheduling import split_integer_range
+
+from sql.sqlite import connectionimpl as sqlite_connection
+from sql.sqlite import schemaimpl as sqlite_schema
+from sql.sqlite import dataimpl as sqlite_data
+
+from sql.sqlserver import connectionimpl as sqlserver_connection
+from sql.sqlserver import schemaimpl as sqlserver_schema
+from sql.sqlserver import dataimpl as sqlserver_data
+
+DEFAULT_CHUNK_ROWS = 100000     # Rows per top-level key range.
+DEFAULT_LEAF_ROWS = 1000        # Mismatching ranges with more rows are split again before their rows are compared.
+DEFAULT_FANOUT = 8              # Sub-ranges a mismatching range is split into.
+
+class TableDiff:
+    '''Outcome of the verification of one table.'''
+
+    def __init__(self, table):
+
+        self.table = table
+        self.chunks = 0
+        self.mismatched_chunks = 0
+        self.missing = 0        # Source rows not in the destination.
+        self.extra = 0          # Destination rows not in the source.
+        self.changed = 0
+        self.repaired = 0
+
+    def is_equal(self) -> bool:
+
+        return self.mismatched_chunks == 0
+
+    def __str__(self):
+
+        if self.is_equal():
+            return f"{self.table}: equal ({self.chunks} chunks)."
+
+        text = f"{self.table}: {self.mismatched_chunks} of {self.chunks} chunks differ; {self.missing} rows missing, {self.extra} extra, {self.changed} changed."
+        if self.repaired:
+            text += f" {self.repaired} rows repaired."
+        return text
+
+class _TableVerifier:
+    '''Compares one table range by range through order-independent checksums that each database computes over its own
+    rows (get_chunk_digest), splitting mismatching integer ranges until they are small enough to compare row by row.
+    Rows are only read for ranges whose checksums differ: when the rows turn out equal, the two renderings of a value
+    differ and the table falls back to hashing rows client-side. So do tables with columns of other types.'''
+
+    def __init__(self, data_src, conn_src, data_dest, conn_dest, table, source_columns, dest_columns, dest_dialect, pk,
+                 batch_size, leaf_rows, repair):
+
+        self._data_src = data_src
+        self._conn_src = conn_src
+        self._data_dest = data_dest
+        self._conn_dest = conn_dest
+        self._table = table
+        self._source_columns = source_columns
+        self.pk = pk
+        self._batch_size = batch_size
+        self._leaf_rows = leaf_rows
+        self._repair = repair
+        self.diff = TableDiff(table)
+
+        self._convert = build_batch_converter(source_columns, dest_columns, dest_dialect)
+        self._canonical = build_canonicalizer(dest_columns)
+
+        self._source_names = [column.COLUMN_NAME for column in source_columns]
+        self._dest_names = [column.COLUMN_NAME for column in dest_columns]
+        self._digest_kinds = None
+        if len(source_columns) == len(dest_columns):
+            self._digest_kinds = digest_kinds(source_columns if dest_dialect == SQLITE else dest_columns)
+
+        names = self._dest_names
+        self._key_index = names.index(pk) if pk in names else None
+        self._to_dest_key = None
+        if self._key_index is not None:
+            self._to_dest_key = get_converter(source_columns[self._key_index].DATA_TYPE, dest_columns[self._key_index].DATA_TYPE, dest_dialect)
+
+    def _dest_range(self, key_range):
+
+        if not key_range or not self._to_dest_key:
+            return key_range
+
+        return tuple(map(self._to_dest_key, key_range))
+
+    def _source_rows(self, key_range):
+
+        for rows in self._data_src.iter_rows(self._conn_src, self._table, self._batch_size, key_range, key_column=self.pk):
+            yield from self._convert(rows)
+
+    def _dest_rows(self, key_range):
+
+        for rows in self._data_dest.iter_rows(self._conn_dest, self._table, self._batch_size, self._dest_range(key_range), key_column=self.pk):
+            yield from rows
+
+    def _counts(self, key_range) -> tuple:
+
+        return (self._data_src.count_rows_in_range(self._conn_src, self._table, key_range, self.pk),
+                self._data_dest.count_rows_in_range(self._conn_dest, self._table, self._dest_range(key_range), self.pk))
+
+    def _digests(self, key_range) -> tuple:
+
+        return (self._data_src.get_chunk_digest(self._conn_src, self._table, self._source_names, self._digest_kinds, key_range, self.pk),
+                self._data_dest.get_chunk_digest(self._conn_dest, self._table, self._dest_names, self._digest_kinds,
+                                                 self._dest_range(key_range), self.pk))
+
+    def _rows_equal(self, key_range) -> bool:
+
+        return (digest_rows(map(self._canonical, self._source_rows(key_range))) ==
+                digest_rows(map(self._canonical, self._dest_rows(key_range))))
+
+    def _is_equal(self, key_range) -> bool:
+
+        if self._digest_kinds:
+            source, dest = self._digests(key_range)
+            if source == dest:
+                return True
+            if source[0] != dest[0] or not self._rows_equal(key_range):
+                return False
+
+            print(f"{self._table}: checksums differ over equal rows; comparing rows client-side.")
+            self._digest_kinds = None
+            return True
+
+        source_count, dest_count = self._counts(key_range)
+        if source_count != dest_count:
+            return False
+
+        return self._rows_equal(key_range)
+
+    def verify(self, key_ranges):
+
+        for key_range in key_ranges:
+            self.diff.chunks += 1
+            if not self._is_equal(key_range):
+                self.diff.mismatched_chunks += 1
+                self._drill_down(key_range)
+
+        # Ranges of non-integer keys end at existing source keys; destination rows between two ranges only show in the totals.
+        if self.diff.is_equal() and key_ranges != [None]:
+            source_count, dest_count = self._counts(None)
+            if source_count != dest_count:
+                self.diff.mismatched_chunks += 1
+                self.diff.missing += max(0, source_count - dest_count)
+                self.diff.extra += max(0, dest_count - source_count)
+
+    def _drill_down(self, key_range):
+
+        if key_range and isinstance(key_range[0], int) and isinstance(key_range[1], int) and key_range[1] > key_range[0]:
+            if max(self._counts(key_range)) > self._leaf_rows:
+                for sub_range in split_integer_range(key_range[0], key_range[1], DEFAULT_FANOUT):
+                    if not self._is_equal(sub_range):
+                        self._drill_down(sub_range)
+                return
+
+        if self._key_index is None:
+            self._reload()
+        else:
+            self._compare_rows(key_range)
+
+    def _compare_rows(self, key_range):
+
+        i = self._key_index
+        source = {}
+        for raw_rows in self._data_src.iter_rows(self._conn_src, self._table, self._batch_size, key_range, key_column=self.pk):
+            for raw_row, row in zip(raw_rows, self._convert(raw_rows)):
+                source[row[i]] = (self._canonical(row), raw_row)
+
+        dest = {row[i]: self._canonical(row) for row in self._dest_rows(key_range)}
+
+        missing = [key for key in source if key not in dest]
+        extra = [key for key in dest if key not in source]
+        changed = [key for key in source if key in dest and source[key][0] != dest[key]]
+
+        self.diff.missing += len(missing)
+        self.diff.extra += len(extra)
+        self.diff.changed += len(changed)
+
+        if self._repair:
+            if extra:
+                self.diff.repaired += self._data_dest.delete_keys(self._conn_dest, self._table, self.pk, extra)
+            if missing or changed:
+                rows = [source[key][1] for key in missing + changed]
+                self.diff.repaired += self._data_dest.upsert_batched(self._conn_dest, self._table, rows, self.pk, self._batch_size, self._source_columns)
+
+    def _reload(self):
+        '''Tables without a primary key cannot be compared row by row; they are reported as a whole and reloaded on repair.'''
+        source_count, dest_count = self._counts(None)
+        self.diff.missing += max(0, source_count - dest_count)
+        self.diff.extra += max(0, dest_count - source_count)
+
+        if self._repair:
+            self._data_dest.delete_rows(self._conn_dest, self._table)
+            for rows in self._data_src.iter_rows(self._conn_src, self._table, self._batch_size):
+                self.diff.repaired += self._data_dest.insert_batched(self._conn_dest, self._table, rows, self._batch_size, source_columns=self._source_columns)
+
+class DataVerify:
+    '''Checks that a destination holds the same rows as its source, and with repair re-syncs only the rows that differ.'''
+
+    def sqlserver_to_sqlite(sqlserver_name, sqlserver_database, sqlite_path, repair=False, chunk_rows=DEFAULT_CHUNK_ROWS, leaf_rows=DEFAULT_LEAF_ROWS,
+                            batch_size=sqlserver_data.DEFAULT_BATCH_SIZE) -> dict:
+
+        conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        if not conn_src:
+            print(f'Cannot connect into server: {sqlserver_name}, database{sqlserver_database}')
+            return {}
+
+        conn_dest = sqlite_connection.acquire_connection(sqlite_path)
+
+        try:
+            diffs = {}
+            for table in sqlserver_schema.get_tables(conn_src):
+                if not sqlite_schema.is_table_exists(conn_dest, table):
+                    print(f"{table}: not in the destination.")
+                    continue
+
+                verifier = _TableVerifier(sqlserver_data, conn_src, sqlite_data, conn_dest, table,
+                                          sqlserver_schema.get_columns(conn_src, table), sqlite_schema.get_columns(conn_dest, table), SQLITE,
+                                          sqlserver_schema.get_primary_key(conn_src, table), batch_size, leaf_rows, repair)
+                diffs[table] = DataVerify._verify_table(verifier, sqlserver_data, conn_src, sqlite_data, conn_dest, table, chunk_rows)
+
+            return diffs
+        finally:
+            sqlserver_connection.release_connection(conn_src)
+            sqlite_connection.release_connection(conn_dest)
+
+    def sqlite_to_sqlserver(sqlite_path, sqlserver_name, sqlserver_database, repair=False, chunk_rows=DEFAULT_CHUNK_ROWS, leaf_rows=DEFAULT_LEAF_ROWS,
+                            batch_size=sqlite_data.DEFAULT_BATCH_SIZE) -> dict:
+
+        conn_src = sqlite_connection.acquire_connection(sqlite_path)
+        if not conn_src:
+            print(f'Cannot connect into source Sqlite database: {sqlite_path}')
+            return {}
+
+        conn_dest = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+
+        try:
+            diffs = {}
+            for table in sqlite_schema.get_tables(conn_src):
+                if not sqlserver_schema.is_table_exists(conn_dest, table):
+                    print(f"{table}: not in the destination.")
+                    continue
+
+                verifier = _TableVerifier(sqlite_data, conn_src, sqlserver_data, conn_dest, table,
+                                          sqlite_schema.get_columns(conn_src, table), sqlserver_schema.get_columns(conn_dest, table), SQLSERVER,
+                                          sqlite_schema.get_primary_key(conn_src, table), batch_size, leaf_rows, repair)
+                diffs[table] = DataVerify._verify_table(verifier, sqlite_data, conn_src, sqlserver_data, conn_dest, table, chunk_rows)
+
+            return diffs
+        finally:
+            sqlite_connection.release_connection(conn_src)
+            sqlserver_connection.release_connection(conn_dest)
+
+    @staticmethod
+    def _plan_chunks(data_src, conn_src, data_dest, conn_dest, table, pk, chunk_rows) -> list:
+        '''Key ranges of about chunk_rows source rows. The outer ranges are widened to the destination's smallest and
+        largest keys, so destination rows beyond the source's keys fall into a range too.'''
+        if not pk:
+            return [None]
+
+        partitions = math.ceil(data_src.count_rows_in_range(conn_src, table) / chunk_rows)
+        key_ranges = data_src.get_key_ranges(conn_src, table, max(1, partitions))
+        dest_low, dest_high = data_dest.get_key_bounds(conn_dest, table, pk)
+
+        if not key_ranges:
+            return [(dest_low, dest_high)] if dest_low is not None else [None]
+
+        if dest_low is not None and type(dest_low) is type(key_ranges[0][0]):
+            key_ranges[0] = (min(dest_low, key_ranges[0][0]), key_ranges[0][1])
+            key_ranges[-1] = (key_ranges[-1][0], max(dest_high, key_ranges[-1][1]))
+
+        return key_ranges
+
+    @staticmethod
+    def _verify_table(verifier, data_src, conn_src, data_dest, conn_dest, table, chunk_rows) -> TableDiff:
+
+        key_ranges = DataVerify._plan_chunks(data_src, conn_src, data_dest, conn_dest, table, verifier.pk, chunk_rows)
+        verifier.verify(key_ranges)
+        print(verifier.diff)
+
+        return verifier.diff
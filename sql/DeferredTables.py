@@ -0,0 +1,43 @@
+import threading
+
+from sql.scheduling import dependency_order
+
+class DeferredTables:
+    '''Tables whose copy failed with an error another table's copy may clear, e.g. a reference to a table not loaded yet.
+    Only the table name, the error and the resume position of every part are kept, never rows, so memory stays flat
+    however many tables are deferred.'''
+    
+    def __init__(self):
+        
+        self._tables = {}       # Table -> (error number, part -> Checkpoint)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        
+        return len(self._tables)
+    
+    def __contains__(self, table):
+        
+        return table in self._tables
+    
+    def defer(self, table, error, positions: dict):
+        
+        with self._lock:
+            self._tables[table] = (error, positions)
+        
+        print(f"{table} deferred (error {error}) after {sum(position.ROWS_READ for position in positions.values())} rows.")
+    
+    def pop_all(self, graph: dict) -> list:
+        '''Removes and returns every deferred (table, positions), referenced tables first.'''
+        with self._lock:
+            tables = self._tables
+            self._tables = {}
+        
+        order = dependency_order({table: parents & tables.keys() for table, parents in graph.items() if table in tables})
+        
+        return [(table, tables[table][1]) for table in order]
+    
+    def errors(self) -> dict:
+        
+        with self._lock:
+            return {table: error for table, (error, positions) in self._tables.items()}
@@ -2,6 +2,10 @@ from collections import namedtuple
 
 Column = namedtuple('Column', ['TABLE_NAME', 'COLUMN_NAME', 'ORDINAL_POSITION', 'IS_NULLABLE', 'DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH', 'DATETIME_PRECISION', 'IS_PK', 'DEFAULT_VALUE'])
 Foreign_Key = namedtuple('Foreign_Key', ['ID', 'SEQ', 'REFERENCING_TABLE_NAME', 'REFERENCED_TABLE_NAME', 'REFERENCING_COLUMN_NAME', 'REFERENCED_COLUMN_NAME', 'CONSTRAINT_NAME', 'ON_UPDATE', 'ON_DELETE', 'MATCH'])
+Index = namedtuple('Index', ['TABLE_NAME', 'INDEX_NAME', 'IS_UNIQUE', 'COLUMNS'])     # COLUMNS: ((COLUMN_NAME, IS_DESCENDING), ...)
+Checkpoint = namedtuple('Checkpoint', ['TABLE_NAME', 'PART', 'STATUS', 'LAST_KEY', 'ROWS_READ'])
+Watermark = namedtuple('Watermark', ['TABLE_NAME', 'STRATEGY', 'COLUMN_NAME', 'VALUE'])
+Table_Filter = namedtuple('Table_Filter', ['TABLE_NAME', 'CONDITION', 'OMITTED_COLUMNS'])      # CONDITION: SQL, None for every row.
 
 sqlite_to_sqlserver_types_dict = {
     "TEXT": ["varchar", "nvarchar", "char", "nchar", "text", "ntext"],
@@ -0,0 +1,56 @@
+import threading
+from types import MappingProxyType
+
+from sql.metrics import get_metrics
+
+class SchemaCatalog:
+    '''Immutable snapshot of the columns, primary keys and foreign keys of every table in a database.'''
+
+    def __init__(self, columns: dict, primary_keys: dict, foreign_keys: dict):
+
+        self._columns = MappingProxyType({table: tuple(items) for table, items in columns.items()})
+        self._primary_keys = MappingProxyType(dict(primary_keys))
+        self._foreign_keys = MappingProxyType({table: tuple(items) for table, items in foreign_keys.items()})
+
+    def __contains__(self, table):
+
+        return table in self._columns
+
+    def get_tables(self) -> tuple:
+
+        return tuple(self._columns.keys())
+
+    def get_columns(self, table) -> tuple:
+
+        return self._columns.get(table, ())
+
+    def get_primary_key(self, table):
+
+        return self._primary_keys.get(table)
+
+    def get_foreign_keys(self, table) -> tuple:
+
+        return self._foreign_keys.get(table, ())
+
+
+_catalogs = {}      # id(conn) -> (conn, catalog). Connections don't support weak references, so the entry holds the connection.
+_catalogs_lock = threading.Lock()
+
+def get_catalog(conn, loader) -> SchemaCatalog:
+    '''Returns the cached catalog of conn, building it with loader(conn) on first use.'''
+    with _catalogs_lock:
+        entry = _catalogs.get(id(conn))
+        if entry:
+            return entry[1]
+
+    with get_metrics().timed(None, 'metadata'):
+        catalog = loader(conn)
+    with _catalogs_lock:
+        _catalogs[id(conn)] = (conn, catalog)
+
+    return catalog
+
+def invalidate_catalog(conn):
+    '''Drops the cached catalog of conn. Call after DDL and before closing the connection.'''
+    with _catalogs_lock:
+        _catalogs.pop(id(conn), None)
@@ -1,10 +1,13 @@
 import codecs
-import pymssql
+
+from sql.metrics import get_metrics
+from sql.scheduling import build_dependency_graph, dependency_order
 
 from sql.sqlite import connectionimpl as sqlite_connection
 from sql.sqlite import schemaimpl as sqlite_schema
 
 from sql.sqlserver import connectionimpl as sqlserver_connection
+from sql.sqlserver.connectionimpl import pymssql
 from sql.sqlserver import schemaimpl as sqlserver_schema
 
 class SchemaClone:
@@ -15,185 +18,211 @@ class SchemaClone:
     def sqlserver_to_sqlite(*, sqlserver_name: str = None, sqlserver_database: str = None, 
                             sqlserver_username: str = None, sqlserver_password: str = None, 
                             mssql_trusted: bool = True, 
-                            sqlite_path: str = None):
-    
+                            sqlite_path: str = None, defer_indexes: bool = False):
+        '''Creates the tables, and unless defer_indexes their secondary indexes; sqlserver_to_sqlite_add_constraints
+        builds deferred indexes after the data load.'''
         conn_src = None
         
         if mssql_trusted:
-            conn_src = sqlserver_connection.get_trusted_connection(sqlserver_name, sqlserver_database)
+            conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
         else:
-            conn_src = sqlserver_connection.get_connection(sqlserver_name, sqlserver_username, sqlserver_password, sqlserver_database)
+            conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database, sqlserver_username, sqlserver_password)
         
         if not conn_src:
             print(f'Cannot connect into server: {sqlserver_name}, database{sqlserver_database}')
             return
         
-        conn_dest = sqlite_connection.get_connection(sqlite_path)
+        conn_dest = sqlite_connection.acquire_connection(sqlite_path)
         
-        tables = sqlserver_schema.get_tables(conn_src)
-        
-        for table in tables:
-            if sqlite_schema.is_table_exists(conn_dest,table):
-                continue
+        try:
+            tables = [table for table in sqlserver_schema.get_tables(conn_src) if not sqlite_schema.is_table_exists(conn_dest, table)]
             
-            columns = sqlserver_schema.get_columns(conn_src, table)
-            pk = sqlserver_schema.get_primary_key(conn_src, table)
-            fks = sqlserver_schema.get_foreign_keys(conn_src, table)
+            # Referenced tables first. SQLite resolves foreign keys lazily, so tables in a cycle keep theirs inline.
+            graph = build_dependency_graph(tables, lambda table: sqlserver_schema.get_foreign_keys(conn_src, table))
+            tables = dependency_order(graph)
             
-            build_create_script = sqlite_schema.build_create_table_script(conn_dest, table, columns, pk, fks)
+            scripts = []
+            for table in tables:
+                columns = sqlserver_schema.get_columns(conn_src, table)
+                pk = sqlserver_schema.get_primary_key(conn_src, table)
+                fks = sqlserver_schema.get_foreign_keys(conn_src, table)
+                
+                scripts.append(sqlite_schema.build_create_table_script(conn_dest, table, columns, pk, fks))
             
             try:
-                sqlite_schema.exec_create_table(conn_dest, build_create_script)
-                print(f'Table: {table} created.')
+                with get_metrics().timed(None, 'ddl'):
+                    sqlite_schema.exec_create_tables(conn_dest, scripts)
+                print(f'{len(tables)} tables created.')
+                
+                if not defer_indexes:
+                    indexes = sqlserver_schema.get_indexes(conn_src)
+                    with get_metrics().timed(None, 'ddl'):
+                        sqlite_schema.exec_create_indexes(conn_dest, [index for table in tables for index in indexes.get(table, ())], indexes)
             except Exception as error:
                 print(error)
-                sqlite_schema.CREATION_DEQUE.append((build_create_script, table), )
-        
-        pop_left = True     # First queue, then deque, then queue again ...
-        while True:
-            dsize = len(sqlite_schema.CREATION_DEQUE)
-            if (dsize == 0):
-                break
-            
-            for i in range(dsize):
-                if pop_left:
-                    build_create_script, table = sqlite_schema.CREATION_DEQUE.popleft()
-                else:    
-                    build_create_script, table = sqlite_schema.CREATION_DEQUE.pop()
-                    
-                try:
-                    sqlite_schema.exec_create_table(conn_dest, build_create_script)
-                except Exception as error:
-                    if pop_left:
-                        sqlite_schema.CREATION_DEQUE.append((build_create_script, table), )
-                    else:
-                        sqlite_schema.CREATION_DEQUE.appendleft((build_create_script, table), )
-
-            pop_left = not pop_left
-            # sqlserver_name, sqlserver_database, sqlite_path
+                raise
             
-        print(f'Database structure from database: {sqlserver_database} at SQL Server: {sqlserver_name} to {sqlite_path} successfully cloned.')
+            print(f'Database structure from database: {sqlserver_database} at SQL Server: {sqlserver_name} to {sqlite_path} successfully cloned.')
+        finally:
+            sqlserver_connection.release_connection(conn_src)
+            sqlite_connection.release_connection(conn_dest)
  
     @staticmethod
-    def sqlite_to_sqlserver(sqlite_path, sqlserver_name, sqlserver_database):
-    
-        conn_src = sqlite_connection.get_connection(sqlite_path)
-        if not conn_src:
-            print(f'Cannot connect to sqlite file: {sqlite_path}')
-            return
+    def sqlserver_to_sqlite_add_constraints(*, sqlserver_name: str = None, sqlserver_database: str = None, 
+                                            sqlserver_username: str = None, sqlserver_password: str = None, 
+                                            mssql_trusted: bool = True, 
+                                            sqlite_path: str = None):
+        '''Builds the indexes missing from the loaded tables, each with one sort, and checks every foreign key in one pass.'''
+        conn_src = None
         
-        conn_dest = sqlserver_connection.get_trusted_connection(sqlserver_name)
-        if not conn_dest:
-            print(f'Cannot connect into SQL Server: {sqlserver_name}')
-            return
+        if mssql_trusted:
+            conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+        else:
+            conn_src = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database, sqlserver_username, sqlserver_password)
         
-        if (not sqlserver_schema.is_database_exists(conn_dest, sqlserver_database)):
-            create_database_script = sqlserver_schema.generate_create_database_script(None, sqlserver_database)
+        if not conn_src:
+            print(f'Cannot connect into server: {sqlserver_name}, database{sqlserver_database}')
+            return
         
-            if not sqlserver_schema.exec_create_database(conn_dest, create_database_script):
-                print(f'Cannot create database: {sqlserver_database} in SQL Server')
-                return
+        conn_dest = sqlite_connection.acquire_connection(sqlite_path)
         
-        conn_dest = sqlserver_schema.get_trusted_connection(sqlserver_name, sqlserver_database)
-        if not conn_dest:
-            print(f'Cannot connect into database: {sqlserver_database} in SQL Server: {sqlserver_name}')
+        try:
+            tables = sqlite_schema.get_tables(conn_dest)
+            schema_indexes = sqlserver_schema.get_indexes(conn_src)
+            indexes = [index for table in tables for index in schema_indexes.get(table, ())]
+            
+            try:
+                with get_metrics().timed(None, 'ddl'):
+                    sqlite_schema.exec_create_indexes(conn_dest, indexes, schema_indexes)
+                    conn_dest.execute('ANALYZE;')
+                print(f'{len(indexes)} indexes built.')
+            except Exception as error:
+                print(error)
+                raise
+            
+            violations = sqlite_schema.check_foreign_keys(conn_dest)
+            for table, count in violations.items():
+                print(f'{table}: {count} rows reference missing rows.')
+            if not violations:
+                print('Foreign keys checked, no violations.')
+        finally:
+            sqlserver_connection.release_connection(conn_src)
+            sqlite_connection.release_connection(conn_dest)
+
+    @staticmethod
+    def sqlite_to_sqlserver(sqlite_path, sqlserver_name, sqlserver_database, defer_indexes=False):
+        '''Creates the tables without foreign keys. With defer_indexes they are heaps without primary keys or indexes
+        either, all of which sqlite_to_sqlserver_add_constraints builds after the data load.'''
+        conn_src = sqlite_connection.acquire_connection(sqlite_path)
+        if not conn_src:
+            print(f'Cannot connect to sqlite file: {sqlite_path}')
             return
         
-        tables = sqlite_schema.get_tables(conn_src)
-        for table in tables:
-            if sqlserver_schema.is_table_exists(conn_dest, table):
-                continue
+        conn_dest = None
+        try:
+            conn_master = sqlserver_connection.get_trusted_connection(sqlserver_name)
+            if not conn_master:
+                print(f'Cannot connect into SQL Server: {sqlserver_name}')
+                return
             
-            columns = sqlite_schema.get_columns(conn_src, table)
-            pk = sqlite_schema.get_primary_key(conn_src, table)
-            fks = sqlite_schema.get_foreign_keys(conn_src, table)
+            try:
+                if (not sqlserver_schema.is_database_exists(conn_master, sqlserver_database)):
+                    create_database_script = sqlserver_schema.generate_create_database_script(None, sqlserver_database)
+                
+                    if not sqlserver_schema.exec_create_database(conn_master, create_database_script):
+                        print(f'Cannot create database: {sqlserver_database} in SQL Server')
+                        return
+            finally:
+                sqlserver_connection.release_connection(conn_master)
+            
+            conn_dest = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+            if not conn_dest:
+                print(f'Cannot connect into database: {sqlserver_database} in SQL Server: {sqlserver_name}')
+                return
+            
+            tables = [table for table in sqlite_schema.get_tables(conn_src) if not sqlserver_schema.is_table_exists(conn_dest, table)]
+            
+            # Tables are created without foreign keys, referenced tables first; sqlite_to_sqlserver_add_constraints adds the keys,
+            # cycles included, once every table exists.
+            graph = build_dependency_graph(tables, lambda table: sqlite_schema.get_foreign_keys(conn_src, table))
+            tables = dependency_order(graph)
+            
+            scripts = []
+            for table in tables:
+                columns = sqlite_schema.get_columns(conn_src, table)
+                pk = sqlite_schema.get_primary_key(conn_src, table)
+                
+                scripts.append(sqlserver_schema.build_create_table_script(table, columns, pk, (), build_fk_constraints=False, 
+                                                                          build_pk_constraint=not defer_indexes))
+            
+            if not defer_indexes:
+                indexes = sqlite_schema.get_indexes(conn_src)
+                scripts.extend(sqlserver_schema.build_create_index_script(index) for table in tables for index in indexes.get(table, ()))
             
-            build_create_script = sqlserver_schema.build_create_table_script(table, columns, pk, fks, build_fk_constraints=False)
             try:
-                sqlserver_schema.exec_script(conn_dest, build_create_script)
-                print(f'Table {table} created.')
+                with get_metrics().timed(None, 'ddl'):
+                    sqlserver_schema.exec_scripts(conn_dest, scripts)
+                print(f'{len(tables)} tables created.')
                 
             except pymssql.exceptions.OperationalError as o_error:
                 msg = codecs.decode(o_error.args[1])
-                # print(msg)
-                
-                if o_error.args[0] == 1767:
-                    # (1767, b"Foreign key 'None' references invalid table 'dbo.Publisher'.DB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\nDB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\n")
-                    sqlserver_schema.CREATION_DEQUE.append((build_create_script, table), )
-                    continue
-                if o_error.args[0] == 3902:
-                    # ("Cannot commit transaction: (3902, b'The COMMIT TRANSACTION request has no corresponding BEGIN TRANSACTION.DB-Lib error message 20018, severity 16:\\nGeneral SQL Server error: Check messages from the SQL Server\\n')",)
-                    raise
-                if o_error.args[0] == 2714:
-                    # (2714, b"There is already an object named 'None' in the database.DB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\nDB-Lib error message 20018, severity 16:\nGeneral SQL Server error: Check messages from the SQL Server\n")
-                    continue
-                if o_error.args[0] == 173:
-                    # (173, b"The definition for column 'Data' must include a data type.DB-Lib error message 20018, severity 15:\nGeneral SQL Server error: Check messages from the SQL Server\n")
-                    raise
-
-            except pymssql.exceptions.ProgrammingError as p_error:
-                # sqlserver.CREATION_DEQUE.append((build_create_script, table), )
-                print(p_error)
-                raise
-            except pymssql.exceptions.IntegrityError as i_error:
-                print(i_error)
+                print(msg)
                 raise
-            except AttributeError as a_error:
-                print(a_error)
-                raise
-            except Exception as error:
-                print(error)
-                raise
-            
-        
-        pop_left = True     # First queue, then deque, then queue again ... make it better.
-        while True:
-            dsize = len(sqlserver_schema.CREATION_DEQUE)
-            if (dsize == 0):
-                break
-            
-            for i in range(dsize):
-                if pop_left:
-                    build_create_script, table = sqlserver_schema.CREATION_DEQUE.popleft()
-                else:    
-                    build_create_script, table = sqlserver_schema.CREATION_DEQUE.pop()
-                    
-                try:
-                    sqlserver_schema.exec_script(conn_dest, build_create_script)
-                    print(f'Table {table} created.')
-                except Exception as error:
-                    if pop_left:
-                        sqlserver_schema.CREATION_DEQUE.append((build_create_script, table), )
-                    else:
-                        sqlserver_schema.CREATION_DEQUE.appendleft((build_create_script, table), )
-
-            pop_left = not pop_left
+        finally:
+            sqlite_connection.release_connection(conn_src)
+            if conn_dest:
+                sqlserver_connection.release_connection(conn_dest)
 
     @staticmethod
-    def sqlite_to_sqlserver_add_constraints(sqlite_path, sqlserver_name, sqlserver_database):
-        
-        conn_src = sqlite_connection.get_connection(sqlite_path)
+    def sqlite_to_sqlserver_add_constraints(sqlite_path, sqlserver_name, sqlserver_database, defer_indexes=False):
+        '''Adds the foreign keys, checked against the loaded rows. With defer_indexes the primary keys and indexes are
+        built first, so every one of them is built with a single sort of its table.'''
+        conn_src = sqlite_connection.acquire_connection(sqlite_path)
         if not conn_src:
             print(f'Cannot connect to sqlite file: {sqlite_path}')
             return
         
-        conn_dest = sqlserver_schema.get_trusted_connection(sqlserver_name, sqlserver_database)
-        if not conn_dest:
-            print(f'Cannot connect into database: {sqlserver_database} in SQL Server: {sqlserver_name}')
-            return
-        
-        tables = sqlserver_schema.get_tables(conn_dest)
-        for table in tables:
-            fks = sqlite_schema.get_foreign_keys(conn_src, table)
-            if len(fks) == 0:
-                continue
+        conn_dest = None
+        try:
+            conn_dest = sqlserver_connection.acquire_connection(sqlserver_name, sqlserver_database)
+            if not conn_dest:
+                print(f'Cannot connect into database: {sqlserver_database} in SQL Server: {sqlserver_name}')
+                return
+            
+            tables = sqlserver_schema.get_tables(conn_dest)
+            graph = build_dependency_graph(tables, lambda table: sqlite_schema.get_foreign_keys(conn_src, table))
+            
+            index_scripts = []
+            if defer_indexes:
+                indexes = sqlite_schema.get_indexes(conn_src)
+                for table in tables:
+                    pk = sqlite_schema.get_primary_key(conn_src, table)
+                    if pk:
+                        index_scripts.append(sqlserver_schema.build_primary_key_script(table, pk))
+                    index_scripts.extend(sqlserver_schema.build_create_index_script(index) for index in indexes.get(table, ()))
+            
+            scripts = []
+            for table in dependency_order(graph):
+                fks = sqlite_schema.get_foreign_keys(conn_src, table)
+                if len(fks) == 0:
+                    continue
+                
+                scripts.append(sqlserver_schema.build_foreign_key_script(fks))
             
-            build_create_script = sqlserver_schema.build_foreign_key_script(fks)
             try:
-                sqlserver_schema.exec_script(conn_dest, build_create_script)
-                print(f'Foreign key constrains in Table {table} added.')
+                if index_scripts:       # Foreign keys need the referenced primary keys in place.
+                    with get_metrics().timed(None, 'ddl'):
+                        sqlserver_schema.exec_scripts(conn_dest, index_scripts)
+                    print(f'{len(index_scripts)} primary keys and indexes built.')
+                
+                with get_metrics().timed(None, 'ddl'):
+                    sqlserver_schema.exec_scripts(conn_dest, scripts)
+                print(f'Foreign key constraints in {len(scripts)} tables added.')
                 
             except Exception as error:
                 print(error)
                 raise
-            
\ No newline at end of file
+        finally:
+            sqlite_connection.release_connection(conn_src)
+            if conn_dest:
+                sqlserver_connection.release_connection(conn_dest)
@@ -0,0 +1,136 @@
+import contextlib
+import itertools
+import time
+
+from sql.metrics import estimate_bytes
+
+def rows_per_statement(num_of_columns, max_parameters, max_rows=None) -> int:
+    '''Largest number of rows a multi-row VALUES statement can hold without exceeding the backend limits.'''
+    rows = max(1, max_parameters // max(1, num_of_columns))
+    if max_rows:
+        rows = min(rows, max_rows)
+
+    return rows
+
+def chunked(rows, size):
+    '''Yields lists of at most size rows from any iterable of rows.'''
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+DEFAULT_TARGET_SECONDS = 0.25           # Latency a batch write is steered towards.
+DEFAULT_MAX_BATCH_BYTES = 16 << 20      # Estimated payload of a batch (sql.metrics.estimate_bytes).
+DEFAULT_MAX_BATCH_PARAMETERS = 1000000  # Values bound by a batch.
+DEFAULT_MAX_BATCH_ROWS = 100000
+
+GROWTH = 2.0            # A batch is at most this many times larger, or smaller, than the one before it.
+SMOOTHING = 0.5         # Weight of the latest batch in the rows per second estimate.
+HOLD_AFTER_ERROR = 3    # Batches written after an error before the size may grow again.
+SAMPLE_ROWS = 64        # Rows of a batch whose size is measured.
+
+class BatchController:
+    '''Chooses the size of each batch a writer sends. The size starts at batch_size and is limited by max_bytes, at
+    the average row size seen so far, and by max_parameters. Within those limits it follows the observed rows per
+    second towards batches taking target_seconds, changing by at most GROWTH per batch. A failed batch halves the
+    size and holds it for HOLD_AFTER_ERROR batches. Narrow tables end up with large batches and wide tables with
+    LOB values with small ones. A fixed controller keeps batch_size.'''
+
+    def __init__(self, batch_size, num_of_columns=1, table=None, target_seconds=DEFAULT_TARGET_SECONDS, max_bytes=DEFAULT_MAX_BATCH_BYTES,
+                 max_parameters=DEFAULT_MAX_BATCH_PARAMETERS, min_rows=1, max_rows=DEFAULT_MAX_BATCH_ROWS, adaptive=True):
+
+        self.table = table
+        self.adaptive = adaptive
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.min_rows = min_rows
+        self.max_rows = max(max_rows, min_rows)
+        self.max_parameter_rows = rows_per_statement(num_of_columns, max_parameters)
+        self.size = batch_size
+        self.row_bytes = None
+        self.rows_per_sec = None
+        self.sizes = None       # Statistics of the sizes chosen, see summary().
+        self._hold = 0
+
+    def _limit(self, size) -> int:
+
+        limit = min(self.max_rows, self.max_parameter_rows)
+        if self.row_bytes:
+            limit = min(limit, int(self.max_bytes / self.row_bytes))
+
+        return max(self.min_rows, min(int(size), limit))
+
+    def next_size(self) -> int:
+
+        if self.adaptive:
+            self.size = self._limit(self.size)
+
+        return int(self.size)
+
+    def _chosen(self, size):
+
+        if self.sizes is None:
+            self.sizes = {'batches': 0, 'first': size, 'min': size, 'max': size, 'last': size, 'total': 0}
+        sizes = self.sizes
+        sizes['batches'] += 1
+        sizes['min'] = min(sizes['min'], size)
+        sizes['max'] = max(sizes['max'], size)
+        sizes['last'] = size
+        sizes['total'] += size
+
+    def record(self, num_of_rows, num_of_bytes, seconds):
+        '''Feeds back a batch of num_of_rows rows, about num_of_bytes large, written in seconds.'''
+        if not self.adaptive or num_of_rows <= 0:
+            return
+
+        row_bytes = num_of_bytes / num_of_rows
+        self.row_bytes = row_bytes if self.row_bytes is None else (1 - SMOOTHING) * self.row_bytes + SMOOTHING * row_bytes
+
+        if seconds <= 0:
+            return
+
+        rate = num_of_rows / seconds
+        self.rows_per_sec = rate if self.rows_per_sec is None else (1 - SMOOTHING) * self.rows_per_sec + SMOOTHING * rate
+
+        if num_of_rows < self.size / GROWTH:
+            return      # The last, partial batch says little about its size.
+
+        ideal = self.rows_per_sec * self.target_seconds
+        if self._hold:
+            self._hold -= 1
+            ideal = min(ideal, self.size)
+        self.size = min(max(ideal, self.size / GROWTH), self.size * GROWTH)
+
+    def record_error(self):
+
+        if not self.adaptive:
+            return
+
+        self.size = max(self.min_rows, self.size // 2)
+        self._hold = HOLD_AFTER_ERROR
+
+    @contextlib.contextmanager
+    def measure(self, batch):
+        '''Context manager around the write of batch (a list), recording it unless it raises.'''
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        sample = batch[:SAMPLE_ROWS]
+        self.record(len(batch), estimate_bytes(sample) * len(batch) / max(1, len(sample)), seconds)
+
+    def batches(self, rows):
+        '''chunked() with the size chosen anew for every batch.'''
+        iterator = iter(rows)
+        while True:
+            size = self.next_size()
+            batch = list(itertools.islice(iterator, size))
+            if not batch:
+                return
+            self._chosen(len(batch))
+            yield batch
+
+    def summary(self) -> dict:
+        '''{'batches', 'first', 'min', 'max', 'last', 'total'} of the sizes of the batches sent so far, {} before the first.'''
+        return dict(self.sizes or {})
@@ -0,0 +1,155 @@
+import datetime
+import hashlib
+import struct
+
+from sql.converters import _base_type, from_julian
+
+# Column types whose values may come back from the other database as another numeric type, or as numeric text
+# (SQLite stores the text of a decimal.Decimal in a NUMERIC column as a number).
+NUMERIC_TYPES = ('integer', 'real', 'numeric', 'tinyint', 'smallint', 'int', 'bigint', 'bit', 'decimal', 'money', 'smallmoney', 'float')
+
+CHECKSUM_MODULUS = 2 ** 64
+
+def _canonical_number(val):
+
+    if isinstance(val, (bytes, datetime.date, datetime.time)):
+        return val
+    try:
+        return float(f'{float(val):.12g}')      # 12.5, '12.50' and Decimal('12.500') hash alike.
+    except (TypeError, ValueError):
+        return val
+
+def build_canonicalizer(columns):
+    '''Function turning a row in the types of columns, as written into or read from the destination, into a tuple that
+    compares and hashes equal for the same values on both sides.'''
+    numeric = tuple(i for i, column in enumerate(columns) if _base_type(column.DATA_TYPE) in NUMERIC_TYPES)
+
+    if not numeric:
+        return tuple
+
+    def canonical(row):
+        values = list(row)
+        for i in numeric:
+            if values[i] is not None:
+                values[i] = _canonical_number(values[i])
+        return tuple(values)
+
+    return canonical
+
+def row_hash(values) -> int:
+
+    return int.from_bytes(hashlib.blake2b(repr(values).encode(), digest_size=8).digest(), 'little')
+
+def digest_rows(rows) -> tuple:
+    '''(count, checksum) of canonical rows. The checksum is the sum of the row hashes, so it does not depend on the
+    order the rows are read in and the tables need no ORDER BY.'''
+    count = 0
+    checksum = 0
+    for values in rows:
+        count += 1
+        checksum = (checksum + row_hash(values)) % CHECKSUM_MODULUS
+
+    return count, checksum
+
+# How a column is hashed by get_chunk_digest, by the type of its SQL Server side. Each dataimpl renders a kind the
+# same way: sql.sqlserver.dataimpl with T-SQL expressions, SQLite through RowDigest.
+DIGEST_KINDS = {
+    'tinyint': 'int', 'smallint': 'int', 'int': 'int', 'bigint': 'int', 'bit': 'int',
+    'float': 'number', 'real': 'number', 'decimal': 'number', 'numeric': 'number', 'money': 'number', 'smallmoney': 'number',
+    'char': 'text', 'varchar': 'text', 'nchar': 'text', 'nvarchar': 'text', 'text': 'text', 'ntext': 'text',
+    'uniqueidentifier': 'uuid',
+    'binary': 'binary', 'varbinary': 'binary', 'image': 'binary',
+    'datetime': 'datetime', 'datetime2': 'datetime', 'smalldatetime': 'datetime',
+    'date': 'date',
+    'time': 'time'
+}
+
+DIGEST_SEPARATOR = '\x1f'
+
+def digest_kinds(sqlserver_columns):
+    '''Kinds of the columns, None when one of them has a type get_chunk_digest cannot hash alike on both sides.'''
+    kinds = tuple(DIGEST_KINDS.get(_base_type(column.DATA_TYPE)) for column in sqlserver_columns)
+
+    return None if None in kinds else kinds
+
+def _round_to_milliseconds(val):
+
+    return val.replace(microsecond=0) + datetime.timedelta(milliseconds=round(val.microsecond / 1000))
+
+def _datetime_value(val):
+
+    if isinstance(val, str):
+        return datetime.datetime.fromisoformat(val)
+    if isinstance(val, (int, float)):
+        return from_julian(val)
+    return val
+
+def _datetime_text(val) -> str:
+
+    val = _round_to_milliseconds(_datetime_value(val))
+    return f'{val.year:04d}-{val.month:02d}-{val.day:02d} {val:%H:%M:%S}.{val.microsecond // 1000:03d}'
+
+def _date_text(val) -> str:
+
+    if isinstance(val, str):
+        return datetime.date.fromisoformat(val[:10]).isoformat()
+    if not isinstance(val, datetime.datetime) and isinstance(val, datetime.date):
+        return val.isoformat()
+    return _round_to_milliseconds(_datetime_value(val)).date().isoformat()
+
+def _time_text(val) -> str:
+
+    if isinstance(val, str):
+        val = datetime.time.fromisoformat(val)
+    val = _round_to_milliseconds(datetime.datetime.combine(datetime.date.min, val))
+    return f'{val:%H:%M:%S}.{val.microsecond // 1000:03d}'
+
+def _binary_text(val) -> str:
+
+    return (val.encode() if isinstance(val, str) else bytes(val)).hex().upper()
+
+# The text SQL Server renders for each kind, see sqlserver.dataimpl.DIGEST_EXPRESSIONS.
+_DIGEST_TEXT = {
+    'int': lambda val: str(int(val)),
+    'number': lambda val: struct.pack('>d', float(val)).hex().upper(),       # CAST(CAST(... AS FLOAT) AS BINARY(8))
+    'text': lambda val: val.decode('utf-8') if isinstance(val, bytes) else str(val),
+    'uuid': lambda val: str(val).lower(),
+    'binary': _binary_text,
+    'datetime': _datetime_text,
+    'date': _date_text,
+    'time': _time_text
+}
+
+def digest_text(kinds, values) -> str:
+    '''Text of a row that get_chunk_digest hashes: each value prefixed with v, NULL as n. A value that cannot be
+    rendered yields a text no row renders to, so its chunk mismatches and is compared row by row.'''
+    texts = []
+    for kind, val in zip(kinds, values):
+        if val is None:
+            texts.append('n')
+            continue
+        try:
+            texts.append('v' + _DIGEST_TEXT[kind](val))
+        except (AttributeError, TypeError, ValueError, OverflowError, UnicodeDecodeError):
+            texts.append('\x00')
+    return DIGEST_SEPARATOR.join(texts)
+
+def text_hash(text) -> int:
+    '''The first 7 bytes of the SHA-256 of the UTF-16LE text, as SQL Server's HASHBYTES of an NVARCHAR.'''
+    return int.from_bytes(hashlib.sha256(text.encode('utf-16-le', 'surrogatepass')).digest()[:7], 'big')
+
+class RowDigest:
+    '''SQLite aggregate summing the text_hash of the digest_text of each row. Called as f('kind,kind', col, col);
+    returns text, since the sum does not fit into SQLite's 64-bit integers.'''
+
+    def __init__(self):
+
+        self.checksum = 0
+
+    def step(self, kinds, *values):
+
+        self.checksum += text_hash(digest_text(kinds.split(','), values))
+
+    def finalize(self):
+
+        return str(self.checksum)
@@ -0,0 +1,147 @@
+import codecs
+import datetime
+
+from bdatetime.bdatetime import to_julian, from_julian, to_julian_many, from_julian_many, is_julian
+
+SQLITE = 'sqlite'
+SQLSERVER = 'sqlserver'
+
+# SQL Server type families.
+SQLSERVER_DATETIME_TYPES = ('datetime', 'datetime2', 'smalldatetime', 'datetimeoffset')
+SQLSERVER_DECIMAL_TYPES = ('decimal', 'numeric', 'money', 'smallmoney')
+SQLSERVER_TEXT_TYPES = ('varchar', 'nvarchar', 'char', 'nchar', 'text', 'ntext')
+
+def _base_type(data_type) -> str:
+    '''nvarchar(max) -> nvarchar, REAL -> real'''
+    return (data_type or '').split('(')[0].strip().lower()
+
+def _date_to_julian(val):
+
+    return to_julian(datetime.datetime.combine(val, datetime.time()))
+
+def _time_to_text(val):
+
+    return val.isoformat()
+
+def _julian_to_datetime(val):
+
+    # ISO text is left for SQL Server to parse; numbers that are no Julian day a datetime can hold are passed through as well.
+    return from_julian(val) if is_julian(val) else val
+
+def _julian_to_date(val):
+
+    return from_julian(val).date() if is_julian(val) else val
+
+def _decode_utf8(val):
+
+    return codecs.decode(val, encoding='UTF-8') if isinstance(val, bytes) else val
+
+def get_converter(source_type, dest_type, dest_dialect):
+    '''Conversion function for values of a source_type column written into a dest_type column of a dest_dialect
+    database, or None if they can be written as read.'''
+    source = _base_type(source_type)
+    dest = _base_type(dest_type)
+
+    if dest_dialect == SQLITE:          # Source is SQL Server; dest is a SQLite affinity.
+        if source in SQLSERVER_DATETIME_TYPES:
+            return to_julian
+        if source == 'date':
+            return _date_to_julian
+        if source == 'time':
+            return _time_to_text
+        if source in SQLSERVER_DECIMAL_TYPES:
+            return str          # sqlite3 cannot bind decimal.Decimal.
+        if source == 'uniqueidentifier':
+            return str
+
+    elif dest_dialect == SQLSERVER:     # Source is a SQLite affinity.
+        if dest in SQLSERVER_DATETIME_TYPES and source not in SQLSERVER_DATETIME_TYPES:
+            return _julian_to_datetime
+        if dest == 'date' and source != 'date':
+            return _julian_to_date
+        if dest in SQLSERVER_TEXT_TYPES and source == 'blob':
+            return _decode_utf8
+
+    return None
+
+def _plan(source_columns, dest_columns, dest_dialect, skip_columns):
+    '''(indexes of the source values kept, ((position in the output, converter), ...))'''
+    if source_columns is None:
+        source_columns, dest_dialect = dest_columns, None
+
+    keep = []
+    converters = []
+    for i, (source, dest) in enumerate(zip(source_columns, dest_columns)):
+        if dest.COLUMN_NAME in skip_columns:
+            continue
+
+        converter = get_converter(source.DATA_TYPE, dest.DATA_TYPE, dest_dialect)
+        if converter:
+            converters.append((len(keep), converter))
+        keep.append(i)
+
+    return tuple(keep), tuple(converters)
+
+def _make_row_converter(keep, converters, num_of_columns):
+
+    if not converters and len(keep) == num_of_columns:
+        return tuple
+
+    if not converters:
+        return lambda row: tuple([row[i] for i in keep])
+
+    def convert(row):
+        values = [row[i] for i in keep]
+        for i, converter in converters:
+            val = values[i]
+            if val is not None:
+                values[i] = converter(val)
+        return values
+
+    return convert
+
+def build_row_converter(source_columns, dest_columns, dest_dialect, skip_columns=()):
+    '''Builds, once per table, the function that turns a source row into the parameter sequence of the destination INSERT.
+    Columns named in skip_columns are dropped. Without source_columns the rows are assumed to be in destination types already.'''
+    keep, converters = _plan(source_columns, dest_columns, dest_dialect, skip_columns)
+
+    return _make_row_converter(keep, converters, len(dest_columns))
+
+def _julian_to_datetime_many(values) -> list:
+
+    if all(val is None or is_julian(val) for val in values):
+        return from_julian_many(values)
+
+    return [None if val is None else _julian_to_datetime(val) for val in values]
+
+# Converters with a whole-column counterpart in bdatetime.
+_COLUMN_CONVERTERS = {
+    to_julian: to_julian_many,
+    _julian_to_datetime: _julian_to_datetime_many
+}
+
+def build_batch_converter(source_columns, dest_columns, dest_dialect, skip_columns=()):
+    '''Like build_row_converter, but the returned function converts a list of rows at once; date/time columns go
+    through the bdatetime *_many functions a column at a time. Returns a list of rows.'''
+    keep, converters = _plan(source_columns, dest_columns, dest_dialect, skip_columns)
+
+    column_converters = tuple((i, _COLUMN_CONVERTERS[converter]) for i, converter in converters if converter in _COLUMN_CONVERTERS)
+    row_converters = tuple((i, converter) for i, converter in converters if converter not in _COLUMN_CONVERTERS)
+
+    if not converters and len(keep) == len(dest_columns):
+        return list         # Nothing to convert, e.g. rows converted by an earlier pipeline stage.
+    
+    if not column_converters:
+        convert = _make_row_converter(keep, row_converters, len(dest_columns))
+        return lambda rows: [list(convert(row)) for row in rows]
+
+    convert = _make_row_converter(keep, row_converters, -1)     # -1: always build a new list per row.
+
+    def convert_batch(rows):
+        rows = [list(convert(row)) for row in rows]
+        for i, convert_column in column_converters:
+            for row, val in zip(rows, convert_column([row[i] for row in rows])):
+                row[i] = val
+        return rows
+
+    return convert_batch
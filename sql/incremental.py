@@ -0,0 +1,40 @@
+from sql.converters import _base_type, SQLSERVER
+
+KEY = 'key'                 # New rows only: keys above the largest one copied.
+ROWVERSION = 'rowversion'   # New and changed rows: SQL Server bumps the rowversion of every written row.
+MODIFIED = 'modified'       # New and changed rows: a modified-at column the application maintains.
+
+ROWVERSION_TYPES = ('rowversion', 'timestamp')      # INFORMATION_SCHEMA reports rowversion columns as timestamp.
+INTEGER_TYPES = ('tinyint', 'smallint', 'int', 'bigint', 'integer')
+
+def choose_watermark(columns, pk, modified_column=None, dialect=SQLSERVER) -> tuple:
+    '''(strategy, column) of the watermark an incremental sync of a table with columns uses, or (None, None) when the
+    table has to be copied in full. A modified_column chosen by the user wins, then a rowversion column (SQL Server
+    sources only), then an integer primary key.'''
+    names = {column.COLUMN_NAME: _base_type(column.DATA_TYPE) for column in columns}
+
+    if modified_column:
+        if modified_column not in names:
+            raise ValueError(f"Column {modified_column} not found in {columns[0].TABLE_NAME if columns else 'table'}")
+        return MODIFIED, modified_column
+
+    if dialect == SQLSERVER:
+        for name, data_type in names.items():
+            if data_type in ROWVERSION_TYPES:
+                return ROWVERSION, name
+
+    if pk and names.get(pk) in INTEGER_TYPES:
+        return KEY, pk
+
+    return None, None
+
+def parse_modified_columns(items) -> dict:
+    '''['Table=Column', ...] -> {Table: Column}'''
+    columns = {}
+    for item in items or ():
+        table, sep, column = item.partition('=')
+        if not sep or not table or not column:
+            raise ValueError(f"Expected Table=Column, got {item}")
+        columns[table] = column
+
+    return columns
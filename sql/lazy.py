@@ -0,0 +1,20 @@
+import importlib
+
+class LazyModule:
+    '''Stands in for the module name until one of its attributes is used, then imports it. Attributes are cached on
+    the stand-in, so later lookups cost what they cost on the module. Keeps database drivers out of the startup of
+    runs that never use them.'''
+
+    def __init__(self, name):
+
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+
+        value = getattr(importlib.import_module(self._name), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+
+        return f"<lazy module '{self._name}'>"
@@ -0,0 +1,64 @@
+import sqlite3
+
+from sql.converters import _base_type, SQLITE
+
+# Large values (BLOB, varbinary(max), nvarchar(max), ...) above the inline limit are not read with their row: the row
+# is copied with an empty value in their place and the value follows in LOB_CHUNK_SIZE pieces, read and written
+# through the databases' partial LOB access, so a table of multi-MB attachments copies with flat memory use.
+DEFAULT_LOB_INLINE_LIMIT = 1 << 20      # Bytes (SQLite) or DATALENGTH (SQL Server).
+LOB_CHUNK_SIZE = 1 << 20                # Bytes, or characters of SQL Server text.
+
+SQLITE_LOB_TYPES = ('blob', 'text')
+SQLSERVER_MAX_TYPES = ('varbinary', 'varchar', 'nvarchar')      # Take .WRITE when declared (max).
+SQLSERVER_LEGACY_LOB_TYPES = ('image', 'text', 'ntext')
+BINARY_TYPES = ('blob', 'varbinary', 'image')
+
+def is_lob_column(column, dialect) -> bool:
+
+    data_type = _base_type(column.DATA_TYPE)
+    if dialect == SQLITE:
+        return data_type in SQLITE_LOB_TYPES
+
+    return data_type in SQLSERVER_LEGACY_LOB_TYPES or (data_type in SQLSERVER_MAX_TYPES and column.CHARACTER_MAXIMUM_LENGTH == -1)
+
+def _is_writable_in_pieces(column, dialect) -> bool:
+
+    if dialect == SQLITE:
+        return _base_type(column.DATA_TYPE) in SQLITE_LOB_TYPES
+
+    return _base_type(column.DATA_TYPE) in SQLSERVER_MAX_TYPES and column.CHARACTER_MAXIMUM_LENGTH == -1
+
+def plan_lob_columns(source_columns, source_dialect, dest_columns, dest_dialect, key_column) -> tuple:
+    '''((column name, is_text), ...) of the columns whose large values are streamed: LOB columns of the source that the
+    destination can write in pieces, binary into binary and text into text (values that need a conversion between
+    the two go inline). Empty without a key_column indexed in both databases to find the rows by.'''
+    if not key_column:
+        return ()
+    if SQLITE in (source_dialect, dest_dialect) and not hasattr(sqlite3.Connection, 'blobopen'):       # Python < 3.11.
+        return ()
+
+    lob_columns = []
+    for source, dest in zip(source_columns, dest_columns):
+        if not is_lob_column(source, source_dialect) or not _is_writable_in_pieces(dest, dest_dialect):
+            continue
+
+        source_binary = _base_type(source.DATA_TYPE) in BINARY_TYPES
+        if source_binary == (_base_type(dest.DATA_TYPE) in BINARY_TYPES):
+            lob_columns.append((source.COLUMN_NAME, not source_binary))
+
+    return tuple(lob_columns)
+
+def copy_large_values(data_src, conn_src, data_dest, conn_dest, table, lob_columns, key_column, lob_limit, chunk_size=LOB_CHUNK_SIZE, 
+                      condition=None) -> int:
+    '''Streams the values of lob_columns (from plan_lob_columns) larger than lob_limit from the source row to the
+    destination row with the same key_column value, in the source rows satisfying condition (the rows copied).
+    Returns the number of values copied.'''
+    num_of_values = 0
+    for column, is_text in lob_columns:
+        # Keys first: a pymssql connection cannot read the chunks while another result is still open.
+        for key, size in data_src.get_large_values(conn_src, table, column, key_column, lob_limit, condition):
+            chunks = data_src.iter_lob_chunks(conn_src, table, column, key_column, key, chunk_size, as_text=is_text)
+            data_dest.write_lob(conn_dest, table, column, key_column, key, chunks, None if is_text else size)
+            num_of_values += 1
+
+    return num_of_values
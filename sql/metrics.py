@@ -0,0 +1,240 @@
+import bisect
+import contextlib
+import datetime
+import json
+import threading
+import time
+
+# Upper bounds, in milliseconds, of the batch latency histogram buckets; the last bucket takes everything slower.
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+STAGES = ('metadata', 'ddl', 'read', 'convert', 'write')
+
+def estimate_bytes(rows) -> int:
+    '''Approximate payload of rows: the length of text and binary values, 8 bytes for anything else.'''
+    total = 0
+    for row in rows:
+        for val in row:
+            if isinstance(val, (str, bytes, bytearray)):
+                total += len(val)
+            elif val is not None:
+                total += 8
+    return total
+
+class TableMetrics:
+
+    def __init__(self, table):
+
+        self.table = table
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.retries = 0
+        self.errors = 0
+        self.batch_sizes = None
+        self.started = None
+        self.elapsed = 0.0
+
+    def summary(self) -> dict:
+
+        return {
+            'table': self.table,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'batches': self.batches,
+            'elapsed_seconds': round(self.elapsed, 4),
+            'rows_per_sec': round(self.rows / self.elapsed, 1) if self.elapsed else None,
+            'seconds': {stage: round(seconds, 4) for stage, seconds in self.seconds.items()},
+            'latency_histogram_ms': dict(zip([f'<={bound}' for bound in LATENCY_BUCKETS_MS] + ['>'], self.latency_histogram)),
+            'retries': self.retries,
+            'errors': self.errors,
+            'batch_sizes': self._batch_sizes_summary()
+        }
+
+    def _batch_sizes_summary(self):
+
+        if not self.batch_sizes:
+            return None
+
+        sizes = {key: value for key, value in self.batch_sizes.items() if key != 'total'}
+        sizes['mean'] = round(self.batch_sizes['total'] / self.batch_sizes['batches'], 1)
+        return sizes
+
+    def add_batch_sizes(self, sizes):
+        '''Merges the batch sizes a sql.batching.BatchController chose (its summary()) into the table's.'''
+        if not sizes:
+            return
+        if not self.batch_sizes:
+            self.batch_sizes = dict(sizes)
+            return
+
+        merged = self.batch_sizes
+        merged['batches'] += sizes['batches']
+        merged['min'] = min(merged['min'], sizes['min'])
+        merged['max'] = max(merged['max'], sizes['max'])
+        merged['last'] = sizes['last']
+        merged['total'] += sizes['total']
+
+class Metrics:
+    '''Per-table counters of a migration, written as JSON-lines events to stream as they happen and summed up by
+    summary(). A disabled instance, the default, records nothing, so the instrumented code pays almost nothing.'''
+
+    def __init__(self, stream=None, enabled=True):
+
+        self.enabled = enabled
+        self._stream = stream
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _table(self, table) -> TableMetrics:
+
+        metrics = self._tables.get(table)
+        if metrics is None:
+            metrics = self._tables[table] = TableMetrics(table)
+        return metrics
+
+    def event(self, kind, table=None, **fields):
+
+        if not self.enabled or self._stream is None:
+            return
+
+        line = json.dumps({'time': datetime.datetime.now().isoformat(), 'event': kind, 'table': table, **fields}, default=str)
+        with self._lock:
+            self._stream.write(line + '\n')
+            self._stream.flush()
+
+    def table_started(self, table):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._table(table).started = time.perf_counter()
+        self.event('table_started', table)
+
+    def table_finished(self, table, **fields):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            metrics = self._table(table)
+            if metrics.started is not None:
+                metrics.elapsed += time.perf_counter() - metrics.started
+                metrics.started = None
+            summary = metrics.summary()
+        del summary['table']
+        self.event('table_finished', table, **summary, **fields)
+
+    def add_seconds(self, table, stage, seconds):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._table(table).seconds[stage] += seconds
+
+    @contextlib.contextmanager
+    def _timed(self, table, stage):
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.add_seconds(table, stage, seconds)
+            self.event(stage, table, seconds=round(seconds, 6))
+
+    def timed(self, table, stage):
+        '''Context manager adding the time spent in the block to stage (one of STAGES) of table; None for work not
+        done for a single table.'''
+        return self._timed(table, stage) if self.enabled else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _batch(self, table, rows):
+
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        num_of_bytes = estimate_bytes(rows)
+
+        with self._lock:
+            metrics = self._table(table)
+            metrics.rows += len(rows)
+            metrics.bytes += num_of_bytes
+            metrics.batches += 1
+            metrics.seconds['write'] += seconds
+            metrics.latency_histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+        self.event('batch', table, rows=len(rows), bytes=num_of_bytes, seconds=round(seconds, 6))
+
+    def batch(self, table, rows):
+        '''Context manager around the write of one batch of rows (a list) into table. Batches that raise are not counted.'''
+        return self._batch(table, rows) if self.enabled else contextlib.nullcontext()
+
+    def batch_sizes(self, table, sizes):
+        '''Records the batch sizes chosen for table's writes: the summary() of a sql.batching.BatchController.'''
+        if not self.enabled or not sizes:
+            return
+
+        with self._lock:
+            self._table(table).add_batch_sizes(sizes)
+        self.event('batch_sizes', table, **sizes)
+
+    def retry(self, table, reason=None):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._table(table).retries += 1
+        self.event('retry', table, reason=reason)
+
+    def error(self, table, error):
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._table(table).errors += 1
+        self.event('error', table, error=str(error))
+
+    def summary(self) -> dict:
+
+        with self._lock:
+            everything = [metrics.summary() for metrics in self._tables.values()]
+        tables = [t for t in everything if t['table'] is not None]     # None holds the work not done for one table, e.g. catalog reads.
+
+        totals = {'rows': sum(t['rows'] for t in tables), 'bytes': sum(t['bytes'] for t in tables),
+                  'retries': sum(t['retries'] for t in tables), 'errors': sum(t['errors'] for t in tables),
+                  'seconds': {stage: round(sum(t['seconds'][stage] for t in everything), 4) for stage in STAGES}}
+
+        return {'totals': totals, 'tables': sorted(tables, key=lambda t: t['elapsed_seconds'], reverse=True)}
+
+    def report(self) -> str:
+        '''Summary as text, slowest tables first.'''
+        summary = self.summary()
+        lines = [f"{'table':<32} {'rows':>10} {'MiB':>9} {'rows/s':>10} {'read s':>8} {'conv s':>8} {'write s':>8} {'retries':>7} {'errors':>6} {'batch rows':>17}"]
+        for t in summary['tables']:
+            sizes = t['batch_sizes']
+            batch_rows = f"{sizes['min']}-{sizes['max']}" if sizes else '-'
+            lines.append(f"{str(t['table']):<32} {t['rows']:>10} {t['bytes'] / 2**20:>9.2f} {t['rows_per_sec'] or 0:>10.0f} "
+                         f"{t['seconds']['read']:>8.2f} {t['seconds']['convert']:>8.2f} {t['seconds']['write']:>8.2f} {t['retries']:>7} {t['errors']:>6} {batch_rows:>17}")
+
+        totals = summary['totals']
+        lines.append(f"Total: {totals['rows']} rows, {totals['bytes'] / 2**20:.2f} MiB, metadata {totals['seconds']['metadata']:.2f}s, ddl {totals['seconds']['ddl']:.2f}s, "
+                     f"{totals['retries']} retries, {totals['errors']} errors.")
+
+        return '\n'.join(lines)
+
+_metrics = Metrics(enabled=False)
+
+def get_metrics() -> Metrics:
+
+    return _metrics
+
+def set_metrics(metrics: Metrics):
+    '''Installs the Metrics every instrumented module reports to.'''
+    global _metrics
+    _metrics = metrics
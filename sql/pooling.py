@@ -0,0 +1,125 @@
+import contextlib
+import threading
+
+from sql.SchemaCatalog import invalidate_catalog
+
+DEFAULT_MAX_IDLE = 8        # Idle connections kept per pool; connections released beyond it are closed.
+
+class ConnectionPool:
+    '''Connections opened by connect() and handed back out after release() instead of being reopened. A released
+    connection is rolled back and its cached catalog dropped, so the next user finds it as connect() returned it,
+    with the session settings connect() applied still in effect.'''
+
+    def __init__(self, connect, max_idle=DEFAULT_MAX_IDLE):
+
+        self._connect = connect
+        self._max_idle = max_idle
+        self._idle = []
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self):
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Connection pool is closed.")
+            conn = self._idle.pop() if self._idle else None
+
+        if conn is None:
+            conn = self._connect()
+            if conn is None:
+                return None
+
+        with self._lock:
+            self._in_use.add(id(conn))
+
+        return conn
+
+    def owns(self, conn) -> bool:
+
+        with self._lock:
+            return id(conn) in self._in_use
+
+    def release(self, conn, discard=False):
+        '''Takes conn back; discard closes it instead, e.g. after an error that may have broken the session.'''
+        with self._lock:
+            self._in_use.discard(id(conn))
+
+        invalidate_catalog(conn)
+
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._lock:
+            keep = not discard and not self._closed and len(self._idle) < self._max_idle
+            if keep:
+                self._idle.append(conn)
+
+        if not keep:
+            conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        '''Closes the idle connections; connections still in use are closed when released.'''
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+class PoolRegistry:
+    '''One ConnectionPool per connection key (server and database, file path), created on first use.'''
+
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE):
+
+        self._max_idle = max_idle
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, key, connect) -> ConnectionPool:
+
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = ConnectionPool(connect, self._max_idle)
+            return pool
+
+    def release(self, conn, discard=False):
+        '''Returns conn to the pool it came from; connections opened outside the pools are closed.'''
+        with self._lock:
+            pools = list(self._pools.values())
+
+        for pool in pools:
+            if pool.owns(conn):
+                pool.release(conn, discard)
+                return
+
+        invalidate_catalog(conn)
+        conn.close()
+
+    def close_all(self):
+
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+
+        for pool in pools:
+            pool.close_all()
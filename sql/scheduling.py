@@ -0,0 +1,237 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def build_dependency_graph(tables, get_foreign_keys) -> dict:
+    '''Maps every table to the set of tables it references. Self references and tables outside tables are ignored.'''
+    names = set(tables)
+    graph = {}
+
+    for table in tables:
+        parents = set()
+        for fk in get_foreign_keys(table):
+            if fk.REFERENCED_TABLE_NAME in names and fk.REFERENCED_TABLE_NAME != table:
+                parents.add(fk.REFERENCED_TABLE_NAME)
+        graph[table] = parents
+
+    return graph
+
+def _next_cycle_breaker(pending: dict, done: set):
+    '''Picks the blocked table with the fewest unfinished parents; its remaining references have to be checked after the load.'''
+    return min(pending, key=lambda table: (len(pending[table] - done), table))
+
+def dependency_order(graph: dict) -> list:
+    '''Tables of graph, every one after the tables it references. Cycles are broken as run_in_dependency_order does.'''
+    pending = {table: set(parents) for table, parents in graph.items()}
+    done = set()
+    order = []
+    
+    while pending:
+        ready = sorted(table for table, parents in pending.items() if parents <= done)
+        if not ready:
+            ready = [_next_cycle_breaker(pending, done)]
+        
+        for table in ready:
+            del pending[table]
+            done.add(table)
+            order.append(table)
+    
+    return order
+
+def run_in_dependency_order(graph: dict, task, jobs: int) -> set:
+    '''Runs task(table) on up to jobs threads, starting a table only after all its parents finished.
+    A task returning False stops scheduling new tables. Returns the tables whose parents were not all
+    finished when they started, i.e. the ones whose foreign keys must be validated at the end.'''
+    pending = {table: set(parents) for table, parents in graph.items()}
+    done = set()
+    unordered = set()
+    running = {}
+    stop = False
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            if not stop:
+                ready = [table for table, parents in pending.items() if parents <= done]
+                if not ready and not running and pending:       # Only FK cycles are left.
+                    breaker = _next_cycle_breaker(pending, done)
+                    unordered.add(breaker)
+                    ready = [breaker]
+
+                for table in sorted(ready):
+                    del pending[table]
+                    running[executor.submit(task, table)] = table
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done.add(running.pop(future))
+                if future.result() is False:
+                    stop = True
+
+    return unordered
+
+def split_integer_range(low: int, high: int, partitions: int) -> list:
+    '''Splits [low, high] into at most partitions contiguous, inclusive (low, high) ranges.'''
+    partitions = max(1, min(partitions, high - low + 1))
+    step = (high - low + 1) // partitions
+    remainder = (high - low + 1) % partitions
+
+    ranges = []
+    start = low
+    for i in range(partitions):
+        end = start + step - 1 + (1 if i < remainder else 0)
+        ranges.append((start, end))
+        start = end + 1
+
+    return ranges
+
+def _put(items, item, stop) -> bool:
+
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+def iter_concurrently(producers, queue_size=8):
+    '''Runs every producer (a callable returning an iterable) on its own thread and yields their items
+    as they arrive, through a queue bounded to queue_size items. Producer errors are raised at the end.'''
+    items = queue.Queue(queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def produce(producer):
+        try:
+            for item in producer():
+                if not _put(items, item, stop):
+                    return
+        finally:
+            _put(items, done, stop)
+
+    with ThreadPoolExecutor(max_workers=len(producers)) as executor:
+        futures = [executor.submit(produce, producer) for producer in producers]
+        try:
+            finished = 0
+            while finished < len(producers):
+                item = items.get()
+                if item is done:
+                    finished += 1
+                    continue
+                yield item
+        finally:
+            stop.set()
+
+    for future in futures:
+        future.result()
+
+DEFAULT_QUEUE_SIZE = 4      # Batches buffered between two pipeline stages.
+
+class StageTimings:
+    '''Seconds each pipeline stage spent working, not counting the time it waited on its neighbours.'''
+    
+    def __init__(self):
+        
+        self.read = 0.0
+        self.convert = 0.0
+        self.write = 0.0
+        self.batches = 0
+    
+    def bottleneck(self) -> str:
+        
+        return max(('read', 'convert', 'write'), key=lambda stage: getattr(self, stage))
+    
+    def __str__(self):
+        
+        return f"read {self.read:.2f}s | convert {self.convert:.2f}s | write {self.write:.2f}s | bottleneck: {self.bottleneck()}"
+
+def _get(items, stop):
+    
+    while not stop.is_set():
+        try:
+            return items.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    
+    return None
+
+def run_pipeline(batches, convert, write, queue_size=DEFAULT_QUEUE_SIZE) -> StageTimings:
+    '''Reads batches on a reader thread, passes each through convert on a converter thread and hands the results to
+    write(items) on the calling thread. The stages are joined by queues of at most queue_size batches, so reads overlap
+    writes while memory stays bounded. Errors of any stage stop the others and are raised here.'''
+    timings = StageTimings()
+    read_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+    stop = threading.Event()
+    done = object()
+    errors = []
+    
+    def read():
+        iterator = iter(batches)
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = next(iterator, done)
+                timings.read += time.perf_counter() - start
+                if batch is done or not _put(read_queue, batch, stop):
+                    break
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            _put(read_queue, done, stop)
+    
+    def transform():
+        try:
+            while True:
+                batch = _get(read_queue, stop)
+                if batch is done or batch is None:
+                    break
+                start = time.perf_counter()
+                item = convert(batch)
+                timings.convert += time.perf_counter() - start
+                if not _put(write_queue, item, stop):
+                    break
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            _put(write_queue, done, stop)
+    
+    waited = 0.0
+    
+    def items():
+        nonlocal waited
+        while True:
+            start = time.perf_counter()
+            item = _get(write_queue, stop)
+            waited += time.perf_counter() - start
+            if item is done or item is None:
+                return
+            timings.batches += 1
+            yield item
+    
+    threads = [threading.Thread(target=read, daemon=True), threading.Thread(target=transform, daemon=True)]
+    for thread in threads:
+        thread.start()
+    
+    start = time.perf_counter()
+    try:
+        write(items())
+    finally:
+        timings.write = time.perf_counter() - start - waited
+        stop.set()
+        for thread in threads:
+            thread.join()
+    
+    if errors:
+        raise errors[0]
+    
+    return timings
@@ -0,0 +1,285 @@
+import array
+import datetime
+import decimal
+import json
+import mmap
+import os
+import struct
+import uuid
+import zlib
+
+from sql.Interfaces import Column, Foreign_Key
+
+# Snapshot file layout, one file per table:
+#   MAGIC | u32 format version | u32 header length | header (JSON)
+#   chunks: per chunk, one zlib-compressed block per column
+#   chunk index (JSON): per chunk its offset, row count, and per column its encoding and compressed length
+#   u64 offset of the chunk index | u32 length of the chunk index | MAGIC
+# The header holds the table's Column and Foreign_Key tuples and the dialect they belong to. Values are stored as the
+# source database returned them; converting them into the destination's types is left to the importing side.
+
+MAGIC = b'BANTUSNP'
+FORMAT_VERSION = 1
+SNAPSHOT_EXTENSION = '.bsnap'
+
+DEFAULT_CHUNK_ROWS = 50000
+DEFAULT_COMPRESSION_LEVEL = 6
+
+_PREAMBLE = struct.Struct('<8sII')
+_FOOTER = struct.Struct('<QI8s')
+
+# Column encodings. Columns whose non-null values are all of one type get that type's encoding, others are tagged per value.
+NULL = 'null'
+JSON = 'json'               # bool, int, float and str; JSON round-trips them exactly.
+BYTES = 'bytes'             # Lengths (-1: NULL) followed by the concatenated values.
+DATETIME = 'datetime'
+DATE = 'date'
+TIME = 'time'
+DECIMAL = 'decimal'
+UUID = 'uuid'
+TAGGED = 'tagged'           # [encoding, value] per value.
+
+_JSON_TYPES = (bool, int, float, str)
+
+_TEXT_ENCODINGS = {
+    DATETIME: (datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    DATE: (datetime.date.isoformat, datetime.date.fromisoformat),
+    TIME: (datetime.time.isoformat, datetime.time.fromisoformat),
+    DECIMAL: (str, decimal.Decimal),
+    UUID: (str, uuid.UUID)
+}
+
+def _value_encoding(val) -> str:
+
+    if val is None:
+        return NULL
+    if isinstance(val, _JSON_TYPES):
+        return JSON
+    if isinstance(val, (bytes, bytearray, memoryview)):
+        return BYTES
+    if isinstance(val, datetime.datetime):      # Before date: datetime is a date.
+        return DATETIME
+    if isinstance(val, datetime.date):
+        return DATE
+    if isinstance(val, datetime.time):
+        return TIME
+    if isinstance(val, decimal.Decimal):
+        return DECIMAL
+    if isinstance(val, uuid.UUID):
+        return UUID
+
+    raise TypeError(f"Cannot store a value of type {type(val).__name__} in a snapshot.")
+
+def _column_encoding(values) -> str:
+
+    encodings = {_value_encoding(val) for val in values} - {NULL}
+    if not encodings:
+        return NULL
+
+    return encodings.pop() if len(encodings) == 1 else TAGGED
+
+def _encode_value(encoding, val):
+
+    if encoding == BYTES:
+        return bytes(val).hex()
+    if encoding in _TEXT_ENCODINGS:
+        return _TEXT_ENCODINGS[encoding][0](val)
+    return val
+
+def _decode_value(encoding, val):
+
+    if encoding == BYTES:
+        return bytes.fromhex(val)
+    if encoding in _TEXT_ENCODINGS:
+        return _TEXT_ENCODINGS[encoding][1](val)
+    return val
+
+def encode_column(values) -> tuple:
+    '''(encoding, payload bytes) of a column of values.'''
+    encoding = _column_encoding(values)
+
+    if encoding == NULL:
+        return encoding, struct.pack('<I', len(values))
+
+    if encoding == BYTES:
+        lengths = array.array('q', (-1 if val is None else len(val) for val in values))
+        return encoding, lengths.tobytes() + b''.join(bytes(val) for val in values if val is not None)
+
+    if encoding == TAGGED:
+        items = [None if val is None else [_value_encoding(val), _encode_value(_value_encoding(val), val)] for val in values]
+    elif encoding == JSON:
+        items = values
+    else:
+        to_text = _TEXT_ENCODINGS[encoding][0]
+        items = [None if val is None else to_text(val) for val in values]
+
+    return encoding, json.dumps(items, separators=(',', ':'), ensure_ascii=False).encode()
+
+def decode_column(encoding, payload, num_of_rows) -> list:
+
+    if encoding == NULL:
+        return [None] * num_of_rows
+
+    if encoding == BYTES:
+        lengths = array.array('q')
+        lengths.frombytes(payload[:8 * num_of_rows])
+        values = []
+        offset = 8 * num_of_rows
+        for length in lengths:
+            if length < 0:
+                values.append(None)
+            else:
+                values.append(payload[offset:offset + length])
+                offset += length
+        return values
+
+    items = json.loads(payload)
+
+    if encoding == TAGGED:
+        return [None if item is None else _decode_value(*item) for item in items]
+    if encoding == JSON:
+        return items
+
+    from_text = _TEXT_ENCODINGS[encoding][1]
+    return [None if item is None else from_text(item) for item in items]
+
+def snapshot_path(directory, table) -> str:
+
+    return os.path.join(directory, f'{table}{SNAPSHOT_EXTENSION}')
+
+def list_snapshots(directory) -> list:
+    '''Paths of the snapshot files in directory.'''
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SNAPSHOT_EXTENSION))
+
+class SnapshotWriter:
+    '''Writes the rows of one table into a snapshot file a chunk at a time. The file is written under a temporary
+    name and renamed on close(), so an interrupted export leaves no truncated snapshot behind.'''
+
+    def __init__(self, path, table, dialect, columns, primary_key=None, foreign_keys=(), compression_level=DEFAULT_COMPRESSION_LEVEL):
+
+        self.path = path
+        self.num_of_rows = 0
+        self._compression_level = compression_level
+        self._num_of_columns = len(columns)
+        self._chunks = []
+        self._temp_path = f'{path}.tmp'
+
+        header = json.dumps({
+            'table': table,
+            'dialect': dialect,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'primary_key': primary_key,
+            'columns': [column._asdict() for column in columns],
+            'foreign_keys': [fk._asdict() for fk in foreign_keys]
+        }, default=str).encode()
+
+        self._file = open(self._temp_path, 'wb')
+        self._file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        self._file.write(header)
+
+    def write_chunk(self, rows):
+
+        if not rows:
+            return
+
+        offset = self._file.tell()
+        encodings = []
+        lengths = []
+        for values in zip(*rows):
+            encoding, payload = encode_column(list(values))
+            block = zlib.compress(payload, self._compression_level)
+            self._file.write(block)
+            encodings.append(encoding)
+            lengths.append(len(block))
+
+        if len(encodings) != self._num_of_columns:
+            raise ValueError(f"Rows have {len(encodings)} values, the snapshot has {self._num_of_columns} columns.")
+
+        self._chunks.append({'offset': offset, 'rows': len(rows), 'encodings': encodings, 'lengths': lengths})
+        self.num_of_rows += len(rows)
+
+    def close(self):
+
+        if self._file.closed:
+            return
+
+        index = json.dumps(self._chunks).encode()
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_FOOTER.pack(index_offset, len(index), MAGIC))
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def discard(self):
+
+        self._file.close()
+        os.remove(self._temp_path)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+class SnapshotReader:
+    '''Reads a snapshot file through a memory map; chunks are decompressed one at a time as they are iterated.'''
+
+    def __init__(self, path):
+
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:      # Empty file.
+            self._file.close()
+            raise ValueError(f"{path} is not a snapshot file.")
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC or self._map[-8:] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file.")
+        if version > FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} has snapshot format version {version}; this version reads up to {FORMAT_VERSION}.")
+
+        header = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        self.table = header['table']
+        self.dialect = header['dialect']
+        self.created = header['created']
+        self.primary_key = header['primary_key']
+        self.columns = [Column(**column) for column in header['columns']]
+        self.foreign_keys = [Foreign_Key(**fk) for fk in header['foreign_keys']]
+
+        index_offset, index_length, _ = _FOOTER.unpack_from(self._map, len(self._map) - _FOOTER.size)
+        self._chunks = json.loads(self._map[index_offset:index_offset + index_length])
+        self.num_of_rows = sum(chunk['rows'] for chunk in self._chunks)
+
+    def iter_chunks(self):
+        '''Yields the rows of the snapshot as lists of tuples, one list per chunk written.'''
+        for chunk in self._chunks:
+            offset = chunk['offset']
+            columns = []
+            for encoding, length in zip(chunk['encodings'], chunk['lengths']):
+                payload = zlib.decompress(self._map[offset:offset + length])
+                columns.append(decode_column(encoding, payload, chunk['rows']))
+                offset += length
+            yield list(zip(*columns))
+
+    def close(self):
+
+        if not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+
+        self.close()
@@ -1,7 +1,44 @@
+import atexit
 import os
 import sqlite3
+import zlib
 
-def get_connection(sqlite_path: str): 
+from sql.pooling import PoolRegistry
+from sql.SchemaCatalog import invalidate_catalog
+
+# Settings for a throwaway migration target: in-memory rollback journal (OFF would break ROLLBACK), no fsync, a 1 GiB page cache.
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -1048576,     # Negative values are KiB.
+    'temp_store': 'MEMORY'
+}
+
+# Applied once to every pooled connection. Pooled connections move between threads, so they are opened with
+# check_same_thread=False; busy_timeout makes a writer wait for a lock another connection holds instead of failing.
+SESSION_PRAGMAS = {
+    'busy_timeout': 30000       # Milliseconds.
+}
+
+# Registered on every connection: a hash of key values that is the same in every process (unlike hash()), which
+# sql.subsetting samples rows by.
+KEY_HASH_FUNCTION = 'bantu_key_hash'
+
+# An in-memory database shared by the connections of this process and attached to each of them, where sql.subsetting
+# stages the keys a long condition selects. TEMP tables are seen by one connection only, the readers use others.
+STAGING_SCHEMA = 'bantu_stage'
+_STAGING_URI = f'file:{STAGING_SCHEMA}?mode=memory&cache=shared'
+
+_pools = PoolRegistry()
+
+def key_hash(value):
+    
+    if value is None:
+        return None
+    
+    return zlib.crc32(value if isinstance(value, bytes) else str(value).encode())
+
+def get_connection(sqlite_path: str, check_same_thread=True): 
     
     try:
         dirname = os.path.dirname(sqlite_path)
@@ -10,7 +47,9 @@ def get_connection(sqlite_path: str):
             create_dir_if_not_exists(dirname)
             
         if os.path.exists(dirname):
-            conn = sqlite3.connect(sqlite_path)
+            conn = sqlite3.connect(sqlite_path, check_same_thread=check_same_thread)
+            conn.create_function(KEY_HASH_FUNCTION, 1, key_hash, deterministic=True)
+            conn.execute(f"ATTACH DATABASE '{_STAGING_URI}' AS [{STAGING_SCHEMA}]")
             return conn
     except:
         raise
@@ -29,3 +68,63 @@ def create_dir_if_not_exists(dirname: str) -> str:
             print(f"Permission denied: Unable to create '{dirname}'.")
         except Exception as e:
             print(f"An error occurred: {e}")
+
+def enable_bulk_load(conn) -> dict:
+    '''Applies BULK_LOAD_PRAGMAS and returns the previous values for disable_bulk_load.'''
+    conn.commit()       # journal_mode cannot change inside a transaction.
+    cursor = conn.cursor()
+    
+    previous = {}
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        previous[pragma] = cursor.execute(f'PRAGMA {pragma};').fetchone()[0]
+        cursor.execute(f'PRAGMA {pragma} = {value};')
+        
+    return previous
+
+def disable_bulk_load(conn, previous: dict, optimize=True):
+    '''Restores the settings saved by enable_bulk_load and refreshes the query planner statistics.'''
+    conn.commit()
+    cursor = conn.cursor()
+    
+    for pragma, value in previous.items():
+        cursor.execute(f'PRAGMA {pragma} = {value};')
+    
+    if optimize:
+        cursor.execute('ANALYZE;')
+        cursor.execute('PRAGMA optimize;')
+        conn.commit()
+
+def apply_session_pragmas(conn):
+    
+    cursor = conn.cursor()
+    for pragma, value in SESSION_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value};')
+    cursor.close()
+
+def get_pool(sqlite_path: str):
+    '''Pool of connections to the database file at sqlite_path with SESSION_PRAGMAS applied.'''
+    def connect():
+        conn = get_connection(sqlite_path, check_same_thread=False)
+        apply_session_pragmas(conn)
+        return conn
+    
+    return _pools.get_pool(os.path.abspath(sqlite_path), connect)
+
+def acquire_connection(sqlite_path: str):
+    '''Pooled connection; hand it back with release_connection.'''
+    return get_pool(sqlite_path).acquire()
+
+def release_connection(conn, discard=False):
+    
+    _pools.release(conn, discard)
+
+def close_connection(conn):
+    '''Closes a connection opened outside the pools, dropping its cached catalog with it.'''
+    invalidate_catalog(conn)
+    conn.close()
+
+def close_pools():
+    
+    _pools.close_all()
+
+atexit.register(close_pools)
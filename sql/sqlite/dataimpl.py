@@ -1,23 +1,45 @@
-import datetime
-import decimal
+import codecs
+import contextlib
+import sqlite3
+import uuid
 from sqlite3 import OperationalError, ProgrammingError, IntegrityError
 
-from bdatetime.bdatetime import to_julian
+from sql.batching import rows_per_statement, chunked, BatchController
+from sql.checksums import RowDigest
+from sql.converters import build_row_converter, build_batch_converter, SQLITE
+from sql.metrics import get_metrics
+from sql.scheduling import split_integer_range
+from sql.sqlite.connectionimpl import KEY_HASH_FUNCTION, STAGING_SCHEMA
 from sql.sqlite.schemaimpl import get_columns, get_primary_key
 
-def select_all(conn, table):
-    
-    columns = get_columns(conn, table)
+DEFAULT_BATCH_SIZE = 5000
+ROW_DIGEST_FUNCTION = 'bantu_row_digest'
+
+def build_select_script(table, columns, lob_columns=(), lob_limit=None, omitted_columns=()) -> str:
+    '''Values of lob_columns longer than lob_limit are selected as an empty value of their type, to be streamed separately.
+    omitted_columns are selected as NULL, so they are never read but the rows keep the table's shape.'''
     length = len(columns)
-    pk = None
     
     sql = "SELECT "
     for i in range(length):
-        sql += f"[{columns[i].COLUMN_NAME}]"
+        name = columns[i].COLUMN_NAME
+        if name in omitted_columns:
+            sql += f"NULL AS [{name}]"
+        elif lob_limit is not None and name in lob_columns:
+            sql += f"CASE WHEN length([{name}]) > {int(lob_limit)} THEN substr([{name}], 1, 0) ELSE [{name}] END"
+        else:
+            sql += f"[{name}]"
         if i < length - 1:
             sql += ", "
         
     sql += f" FROM [{table}]"
+    
+    return sql
+
+def select_all(conn, table):
+    
+    columns = get_columns(conn, table)
+    sql = build_select_script(table, columns)
         
     cursor = conn.cursor()
     
@@ -31,8 +53,179 @@ def select_all(conn, table):
         print(error)
         
     return rows
+
+def build_key_condition(pk, key_range=None, after_key=None):
+    '''WHERE clause (or '') and its parameters limiting pk to an inclusive key_range and/or to keys after after_key.'''
+    conditions = []
+    params = []
+    
+    if key_range:
+        conditions.append(f"[{pk}] BETWEEN ? AND ?")
+        params.extend(key_range)
+    if after_key is not None:
+        conditions.append(f"[{pk}] > ?")
+        params.append(after_key)
+    
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params)
+
+def build_key_hash(column) -> str:
+    '''SQL expression of a non-negative integer hash of column, stable across runs; sql.subsetting samples rows by it.'''
+    return f"{KEY_HASH_FUNCTION}([{column}])"
+
+def add_condition(where, condition) -> str:
+    '''where (a WHERE clause or '') also requiring condition, an SQL expression, when given.'''
+    if not condition:
+        return where
+    
+    return f"{where} AND ({condition})" if where else f" WHERE ({condition})"
+
+def stage_keys(conn, table, columns, condition=None) -> str:
+    '''Copies the distinct values of columns in the rows of table satisfying condition into a new table of the staging
+    database (sql.sqlite.connectionimpl.STAGING_SCHEMA) and returns its name. sql.subsetting selects from it instead of
+    repeating a long condition; drop_staged_keys drops it.'''
+    name = f"[{STAGING_SCHEMA}].[keys_{uuid.uuid4().hex}]"
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE TABLE {name} AS SELECT DISTINCT {', '.join(f'[{column}]' for column in columns)} FROM [{table}]" + add_condition("", condition))
+    conn.commit()
+    
+    return name
+
+def drop_staged_keys(conn, names):
+    
+    cursor = conn.cursor()
+    for name in names:
+        cursor.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.commit()
+
+def iter_rows(conn, table, batch_size=DEFAULT_BATCH_SIZE, key_range=None, after_key=None, ordered=False, key_column=None,
+              lob_columns=(), lob_limit=None, condition=None, omitted_columns=()):
+    '''Yields the rows of table in lists of at most batch_size rows, so only one batch is held in memory.
+    key_range=(low, high) limits the rows to an inclusive primary key range, after_key to the keys greater than it.
+    Rows are read in primary key order when ordered or resuming after a key, which checkpoints rely on.
+    key_column puts the range, and the order, on another column, e.g. a watermark.
+    Values of lob_columns longer than lob_limit come back empty; iter_lob_chunks reads them.
+    condition is an SQL expression the rows must also satisfy and omitted_columns come back NULL (sql.subsetting).'''
+    columns = get_columns(conn, table)
+    sql = build_select_script(table, columns, lob_columns, lob_limit, omitted_columns)
+    pk = None
+    
+    if key_range or after_key is not None or ordered:
+        pk = key_column or get_primary_key(conn, table)
+    
+    where, params = build_key_condition(pk, key_range, after_key)
+    sql += add_condition(where, condition)
+    if pk and (ordered or after_key is not None):
+        sql += f" ORDER BY [{pk}]"
+    
+    cursor = conn.cursor()
+    try:
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql)
+    except OperationalError as op_error:
+        print(op_error)
+        return
+    
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+    
+def delete_rows(conn, table, key_range=None, after_key=None, pk=None) -> int:
+    '''Deletes the rows of table in key_range and/or after after_key, or all of them; used to trim a partly copied
+    table back to its last checkpoint. pk names the key column of tables whose primary key is not built yet.
+    Returns the number of rows deleted.'''
+    if key_range or after_key is not None:
+        pk = pk or get_primary_key(conn, table)
+    where, params = build_key_condition(pk, key_range, after_key)
+    
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(f"DELETE FROM [{table}]" + where, params)
+    else:
+        cursor.execute(f"DELETE FROM [{table}]")
+    conn.commit()
     
-def insert_one_by_one(conn, table, rows, skip_primary_key=True) -> int:
+    return cursor.rowcount
+
+def count_rows_in_range(conn, table, key_range=None, key_column=None) -> int:
+    '''Exact row count of table, or of an inclusive key_range of it.'''
+    pk = (key_column or get_primary_key(conn, table)) if key_range else None
+    where, params = build_key_condition(pk, key_range)
+    
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(f"SELECT COUNT(*) FROM [{table}]" + where, params)
+    else:
+        cursor.execute(f"SELECT COUNT(*) FROM [{table}]")
+    
+    return cursor.fetchone()[0]
+
+def get_chunk_digest(conn, table, columns, kinds, key_range=None, key_column=None) -> tuple:
+    '''(count, checksum) of the rows of table, or of an inclusive key_range of it, summed in SQLite by
+    sql.checksums.RowDigest alike sql.sqlserver.dataimpl.get_chunk_digest.'''
+    where, params = build_key_condition(key_column, key_range)
+    conn.create_aggregate(ROW_DIGEST_FUNCTION, -1, RowDigest)
+    
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*), {ROW_DIGEST_FUNCTION}(?, {', '.join(f'[{column}]' for column in columns)}) FROM [{table}]" + where,
+                   (','.join(kinds), ) + params)
+    count, checksum = cursor.fetchone()
+    
+    return count, int(checksum or 0)
+
+def get_key_bounds(conn, table, key_column) -> tuple:
+    '''(MIN, MAX) of key_column, (None, None) for an empty table.'''
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN([{key_column}]), MAX([{key_column}]) FROM [{table}]")
+    
+    return tuple(cursor.fetchone())
+
+def delete_keys(conn, table, key_column, keys, chunk_size=500) -> int:
+    '''Deletes the rows whose key_column value is in keys. Returns the number of rows deleted.'''
+    cursor = conn.cursor()
+    rows_deleted = 0
+    
+    for chunk in chunked(keys, chunk_size):
+        cursor.execute(f"DELETE FROM [{table}] WHERE [{key_column}] IN ({', '.join(['?'] * len(chunk))})", tuple(chunk))
+        rows_deleted += cursor.rowcount
+    conn.commit()
+    
+    return rows_deleted
+
+def count_rows(conn, table) -> int:
+    
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM [{table}]")
+    
+    return cursor.fetchone()[0]
+
+def get_key_ranges(conn, table, partitions) -> list:
+    '''Splits table into at most partitions inclusive primary key ranges, or returns None when it has no primary key.
+    Integer keys are split arithmetically between MIN and MAX, other keys at NTILE boundaries.'''
+    pk = get_primary_key(conn, table)
+    if not pk:
+        return None
+    
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN([{pk}]), MAX([{pk}]) FROM [{table}]")
+    low, high = cursor.fetchone()
+    
+    if low is None:
+        return None
+    if isinstance(low, int) and isinstance(high, int):
+        return split_integer_range(low, high, partitions)
+    
+    cursor.execute(f"SELECT MIN(k), MAX(k) FROM (SELECT [{pk}] AS k, NTILE({int(partitions)}) OVER (ORDER BY [{pk}]) AS tile FROM [{table}]) AS tiles GROUP BY tile ORDER BY tile")
+    
+    return [tuple(row) for row in cursor.fetchall()]
+
+def insert_one_by_one(conn, table, rows, skip_primary_key=True, source_columns=None) -> int:
 
     cursor = conn.cursor()
     rows_inserted = 0
@@ -43,6 +236,8 @@ def insert_one_by_one(conn, table, rows, skip_primary_key=True) -> int:
     if skip_primary_key:
         pk = get_primary_key(conn, table)
     
+    convert = build_row_converter(source_columns, columns, SQLITE, (pk, ))
+    
     for row in rows:
         sql = f"INSERT INTO [{table}] "
         
@@ -66,23 +261,8 @@ def insert_one_by_one(conn, table, rows, skip_primary_key=True) -> int:
             else:
                 sql += ")"
         
-        data_list = []
-        for k in range(len(row)):
-            if skip_primary_key and pk and columns[k].COLUMN_NAME == pk:
-                continue
-            
-            val = row[k]
-            if isinstance(val, datetime.datetime):
-                val = to_julian(val)
-            if isinstance(val, str) and '\'' in val:
-                val = val.replace('\'', '\'\'')     # Escape from ' as '' in sqlite-style, otherwise it's an exception.
-            if isinstance(val, decimal.Decimal):
-                val = str(val)          # Convert sqlite unsupported type decimal to text.
-                
-            data_list.append(val)
-        
         try:
-            cursor.execute(sql, tuple(data_list))       # tuple(row) doesn't work because of unsupported types between sqlserver and sqlite. e.g. type decimal.
+            cursor.execute(sql, convert(row))       # tuple(row) doesn't work because of unsupported types between sqlserver and sqlite. e.g. type decimal.
             conn.commit()
             rows_inserted += 1
         
@@ -99,82 +279,216 @@ def insert_one_by_one(conn, table, rows, skip_primary_key=True) -> int:
             
     return rows_inserted
     
-def insert_many(conn, table, rows, skip_primary_key=False) -> int:
+def get_max_parameters(conn) -> int:
     
+    if hasattr(conn, 'getlimit'):       # Python 3.11+
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    
+    # SQLITE_MAX_VARIABLE_NUMBER defaults to 999 before SQLite 3.32.0 and 32766 after.
+    return 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+def build_insert_many_script(table, columns, num_of_rows, primary_key=None) -> str:
+    
+    names = [f"[{column.COLUMN_NAME}]" for column in columns]
+    values = ", ".join("NULL" if column.COLUMN_NAME == primary_key else "?" for column in columns)
+    
+    return f"INSERT INTO [{table}] ({', '.join(names)}) VALUES " + ", ".join([f"({values})"] * num_of_rows) + ";"
+
+def build_insert_script(table, columns, primary_key=None) -> str:
+    
+    names = [f"[{column.COLUMN_NAME}]" for column in columns]
+    values = ", ".join("NULL" if column.COLUMN_NAME == primary_key else "?" for column in columns)
+    
+    return f"INSERT INTO [{table}] ({', '.join(names)}) VALUES ({values})"
+
+def insert_batched(conn, table, rows, batch_size=DEFAULT_BATCH_SIZE, skip_primary_key=False, source_columns=None, controller=None,
+                   on_commit=None, lock=None) -> int:
+    '''Inserts rows (any iterable) via executemany on one prepared statement, one transaction per batch. Batches are
+    sized by controller (sql.batching.BatchController), shared by calls writing the same table; without one, by a
+    controller starting at batch_size. After every batch, committed or rolled back, on_commit(rows_read, last_row) is
+    called with the number of rows read so far and the last of them. lock, if any, is held while a batch is written.'''
     cursor = conn.cursor()
     columns = get_columns(conn, table)
-    row_length = len(rows)
-    col_length = len(columns)
     pk = None
     
     if skip_primary_key:
         pk = get_primary_key(conn, table)
     
-    for row in rows:
-        sql = f"INSERT INTO [{table}] "
+    sql = build_insert_script(table, columns, pk)
+    convert = build_batch_converter(source_columns, columns, SQLITE, (pk, ))
+    rows_inserted = 0
+    
+    metrics = get_metrics()
+    owned = controller is None
+    if owned:
+        controller = BatchController(batch_size, len(columns), table)
+    
+    rows_read = 0
+    for batch in controller.batches(rows):
+        params = convert(batch)
+        with lock or contextlib.nullcontext():
+            try:
+                with metrics.batch(table, params), controller.measure(batch):
+                    cursor.executemany(sql, params)
+                    conn.commit()
+                rows_inserted += len(batch)
+                
+            except (OperationalError, ProgrammingError, IntegrityError) as error:
+                print(f'Table: {table} | Rows: {len(batch)} | Error: {error}')
+                metrics.error(table, error)
+                controller.record_error()
+                conn.rollback()
         
-        sql += "("
-        for i in range(col_length):
-            sql += f"[{columns[i].COLUMN_NAME}]"
-            if i < col_length - 1:
-                sql += ", "
-            else:
-                sql += ") "
+        rows_read += len(batch)
+        if on_commit:
+            on_commit(rows_read, batch[-1])
+    
+    if owned:
+        metrics.batch_sizes(table, controller.summary())
+    
+    return rows_inserted
 
-    sql += "VALUES"
-    for i in range(row_length):         # Create a query string with multiple lines of values
-        sql += "("
-        for k in range(col_length):
-            if skip_primary_key and pk and columns[k].COLUMN_NAME == pk:
-                sql += "NULL"
-            else:
-                sql += "?"
-                
-            if k < col_length - 1:
-                sql += ", "
-            else:
-                sql += ")"
-                
-        if i < row_length - 1:
-            sql += ","
-        else:
-            sql += ";"
+def get_max_value(conn, table, column):
+    
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX([{column}]) FROM [{table}]")
+    
+    return cursor.fetchone()[0]
 
-    data_dict = {}
-    for row in rows:
-        temp_dict = {}
-        
-        for k in range(col_length):
-            if skip_primary_key and pk and columns[k].COLUMN_NAME == pk:
-                continue
-            
-            val = row[k]
-            if isinstance(val, datetime.datetime):
-                val = to_julian(val)
-            if isinstance(val, str) and '\'' in val:
-                val = val.replace('\'', '\'\'')     # Escape from ' as '' in sqlite-style, otherwise it's an exception.
-            if isinstance(val, decimal.Decimal):
-                val = str(val)                      # Convert sqlite unsupported type decimal to text.
-            
-            temp_dict[columns[k].COLUMN_NAME] = val
+def build_upsert_script(table, columns, key_column) -> str:
+    
+    names = [f"[{column.COLUMN_NAME}]" for column in columns]
+    updates = [f"{name} = excluded.{name}" for name in names if name != f"[{key_column}]"]
+    action = "DO UPDATE SET " + ", ".join(updates) if updates else "DO NOTHING"
+    
+    return f"INSERT INTO [{table}] ({', '.join(names)}) VALUES ({', '.join(['?'] * len(names))}) ON CONFLICT ([{key_column}]) {action}"
+
+def upsert_batched(conn, table, rows, key_column, batch_size=DEFAULT_BATCH_SIZE, source_columns=None) -> int:
+    '''Inserts rows, or updates the ones whose key_column value is already in table, one transaction per batch.
+    Batches are sized by a BatchController starting at batch_size.'''
+    cursor = conn.cursor()
+    columns = get_columns(conn, table)
+    
+    sql = build_upsert_script(table, columns, key_column)
+    convert = build_batch_converter(source_columns, columns, SQLITE)
+    rows_upserted = 0
+    
+    metrics = get_metrics()
+    controller = BatchController(batch_size, len(columns), table)
+    for batch in controller.batches(rows):
+        try:
+            params = convert(batch)
+            with metrics.batch(table, params), controller.measure(batch):
+                cursor.executemany(sql, params)
+                conn.commit()
+            rows_upserted += len(batch)
             
-        data_dict[row[0]] = temp_dict
-        temp_dict = None
-        
-    sql_tuples = [v2 for k1, v1 in data_dict.items() for k2, v2 in v1.items()]
+        except (OperationalError, ProgrammingError, IntegrityError) as error:
+            print(f'Table: {table} | Rows: {len(batch)} | Error: {error}')
+            metrics.error(table, error)
+            controller.record_error()
+            conn.rollback()
+    
+    metrics.batch_sizes(table, controller.summary())
+    
+    return rows_upserted
+
+def _get_rowid(conn, table, key_column, key):
+    
+    row = conn.execute(f"SELECT rowid FROM [{table}] WHERE [{key_column}] = ?", (key, )).fetchone()
+    
+    return row[0] if row else None
+
+def get_large_values(conn, table, column, key_column, lob_limit, condition=None) -> list:
+    '''(key, size in bytes) of the rows, among those satisfying condition, whose column value is longer than lob_limit.'''
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT [{key_column}], length(CAST([{column}] AS BLOB)) FROM [{table}]" + add_condition(f" WHERE length([{column}]) > ?", condition), 
+                   (lob_limit, ))
+    
+    return cursor.fetchall()
+
+def iter_lob_chunks(conn, table, column, key_column, key, chunk_size, as_text=False):
+    '''Yields the value of column in the row with key in pieces of chunk_size bytes through SQLite's incremental blob
+    I/O, without reading it whole. Text is yielded as str, decoded across the piece boundaries.'''
+    decoder = codecs.getincrementaldecoder('UTF-8')() if as_text else None
+    
+    with conn.blobopen(table, column, _get_rowid(conn, table, key_column, key), readonly=True) as blob:
+        while True:
+            chunk = blob.read(chunk_size)
+            if not chunk:
+                break
+            yield decoder.decode(chunk) if decoder else chunk
+    
+    if decoder:
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+def write_lob(conn, table, column, key_column, key, chunks, size=None):
+    '''Writes chunks as the value of column in the row with key. With the size of a binary value, the value is
+    allocated once with zeroblob() and filled through incremental blob I/O; text, whose size in UTF-8 is not known
+    ahead, is appended piece by piece.'''
+    cursor = conn.cursor()
     try:
-        cursor.execute(sql, tuple(sql_tuples))      
+        if size is not None:
+            cursor.execute(f"UPDATE [{table}] SET [{column}] = zeroblob(?) WHERE [{key_column}] = ?", (size, key))
+            with conn.blobopen(table, column, _get_rowid(conn, table, key_column, key)) as blob:
+                for chunk in chunks:
+                    blob.write(chunk)
+        else:
+            cursor.execute(f"UPDATE [{table}] SET [{column}] = '' WHERE [{key_column}] = ?", (key, ))
+            for chunk in chunks:
+                cursor.execute(f"UPDATE [{table}] SET [{column}] = [{column}] || ? WHERE [{key_column}] = ?", (chunk, key))
         conn.commit()
-    
-    except OperationalError as o_error:
-        print(f'SQL: {sql} | Error: {o_error}')
-    except ProgrammingError as p_error:
-        print(f'SQL: {sql} | Error: {p_error}')
-    except IntegrityError as i_error:
-        print(f'SQL: {sql} | Error: {i_error}')
-        conn.rollback()
-    except Exception as error:
-        print(f'SQL: {sql} | Error: {error}')
+        
+    except (OperationalError, ProgrammingError, IntegrityError) as error:
+        print(f'Table: {table} | Column: {column} | Key: {key} | Error: {error}')
+        get_metrics().error(table, error)
         conn.rollback()
+
+def insert_many(conn, table, rows, skip_primary_key=False, source_columns=None) -> int:
+    '''Inserts rows with multi-row VALUES statements sized to stay under SQLITE_MAX_VARIABLE_NUMBER. A statement
+    rejected for its rows (IntegrityError) is skipped; other errors roll back the transaction and are raised.
+    Returns the number of rows inserted.'''
+    cursor = conn.cursor()
+    columns = get_columns(conn, table)
+    pk = None
+    
+    if skip_primary_key:
+        pk = get_primary_key(conn, table)
+    
+    num_of_params = len([column for column in columns if column.COLUMN_NAME != pk])
+    chunk_size = rows_per_statement(num_of_params, get_max_parameters(conn))
     
-    return len(data_dict)
+    convert = build_batch_converter(source_columns, columns, SQLITE, (pk, ))
+    scripts = {}        # Statement text per chunk shape; every chunk but the last shares one.
+    rows_inserted = 0
+    
+    metrics = get_metrics()
+    for chunk in chunked(rows, chunk_size):
+        sql = scripts.get(len(chunk))
+        if sql is None:
+            sql = scripts[len(chunk)] = build_insert_many_script(table, columns, len(chunk), pk)
+        
+        params = []
+        for row in convert(chunk):
+            params.extend(row)
+        
+        try:
+            with metrics.batch(table, chunk):
+                cursor.execute(sql, params)
+            rows_inserted += len(chunk)
+        
+        except IntegrityError as i_error:
+            # SQLite undoes the failed statement alone; the chunks before it stay in the transaction.
+            print(f'Table: {table} | Rows: {len(chunk)} | Error: {i_error}')
+            metrics.error(table, i_error)
+        except Exception as error:
+            print(f'Table: {table} | Rows: {len(chunk)} | Error: {error}')
+            metrics.error(table, error)
+            conn.rollback()
+            raise
+            
+    conn.commit()
+    
+    return rows_inserted
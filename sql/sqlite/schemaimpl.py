@@ -1,10 +1,11 @@
-from collections import deque
-
+from sql.batching import chunked
 from sql.sqlite.connectionimpl import get_connection
-from sql.Interfaces import Column, Foreign_Key, sqlite_to_sqlserver_types_dict
+from sql.Interfaces import Column, Foreign_Key, Index, sqlite_to_sqlserver_types_dict
+from sql.SchemaCatalog import SchemaCatalog, get_catalog, invalidate_catalog
 
 _system_databases = ('sqlite_sequence')
-CREATION_DEQUE = deque()
+
+DDL_BATCH_SIZE = 100        # CREATE TABLE statements per transaction.
 
 def is_table_exists(conn, table):
     
@@ -34,7 +35,7 @@ def get_tables(conn):
     
     return tables
 
-def get_columns(conn, table_name):
+def query_columns(conn, table_name):
     
     columns = []
     cmd = 'SELECT * FROM pragma_table_info(?);'     # f'PRAGMA table_info({table_name});'
@@ -44,25 +45,28 @@ def get_columns(conn, table_name):
     rows = curr.fetchall()
     
     for item in rows:
-        is_nullable = item[3] != 1      # item[3] iş isnotnull. I convert it into is_nullable for consistency with other databases.
-        is_pk = item[5] == 1
-
-        column = Column(                    # table_info            # converted
-            TABLE_NAME=table_name,          # NOT-EXISTS            TABLE_NAME
-            ORDINAL_POSITION=item[0],       # cid                   ORDINAL_POSITION
-            COLUMN_NAME=item[1],            # name                  COLUMN_NAME
-            DATA_TYPE=item[2],              # type                  DATA_TYPE
-            IS_NULLABLE=is_nullable,        # notnull     =not=     IS_NULLABLE
-            DEFAULT_VALUE=item[4],          # dflt_value            DEFAULT_VALUE
-            IS_PK=is_pk,                    # pk                    IS_PK
-            CHARACTER_MAXIMUM_LENGTH=None,  # NOT EXISTS
-            DATETIME_PRECISION=None         # NOT EXISTS
-            )
-        columns.append(column)
+        columns.append(_to_column(table_name, item))
         
     return columns
 
-def get_primary_key(conn, table_name):
+def _to_column(table_name, item) -> Column:
+    
+    is_nullable = item[3] != 1      # item[3] iş isnotnull. I convert it into is_nullable for consistency with other databases.
+    is_pk = item[5] == 1
+
+    return Column(                      # table_info            # converted
+        TABLE_NAME=table_name,          # NOT-EXISTS            TABLE_NAME
+        ORDINAL_POSITION=item[0],       # cid                   ORDINAL_POSITION
+        COLUMN_NAME=item[1],            # name                  COLUMN_NAME
+        DATA_TYPE=item[2],              # type                  DATA_TYPE
+        IS_NULLABLE=is_nullable,        # notnull     =not=     IS_NULLABLE
+        DEFAULT_VALUE=item[4],          # dflt_value            DEFAULT_VALUE
+        IS_PK=is_pk,                    # pk                    IS_PK
+        CHARACTER_MAXIMUM_LENGTH=None,  # NOT EXISTS
+        DATETIME_PRECISION=None         # NOT EXISTS
+        )
+
+def query_primary_key(conn, table_name):
     
     pk_column = None
     cmd = 'SELECT name FROM pragma_table_info(?) WHERE pk = 1';
@@ -76,7 +80,7 @@ def get_primary_key(conn, table_name):
         
     return pk_column
 
-def get_foreign_keys(conn, table_name):
+def query_foreign_keys(conn, table_name):
     
     foreign_keys = []
     cmd = 'SELECT * FROM pragma_foreign_key_list(?);'
@@ -86,22 +90,133 @@ def get_foreign_keys(conn, table_name):
     row = cursor.fetchall()
 
     for item in row:
-        fk = Foreign_Key(                                   # foreign_key_list      # converted
-            ID=item[0],                                     # id                    ID
-            SEQ=item[1],                                    # seq                   SEQ
-            REFERENCING_TABLE_NAME=table_name,              # NOT EXISTS            REFERENCING_TABLE_NAME
-            REFERENCED_TABLE_NAME=item[2],                  # table                 REFERENCED_TABLE_NAME
-            REFERENCING_COLUMN_NAME=item[3],                # from                  REFERENCING_COLUMN_NAME
-            REFERENCED_COLUMN_NAME=item[4],                 # to                    REFERENCED_COLUMN_NAME
-            ON_UPDATE=item[5],                              # on_update             ON_UPDATE
-            ON_DELETE=item[6],                              # on_delete             ON_DELETE
-            MATCH=item[7],                                  # match                 MATCH
-            CONSTRAINT_NAME=f'FK_{table_name}_{item[3]}'    # NOT EXISTS
-            )
-        foreign_keys.append(fk)
+        foreign_keys.append(_to_foreign_key(table_name, item))
         
     return foreign_keys
 
+def _to_foreign_key(table_name, item) -> Foreign_Key:
+    
+    return Foreign_Key(                                 # foreign_key_list      # converted
+        ID=item[0],                                     # id                    ID
+        SEQ=item[1],                                    # seq                   SEQ
+        REFERENCING_TABLE_NAME=table_name,              # NOT EXISTS            REFERENCING_TABLE_NAME
+        REFERENCED_TABLE_NAME=item[2],                  # table                 REFERENCED_TABLE_NAME
+        REFERENCING_COLUMN_NAME=item[3],                # from                  REFERENCING_COLUMN_NAME
+        REFERENCED_COLUMN_NAME=item[4],                 # to                    REFERENCED_COLUMN_NAME
+        ON_UPDATE=item[5],                              # on_update             ON_UPDATE
+        ON_DELETE=item[6],                              # on_delete             ON_DELETE
+        MATCH=item[7],                                  # match                 MATCH
+        CONSTRAINT_NAME=f'FK_{table_name}_{item[3]}'    # NOT EXISTS
+        )
+
+def load_catalog(conn) -> SchemaCatalog:
+    '''Reads columns, primary keys and foreign keys of all tables with one query each.'''
+    columns = {}
+    primary_keys = {}
+    foreign_keys = {}
+    
+    cursor = conn.cursor()
+    cursor.execute('''SELECT m.name, p.* FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p 
+                      WHERE m.type = 'table' ORDER BY m.name, p.cid;''')
+    for item in cursor.fetchall():
+        column = _to_column(item[0], item[1:])
+        columns.setdefault(item[0], []).append(column)
+        if item[6] == 1:
+            primary_keys[item[0]] = column.COLUMN_NAME
+    
+    cursor.execute('''SELECT m.name, f.* FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f 
+                      WHERE m.type = 'table' ORDER BY m.name, f.id, f.seq;''')
+    for item in cursor.fetchall():
+        foreign_keys.setdefault(item[0], []).append(_to_foreign_key(item[0], item[1:]))
+        
+    return SchemaCatalog(columns, primary_keys, foreign_keys)
+
+def get_schema_catalog(conn) -> SchemaCatalog:
+    
+    return get_catalog(conn, load_catalog)
+
+def get_columns(conn, table_name):
+    
+    catalog = get_schema_catalog(conn)
+    if table_name not in catalog:       # Created after the snapshot was taken.
+        return query_columns(conn, table_name)
+    
+    return list(catalog.get_columns(table_name))
+
+def get_primary_key(conn, table_name):
+    
+    catalog = get_schema_catalog(conn)
+    if table_name not in catalog:
+        return query_primary_key(conn, table_name)
+    
+    return catalog.get_primary_key(table_name)
+
+def get_foreign_keys(conn, table_name):
+    
+    catalog = get_schema_catalog(conn)
+    if table_name not in catalog:
+        return query_foreign_keys(conn, table_name)
+    
+    return list(catalog.get_foreign_keys(table_name))
+
+def get_indexes(conn) -> dict:
+    '''Table -> [Index] of the secondary and UNIQUE-constraint indexes of all tables. Primary keys, partial
+    indexes and indexes on expressions are left out.'''
+    cursor = conn.cursor()
+    cursor.execute('''SELECT m.name, l.name, l."unique", x.name, x."desc" FROM sqlite_master AS m 
+                      JOIN pragma_index_list(m.name) AS l JOIN pragma_index_xinfo(l.name) AS x 
+                      WHERE m.type = 'table' AND l.origin != 'pk' AND l.partial = 0 AND x.key = 1 
+                      ORDER BY m.name, l.name, x.seqno;''')
+    
+    columns = {}
+    for item in cursor.fetchall():
+        columns.setdefault((item[0], item[1], bool(item[2])), []).append((item[3], bool(item[4])))
+    
+    indexes = {}
+    for (table_name, index_name, is_unique), index_columns in columns.items():
+        if any(name is None for name, descending in index_columns):
+            continue
+        indexes.setdefault(table_name, []).append(Index(table_name, index_name, is_unique, tuple(index_columns)))
+    
+    return indexes
+
+def build_create_index_script(index, index_name=None) -> str:
+    
+    unique = "UNIQUE " if index.IS_UNIQUE else ""
+    columns = ", ".join(f'"{name}"' + (" DESC" if descending else "") for name, descending in index.COLUMNS)
+    
+    return f'CREATE {unique}INDEX IF NOT EXISTS "{index_name or index.INDEX_NAME}" ON "{index.TABLE_NAME}" ({columns})'
+
+def exec_create_indexes(conn, indexes, schema_indexes=None):
+    '''Builds indexes, each with one sort of the loaded rows. SQLite index names are global, so names used by
+    more than one table of schema_indexes (Table -> [Index] of the whole source schema, default: indexes) are
+    prefixed with the table name; every run names an index the same, whichever tables it builds.'''
+    if schema_indexes is not None:
+        all_indexes = [index for table_indexes in schema_indexes.values() for index in table_indexes]
+    else:
+        all_indexes = indexes
+    
+    tables = {}     # Index name -> tables with an index of that name.
+    for index in all_indexes:
+        tables.setdefault(index.INDEX_NAME, set()).add(index.TABLE_NAME)
+    
+    scripts = []
+    for index in indexes:
+        name = index.INDEX_NAME if len(tables.get(index.INDEX_NAME, ())) <= 1 else f'{index.TABLE_NAME}_{index.INDEX_NAME}'
+        scripts.append(build_create_index_script(index, name))
+    
+    exec_create_tables(conn, scripts)
+
+def check_foreign_keys(conn) -> dict:
+    '''Table -> number of rows whose foreign keys reference missing rows, checked in one pass after the load.'''
+    violations = {}
+    
+    cursor = conn.cursor()
+    for item in cursor.execute("PRAGMA foreign_key_check").fetchall():
+        violations[item[0]] = violations.get(item[0], 0) + 1
+    
+    return violations
+
 def get_create_table_script(conn, table_name):
     
     script = ""
@@ -137,9 +252,6 @@ def build_create_table_script(conn, table_name, columns:Column, primary_key=None
         else:
             script += "NOT NULL"
             
-        if column.COLUMN_NAME == primary_key:
-            script += " UNIQUE"
-
         script += ',\n'
     
     if (len(foreign_keys) == 0) and (not primary_key):
@@ -163,10 +275,27 @@ def exec_create_database(path) -> bool:
 def exec_create_table(conn, script):
     
     cursor = conn.cursor()
+    invalidate_catalog(conn)
     try:
         cursor.execute(script)
         conn.commit()
     except Exception as error:
         conn.rollback()
         raise
- 
\ No newline at end of file
+ 
+def exec_create_tables(conn, scripts, batch_size=DDL_BATCH_SIZE):
+    '''Executes DDL scripts, e.g. CREATE TABLE, batch_size of them per transaction.'''
+    cursor = conn.cursor()
+    invalidate_catalog(conn)
+    if conn.in_transaction:
+        conn.commit()
+    
+    for batch in chunked(scripts, batch_size):
+        try:
+            cursor.execute("BEGIN")
+            for script in batch:
+                cursor.execute(script)
+            conn.commit()
+        except Exception as error:
+            conn.rollback()
+            raise
@@ -1,22 +1,81 @@
-import pymssql
+import atexit
 
-def get_connection(server, user, pwd, database=None):
+from sql.lazy import LazyModule
+from sql.pooling import PoolRegistry
+from sql.SchemaCatalog import invalidate_catalog
+
+pymssql = LazyModule('pymssql')
+
+# Sent once when a connection opens. These replace pymssql's own connection properties, so its ANSI settings are
+# repeated here; NOCOUNT spares a DONE_IN_PROC message per statement (cursor.rowcount is then -1, use @@ROWCOUNT).
+# The TDS packet size is a FreeTDS setting ("packet size" in freetds.conf), pymssql.connect does not take it.
+SESSION_SETTINGS = (
+    'SET ARITHABORT ON;'
+    'SET CONCAT_NULL_YIELDS_NULL ON;'
+    'SET ANSI_NULLS ON;'
+    'SET ANSI_NULL_DFLT_ON ON;'
+    'SET ANSI_PADDING ON;'
+    'SET ANSI_WARNINGS ON;'
+    'SET CURSOR_CLOSE_ON_COMMIT ON;'
+    'SET QUOTED_IDENTIFIER ON;'
+    'SET TEXTSIZE 2147483647;'
+    'SET NOCOUNT ON;'
+    'SET TRANSACTION ISOLATION LEVEL READ COMMITTED;'
+)
+
+_pools = PoolRegistry()
+
+def get_connection(server, user, pwd, database=None, conn_properties=None):
     
     conn = None
     try:
-        conn = pymssql.connect(host=server, user=user, password=pwd, database=database)
+        if conn_properties is None:
+            conn = pymssql.connect(host=server, user=user, password=pwd, database=database)
+        else:
+            conn = pymssql.connect(host=server, user=user, password=pwd, database=database, conn_properties=conn_properties)
     except Exception as error:
         raise error
     
     return conn
 
-def get_trusted_connection(server, database=None):
+def get_trusted_connection(server, database=None, conn_properties=None):
     
     conn = None
     
     try:
-        conn = pymssql.connect(server=server, database=database)
+        if conn_properties is None:
+            conn = pymssql.connect(server=server, database=database)
+        else:
+            conn = pymssql.connect(server=server, database=database, conn_properties=conn_properties)
     except Exception as error:
         raise error
     
     return conn
+
+def get_pool(server, database=None, user=None, pwd=None):
+    '''Pool of connections to database on server with SESSION_SETTINGS applied; trusted unless user is given.'''
+    def connect():
+        if user:
+            return get_connection(server, user, pwd, database, conn_properties=SESSION_SETTINGS)
+        return get_trusted_connection(server, database, conn_properties=SESSION_SETTINGS)
+    
+    return _pools.get_pool((server, database, user), connect)
+
+def acquire_connection(server, database=None, user=None, pwd=None):
+    '''Pooled connection; hand it back with release_connection.'''
+    return get_pool(server, database, user, pwd).acquire()
+
+def release_connection(conn, discard=False):
+    
+    _pools.release(conn, discard)
+
+def close_connection(conn):
+    '''Closes a connection opened outside the pools, dropping its cached catalog with it.'''
+    invalidate_catalog(conn)
+    conn.close()
+
+def close_pools():
+    
+    _pools.close_all()
+
+atexit.register(close_pools)
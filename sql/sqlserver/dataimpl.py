@@ -1,27 +1,50 @@
-from datetime import datetime
-from collections import deque
-import decimal
 import codecs
-import pymssql
+import uuid
 
-from sql.sqlserver.schemaimpl import get_columns, get_primary_key, get_foreign_keys
-from bdatetime.bdatetime import is_valid_dt_format, is_julian, from_julian
+from sql.batching import rows_per_statement, chunked, BatchController
+from sql.scheduling import split_integer_range
+from sql.sqlserver.schemaimpl import get_columns, get_primary_key, get_foreign_keys, has_identity
+from sql.converters import build_row_converter, build_batch_converter, SQLSERVER
+from sql.metrics import get_metrics
+from sql.sqlserver.connectionimpl import pymssql
 
-CREATION_DEQUE = deque()
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_COMMIT_EVERY = 50000
 
-def select_all(conn, table):
-    
-    columns = get_columns(conn, table)
+DEFAULT_BULK_COPY_THRESHOLD = 100000      # Tables with more rows are loaded through bulk copy.
+STAGING_TABLE = '#bantu_stage'
+
+MAX_PARAMETERS = 2100       # Parameters per statement.
+MAX_VALUES_ROWS = 1000      # Row value expressions per INSERT ... VALUES.
+
+# Errors caused by the table or the session rather than by a row's values. Splitting a batch cannot isolate them.
+_NON_ROW_ERRORS = (173, 208, 545, 1767, 2714, 3902)
+
+def build_select_script(table, columns, lob_columns=(), lob_limit=None, omitted_columns=()) -> str:
+    '''Values of lob_columns longer than lob_limit are selected as an empty value of their type, to be streamed separately.
+    omitted_columns are selected as NULL, so they are never read but the rows keep the table's shape.'''
     length = len(columns)
-    pk = None
     
     sql = "SELECT "
     for i in range(length):
-        sql += f"[{columns[i].COLUMN_NAME}]"
+        name = columns[i].COLUMN_NAME
+        if name in omitted_columns:
+            sql += f"NULL AS [{name}]"
+        elif lob_limit is not None and name in lob_columns:
+            sql += f"CASE WHEN DATALENGTH([{name}]) > {int(lob_limit)} THEN SUBSTRING([{name}], 1, 0) ELSE [{name}] END AS [{name}]"
+        else:
+            sql += f"[{name}]"
         if i < length - 1:
             sql += ", "
         
     sql += f" FROM [{table}]"
+    
+    return sql
+
+def select_all(conn, table):
+    
+    columns = get_columns(conn, table)
+    sql = build_select_script(table, columns)
         
     cursor = conn.cursor()
     
@@ -36,7 +59,213 @@ def select_all(conn, table):
         
     return rows
 
-def insert_one_by_one(conn, table, rows, skip_primary_key=False) -> int:
+def build_key_condition(pk, key_range=None, after_key=None):
+    '''WHERE clause (or '') and its parameters limiting pk to an inclusive key_range and/or to keys after after_key.'''
+    conditions = []
+    params = []
+    
+    if key_range:
+        conditions.append(f"[{pk}] BETWEEN %s AND %s")
+        params.extend(key_range)
+    if after_key is not None:
+        conditions.append(f"[{pk}] > %s")
+        params.append(after_key)
+    
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params)
+
+def build_key_hash(column) -> str:
+    '''SQL expression of a non-negative integer hash of column, stable across runs; sql.subsetting samples rows by it.
+    CHECKSUM of an integer is the integer itself, which would sample bands of keys; the first 7 bytes of a SHA-256
+    of the value's text are a non-negative BIGINT.'''
+    return f"CAST(CAST(HASHBYTES('SHA2_256', CAST([{column}] AS NVARCHAR(4000))) AS BINARY(7)) AS BIGINT)"
+
+def add_condition(where, condition, params=()) -> str:
+    '''where (a WHERE clause or '') also requiring condition, an SQL expression, when given. With params, which pymssql
+    substitutes with the % operator, the percent signs in condition (modulo, LIKE patterns) are escaped.'''
+    if not condition:
+        return where
+    if params:
+        condition = condition.replace('%', '%%')
+    
+    return f"{where} AND ({condition})" if where else f" WHERE ({condition})"
+
+def stage_keys(conn, table, columns, condition=None) -> str:
+    '''Copies the distinct values of columns in the rows of table satisfying condition into a new global temporary
+    table, which every connection can read, and returns its name. sql.subsetting selects from it instead of repeating
+    a long condition; drop_staged_keys drops it.'''
+    name = f"[##bantu_keys_{uuid.uuid4().hex}]"
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT {', '.join(f'[{column}]' for column in columns)} INTO {name} FROM [{table}]" + add_condition("", condition))
+    conn.commit()       # Other sessions would wait for the locks of the open transaction.
+    
+    return name
+
+def drop_staged_keys(conn, names):
+    '''Drops tables of stage_keys; they would otherwise live, visible server-wide, as long as the pooled session.'''
+    cursor = conn.cursor()
+    for name in names:
+        cursor.execute(f"DROP TABLE {name}")
+    conn.commit()
+
+def iter_rows(conn, table, batch_size=DEFAULT_BATCH_SIZE, key_range=None, after_key=None, ordered=False, key_column=None,
+              lob_columns=(), lob_limit=None, condition=None, omitted_columns=()):
+    '''Yields the rows of table in lists of at most batch_size rows, so only one batch is held in memory.
+    key_range=(low, high) limits the rows to an inclusive primary key range, after_key to the keys greater than it.
+    Rows are read in primary key order when ordered or resuming after a key, which checkpoints rely on.
+    key_column puts the range, and the order, on another column, e.g. a watermark.
+    Values of lob_columns longer than lob_limit come back empty; iter_lob_chunks reads them.
+    condition is an SQL expression the rows must also satisfy and omitted_columns come back NULL (sql.subsetting).'''
+    columns = get_columns(conn, table)
+    sql = build_select_script(table, columns, lob_columns, lob_limit, omitted_columns)
+    pk = None
+    
+    if key_range or after_key is not None or ordered:
+        pk = key_column or get_primary_key(conn, table)
+    
+    where, params = build_key_condition(pk, key_range, after_key)
+    sql += add_condition(where, condition, params)
+    if pk and (ordered or after_key is not None):
+        sql += f" ORDER BY [{pk}]"
+    
+    cursor = conn.cursor()
+    try:
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql)
+    except pymssql.OperationalError as op_error:
+        print(op_error)
+        return
+    
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+def _rows_affected(cursor) -> int:
+    '''Result of the SELECT @@ROWCOUNT ending the statement just run; pooled connections set NOCOUNT ON, which
+    leaves cursor.rowcount at -1.'''
+    row = cursor.fetchone()
+    return row[0] if row else max(cursor.rowcount, 0)
+
+def delete_rows(conn, table, key_range=None, after_key=None, pk=None) -> int:
+    '''Deletes the rows of table in key_range and/or after after_key, or all of them; used to trim a partly copied
+    table back to its last checkpoint. pk names the key column of tables whose primary key is not built yet.
+    Returns the number of rows deleted.'''
+    if key_range or after_key is not None:
+        pk = pk or get_primary_key(conn, table)
+    where, params = build_key_condition(pk, key_range, after_key)
+    
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(f"DELETE FROM [{table}]" + where + "; SELECT @@ROWCOUNT", params)
+    else:
+        cursor.execute(f"DELETE FROM [{table}]; SELECT @@ROWCOUNT")
+    rows_deleted = _rows_affected(cursor)
+    conn.commit()
+    
+    return rows_deleted
+
+def count_rows_in_range(conn, table, key_range=None, key_column=None) -> int:
+    '''Exact row count of table, or of an inclusive key_range of it.'''
+    pk = (key_column or get_primary_key(conn, table)) if key_range else None
+    where, params = build_key_condition(pk, key_range)
+    
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(f"SELECT COUNT(*) FROM [{table}]" + where, params)
+    else:
+        cursor.execute(f"SELECT COUNT(*) FROM [{table}]")
+    
+    return cursor.fetchone()[0]
+
+# T-SQL rendering the NVARCHAR text of a value of each sql.checksums.DIGEST_KINDS kind, as sql.checksums.digest_text does.
+DIGEST_EXPRESSIONS = {
+    'int': "CONVERT(NVARCHAR(20), {})",
+    'number': "CONVERT(NVARCHAR(16), CAST(CAST({} AS FLOAT) AS BINARY(8)), 2)",
+    'text': "CAST({} AS NVARCHAR(MAX))",
+    'uuid': "LOWER(CONVERT(NVARCHAR(36), {}))",
+    'binary': "CONVERT(NVARCHAR(MAX), CAST({} AS VARBINARY(MAX)), 2)",
+    'datetime': "CONVERT(NVARCHAR(23), CAST({} AS DATETIME2(3)), 121)",
+    'date': "CONVERT(NVARCHAR(10), {}, 23)",
+    'time': "CAST(CAST({} AS TIME(3)) AS NVARCHAR(12))"
+}
+
+def build_digest_script(table, columns, kinds) -> str:
+    
+    values = " + NCHAR(31) + ".join(f"COALESCE(N'v' + {DIGEST_EXPRESSIONS[kind].format(f'[{column}]')}, N'n')" for column, kind in zip(columns, kinds))
+    row_hash = f"CAST(CAST(HASHBYTES('SHA2_256', {values}) AS BINARY(7)) AS BIGINT)"
+    
+    return f"SELECT COUNT(*), SUM(CAST({row_hash} AS DECIMAL(38, 0))) FROM [{table}]"
+
+def get_chunk_digest(conn, table, columns, kinds, key_range=None, key_column=None) -> tuple:
+    '''(count, checksum) of the rows of table, or of an inclusive key_range of it, computed by the server: the sum of the
+    sql.checksums.text_hash of each row's text, which sql.sqlite.dataimpl.get_chunk_digest computes alike.'''
+    where, params = build_key_condition(key_column, key_range)
+    
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(build_digest_script(table, columns, kinds) + where, params)
+    else:
+        cursor.execute(build_digest_script(table, columns, kinds))
+    count, checksum = cursor.fetchone()
+    
+    return count, int(checksum or 0)
+
+def get_key_bounds(conn, table, key_column) -> tuple:
+    '''(MIN, MAX) of key_column, (None, None) for an empty table.'''
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN([{key_column}]), MAX([{key_column}]) FROM [{table}]")
+    
+    return tuple(cursor.fetchone())
+
+def delete_keys(conn, table, key_column, keys, chunk_size=500) -> int:
+    '''Deletes the rows whose key_column value is in keys. Returns the number of rows deleted.'''
+    cursor = conn.cursor()
+    rows_deleted = 0
+    
+    for chunk in chunked(keys, chunk_size):
+        cursor.execute(f"DELETE FROM [{table}] WHERE [{key_column}] IN ({', '.join(['%s'] * len(chunk))}); SELECT @@ROWCOUNT", tuple(chunk))
+        rows_deleted += _rows_affected(cursor)
+    conn.commit()
+    
+    return rows_deleted
+
+def count_rows(conn, table) -> int:
+    '''Row count from the partition metadata; cheap, and exact enough for planning.'''
+    sql = "SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID(%s) AND index_id IN (0, 1)"
+    
+    cursor = conn.cursor()
+    cursor.execute(sql, (f'dbo.{table}', ))
+    row = cursor.fetchone()
+    
+    return int(row[0] or 0) if row else 0
+
+def get_key_ranges(conn, table, partitions) -> list:
+    '''Splits table into at most partitions inclusive primary key ranges, or returns None when it has no primary key.
+    Integer keys are split arithmetically between MIN and MAX, other keys at NTILE boundaries.'''
+    pk = get_primary_key(conn, table)
+    if not pk:
+        return None
+    
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN([{pk}]), MAX([{pk}]) FROM [{table}]")
+    low, high = cursor.fetchone()
+    
+    if low is None:
+        return None
+    if isinstance(low, int) and isinstance(high, int):
+        return split_integer_range(low, high, partitions)
+    
+    cursor.execute(f"SELECT MIN(k), MAX(k) FROM (SELECT [{pk}] AS k, NTILE({int(partitions)}) OVER (ORDER BY [{pk}]) AS tile FROM [{table}]) AS tiles GROUP BY tile ORDER BY tile")
+    
+    return [tuple(row) for row in cursor.fetchall()]
+
+def insert_one_by_one(conn, table, rows, skip_primary_key=False, source_columns=None) -> int:
     
     cursor = conn.cursor()
     rows_inserted = 0
@@ -47,6 +276,8 @@ def insert_one_by_one(conn, table, rows, skip_primary_key=False) -> int:
     
     if skip_primary_key:
         pk = get_primary_key(conn, table)
+    
+    convert = build_row_converter(source_columns, columns, SQLSERVER, (pk, ))
         
     for row in rows:
         sql = f"INSERT INTO [{table}] "
@@ -73,25 +304,8 @@ def insert_one_by_one(conn, table, rows, skip_primary_key=False) -> int:
             else:
                 sql += ")"
         
-        data_list = []
-        for k in range(len(row)):
-            if skip_primary_key and pk and columns[k].COLUMN_NAME == pk:
-                continue
-            
-            val = row[k]
-            if isinstance(val, str):
-                if '\'' in val:
-                    val = val.replace('\'', '\'\'')     # Escape from ' as '' in sqlite-style, otherwise it's an exception.
-            if isinstance(val, float):
-                if is_julian(val):
-                    val = from_julian(val)
-            if isinstance(val, bytes):
-                val = codecs.decode(val, encoding='UTF-8')
-                
-            data_list.append(val)
-        
         try:
-            cursor.execute(sql, tuple(data_list))
+            cursor.execute(sql, tuple(convert(row)))
             conn.commit()
             rows_inserted += 1
             
@@ -131,84 +345,314 @@ def insert_one_by_one(conn, table, rows, skip_primary_key=False) -> int:
                     
     return rows_inserted
 
-def insert_many(conn, table, rows, skip_primary_key=False) -> int:
+def build_insert_script(table, columns, primary_key=None) -> str:
+    
+    names = [f"[{column.COLUMN_NAME}]" for column in columns if column.COLUMN_NAME != primary_key]
+    
+    return f"INSERT INTO [{table}] ({', '.join(names)}) VALUES ({', '.join(['%s'] * len(names))})"
+
+def _is_row_error(error) -> bool:
+    
+    if isinstance(error, pymssql.exceptions.IntegrityError):
+        return True
+    if isinstance(error, pymssql.exceptions.OperationalError):
+        return error.args[0] not in _NON_ROW_ERRORS
+    
+    return False
+
+def _insert_batch(cursor, sql, batch, table=None) -> int:
+    '''Inserts batch inside a savepoint. A failing batch is rolled back and split in halves until the bad rows are isolated and skipped.'''
+    metrics = get_metrics()
+    cursor.execute("SAVE TRANSACTION bantu_batch")
+    try:
+        with metrics.batch(table, batch):
+            cursor.executemany(sql, batch)
+        return len(batch)
     
+    except Exception as error:
+        cursor.execute("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION bantu_batch")
+        if not _is_row_error(error):
+            raise
+        
+        if len(batch) == 1:
+            print(f'SQL: {sql} | Row: {batch[0]} | Error: {error}')
+            metrics.error(table, error)
+            return 0
+        
+        metrics.retry(table, 'split batch')
+        middle = len(batch) // 2
+        return _insert_batch(cursor, sql, batch[:middle], table) + _insert_batch(cursor, sql, batch[middle:], table)
+
+def insert_batched(conn, table, rows, batch_size=DEFAULT_BATCH_SIZE, commit_every=DEFAULT_COMMIT_EVERY, skip_primary_key=False, source_columns=None,
+                   on_commit=None, controller=None) -> int:
+    '''Inserts rows (any iterable) with one prepared statement via executemany and commits every commit_every rows.
+    After every commit, on_commit(rows_read, last_row) is called with the number of rows read so far and the last of them.
+    Batches are sized by controller (sql.batching.BatchController); without one, by a controller starting at batch_size.'''
     cursor = conn.cursor()
     columns = get_columns(conn, table)
-    row_length = len(rows)
-    col_length = len(columns)
     pk = None
     
     if skip_primary_key:
         pk = get_primary_key(conn, table)
+        
+    sql = build_insert_script(table, columns, pk)
+    convert = build_batch_converter(source_columns, columns, SQLSERVER, (pk, ))
     
-    for row in rows:
-        sql = f"INSERT INTO [{table}] "
+    rows_inserted = 0
+    rows_read = 0
+    uncommitted = 0
+    last_row = None
+    
+    owned = controller is None
+    if owned:
+        controller = BatchController(batch_size, len(columns), table)
+    
+    try:
+        for batch in controller.batches(rows):
+            with controller.measure(batch):     # Commits included: their latency counts.
+                inserted = _insert_batch(cursor, sql, list(map(tuple, convert(batch))), table)     # pymssql binds tuples only.
+                uncommitted += len(batch)
+                committed = uncommitted >= commit_every
+                if committed:
+                    conn.commit()
+                    uncommitted = 0
+            
+            rows_inserted += inserted
+            rows_read += len(batch)
+            last_row = batch[-1]
+            if inserted < len(batch):
+                controller.record_error()       # Rejected rows: smaller batches isolate them in fewer splits.
+            if committed and on_commit:
+                on_commit(rows_read, last_row)
         
-        sql += "("
-        for i in range(col_length):
-            sql += f"[{columns[i].COLUMN_NAME}]"
-            if i < col_length - 1:
-                sql += ", "
-            else:
-                sql += ") "
+        conn.commit()
+        if on_commit and uncommitted:
+            on_commit(rows_read, last_row)
+        
+    except Exception as error:
+        print(f'SQL: {sql} | Error: {error}')
+        conn.rollback()
+        raise
+    
+    finally:
+        if owned:
+            get_metrics().batch_sizes(table, controller.summary())
+    
+    return rows_inserted
 
-    sql += "VALUES"
-    for i in range(row_length):
-        sql += "("
-        for k in range(col_length):
-            if skip_primary_key and pk and columns[k].COLUMN_NAME == pk:
-                sql += "NULL"
-            else:
-                sql += "%s"
-                
-            if k < col_length - 1:
-                sql += ", "
-            else:
-                sql += ")"
-                
-        if i < row_length - 1:
-            sql += ","
-        else:
-            sql += ";"
+def _create_staging_table(cursor, table):
+    '''Session-local copy of table's columns without the IDENTITY property. The UNION keeps SELECT INTO from copying it.'''
+    cursor.execute(f"IF OBJECT_ID('tempdb..{STAGING_TABLE}') IS NOT NULL DROP TABLE {STAGING_TABLE}")
+    cursor.execute(f"SELECT * INTO {STAGING_TABLE} FROM [{table}] WHERE 1 = 0 UNION ALL SELECT * FROM [{table}] WHERE 1 = 0")
 
-    data_dict = {}
-    for row in rows:
-        temp_dict = {}
-        
-        for k in range(col_length):
-            if skip_primary_key and pk and columns[k].COLUMN_NAME == pk:
-                continue
-            
-            val = row[k]
-            if isinstance(val, str):
-                if '\'' in val:
-                    val = val.replace('\'', '\'\'')     # Escape from ' as '' in sqlite-style, otherwise it's an exception.
-            if isinstance(val, decimal.Decimal):
-                if is_julian(val):
-                    val = from_julian(val)
-                if is_valid_dt_format(val):
-                    val = datetime.strftime(val)    # Convert sqlite unsupported type decimal to text.
-            
-            temp_dict[columns[k].COLUMN_NAME] = val
+def insert_bulk(conn, table, rows, batch_size=DEFAULT_BATCH_SIZE, commit_every=DEFAULT_COMMIT_EVERY, tablock=False, source_columns=None, 
+                on_commit=None) -> int:
+    '''Loads rows (any iterable) through the TDS bulk-copy protocol, committing every commit_every rows.
+    pymssql's bulk_copy has no KEEPIDENTITY hint, so tables with an identity column are bulk copied into a session staging
+    table and moved with one INSERT ... SELECT under IDENTITY_INSERT per commit; identity values are kept either way.
+    tablock takes a table lock for the load, which enables minimal logging. on_commit works as in insert_batched.'''
+    cursor = conn.cursor()
+    columns = get_columns(conn, table)
+    convert = build_batch_converter(source_columns, columns, SQLSERVER)
+    
+    staged = has_identity(conn, table)
+    if staged:
+        _create_staging_table(cursor, table)
+        names = ", ".join(f"[{column.COLUMN_NAME}]" for column in columns)
+        hint = " WITH (TABLOCK)" if tablock else ""
+        move = (f"SET IDENTITY_INSERT [{table}] ON; "
+                f"INSERT INTO [{table}]{hint} ({names}) SELECT {names} FROM {STAGING_TABLE}; "
+                f"SET IDENTITY_INSERT [{table}] OFF; "
+                f"TRUNCATE TABLE {STAGING_TABLE}")
+    
+    metrics = get_metrics()
+    rows_inserted = 0
+    try:
+        for chunk in chunked(rows, commit_every):
+            with metrics.batch(table, chunk):
+                if staged:
+                    conn.bulk_copy(STAGING_TABLE, map(tuple, convert(chunk)), batch_size=batch_size)
+                    cursor.execute(move)
+                else:
+                    conn.bulk_copy(table, map(tuple, convert(chunk)), batch_size=batch_size, tablock=tablock)
+                conn.commit()
             
-        data_dict[row[0]] = temp_dict
-        temp_dict = None
+            rows_inserted += len(chunk)
+            if on_commit:
+                on_commit(rows_inserted, chunk[-1])
         
-    sql_tuples = [v2 for k1, v1 in data_dict.items() for k2, v2 in v1.items()]
+        if staged:
+            cursor.execute(f"DROP TABLE {STAGING_TABLE}")      # Otherwise dropped with the session, or by the next staged load.
+            conn.commit()
+    
+    except Exception as error:
+        print(f'Table: {table} | Bulk copy error: {error}')
+        get_metrics().error(table, error)
+        conn.rollback()
+        raise
+    
+    return rows_inserted
+
+def get_max_value(conn, table, column, rowversion=False):
+    '''MAX of column. For a rowversion column only values below MIN_ACTIVE_ROWVERSION() count: rows with lower
+    values may still be written by open transactions, and would be missed by a watermark past them.'''
+    sql = f"SELECT MAX([{column}]) FROM [{table}]"
+    if rowversion:
+        sql += f" WHERE [{column}] < MIN_ACTIVE_ROWVERSION()"
+    
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    
+    return cursor.fetchone()[0]
+
+def build_merge_script(table, columns, key_column) -> str:
+    '''MERGE of the staging table into table on key_column.'''
+    names = [f"[{column.COLUMN_NAME}]" for column in columns]
+    updates = [f"T.{name} = S.{name}" for name in names if name != f"[{key_column}]"]
+    
+    sql = f"MERGE [{table}] AS T USING {STAGING_TABLE} AS S ON T.[{key_column}] = S.[{key_column}] "
+    if updates:
+        sql += "WHEN MATCHED THEN UPDATE SET " + ", ".join(updates) + " "
+    sql += f"WHEN NOT MATCHED THEN INSERT ({', '.join(names)}) VALUES ({', '.join('S.' + name for name in names)});"
+    
+    return sql
+
+def upsert_batched(conn, table, rows, key_column, batch_size=DEFAULT_BATCH_SIZE, source_columns=None) -> int:
+    '''Inserts rows, or updates the ones whose key_column value is already in table: every batch goes into a session
+    staging table and is merged into table with one MERGE, under IDENTITY_INSERT when table has an identity column.
+    Batches are sized by a BatchController starting at batch_size.'''
+    cursor = conn.cursor()
+    columns = get_columns(conn, table)
+    convert = build_batch_converter(source_columns, columns, SQLSERVER)
+    
+    _create_staging_table(cursor, table)
+    stage = build_insert_script(STAGING_TABLE, columns)
+    merge = build_merge_script(table, columns, key_column)
+    if has_identity(conn, table):
+        merge = f"SET IDENTITY_INSERT [{table}] ON; {merge} SET IDENTITY_INSERT [{table}] OFF;"
+    
+    metrics = get_metrics()
+    controller = BatchController(batch_size, len(columns), table)
+    rows_upserted = 0
     try:
-        cursor.execute(sql, tuple(sql_tuples))      
+        for batch in controller.batches(rows):
+            params = list(map(tuple, convert(batch)))     # pymssql binds tuples only.
+            with metrics.batch(table, params), controller.measure(batch):
+                cursor.executemany(stage, params)
+                cursor.execute(merge)
+                cursor.execute(f"TRUNCATE TABLE {STAGING_TABLE}")
+                conn.commit()
+            rows_upserted += len(batch)
+        
+        cursor.execute(f"DROP TABLE {STAGING_TABLE}")
         conn.commit()
     
-    except pymssql.OperationalError as o_error:
-        print(f'SQL: {sql} | Error: {o_error}')
-    except pymssql.ProgrammingError as p_error:
-        print(f'SQL: {sql} | Error: {p_error}')
-    except pymssql.IntegrityError as i_error:
-        print(f'SQL: {sql} | Error: {i_error}')
+    except Exception as error:
+        print(f'Table: {table} | Upsert error: {error}')
+        metrics.error(table, error)
         conn.rollback()
-    except pymssql.Exception as error:
-        print(f'SQL: {sql} | Error: {error}')
+        raise
+    
+    finally:
+        metrics.batch_sizes(table, controller.summary())
+    
+    return rows_upserted
+
+def get_large_values(conn, table, column, key_column, lob_limit, condition=None) -> list:
+    '''(key, DATALENGTH) of the rows, among those satisfying condition, whose column value is longer than lob_limit bytes.'''
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT [{key_column}], DATALENGTH([{column}]) FROM [{table}]" + add_condition(f" WHERE DATALENGTH([{column}]) > %s", condition, (lob_limit, )), 
+                   (lob_limit, ))
+    
+    return cursor.fetchall()
+
+def iter_lob_chunks(conn, table, column, key_column, key, chunk_size, as_text=False):
+    '''Yields the value of column in the row with key in pieces of chunk_size bytes (characters for text) read with
+    SUBSTRING, one round trip per piece. Text comes back as str and binary values as bytes either way.'''
+    cursor = conn.cursor()
+    sql = f"SELECT SUBSTRING([{column}], %s, %s) FROM [{table}] WHERE [{key_column}] = %s"
+    offset = 1
+    
+    while True:
+        cursor.execute(sql, (offset, chunk_size, key))
+        row = cursor.fetchone()
+        if not row or not row[0]:
+            break
+        
+        yield row[0]
+        if len(row[0]) < chunk_size:
+            break
+        offset += chunk_size
+
+def write_lob(conn, table, column, key_column, key, chunks, size=None):
+    '''Writes chunks as the value of a (max) column in the row with key through UPDATE .WRITE: the first piece replaces
+    the value, the others are appended, so the value never passes through memory whole. size is not needed.'''
+    cursor = conn.cursor()
+    replace = f"UPDATE [{table}] SET [{column}].WRITE(%s, 0, NULL) WHERE [{key_column}] = %s"
+    append = f"UPDATE [{table}] SET [{column}].WRITE(%s, NULL, NULL) WHERE [{key_column}] = %s"
+    
+    try:
+        sql = replace
+        for chunk in chunks:
+            cursor.execute(sql, (chunk, key))
+            sql = append
+        conn.commit()
+    
+    except Exception as error:
+        print(f'Table: {table} | Column: {column} | Key: {key} | Error: {error}')
+        get_metrics().error(table, error)
         conn.rollback()
+        raise
+
+def build_insert_many_script(table, columns, num_of_rows, primary_key=None) -> str:
+    
+    names = [f"[{column.COLUMN_NAME}]" for column in columns if column.COLUMN_NAME != primary_key]
+    values = "(" + ", ".join(["%s"] * len(names)) + ")"
+    
+    return f"INSERT INTO [{table}] ({', '.join(names)}) VALUES " + ", ".join([values] * num_of_rows) + ";"
+
+def insert_many(conn, table, rows, skip_primary_key=False, source_columns=None) -> int:
+    '''Inserts rows with multi-row VALUES statements sized to stay under the 2100-parameter and 1000-row limits. A statement
+    rejected for its rows is rolled back and its rows skipped; other errors roll back the transaction and are raised.
+    Returns the number of rows inserted.'''
+    cursor = conn.cursor()
+    columns = get_columns(conn, table)
+    pk = None
+    
+    if skip_primary_key:
+        pk = get_primary_key(conn, table)
+    
+    num_of_params = len([column for column in columns if column.COLUMN_NAME != pk])
+    chunk_size = rows_per_statement(num_of_params, MAX_PARAMETERS - 1, MAX_VALUES_ROWS)
     
-    return len(data_dict)
+    convert = build_batch_converter(source_columns, columns, SQLSERVER, (pk, ))
+    scripts = {}        # Statement text per chunk shape; every chunk but the last shares one.
+    rows_inserted = 0
+    
+    metrics = get_metrics()
+    for chunk in chunked(rows, chunk_size):
+        sql = scripts.get(len(chunk))
+        if sql is None:
+            sql = scripts[len(chunk)] = build_insert_many_script(table, columns, len(chunk), pk)
+        
+        params = []
+        for row in convert(chunk):
+            params.extend(row)
+        
+        cursor.execute("SAVE TRANSACTION bantu_batch")     # A rejected statement is undone alone, as in _insert_batch.
+        try:
+            with metrics.batch(table, chunk):
+                cursor.execute(sql, tuple(params))
+            rows_inserted += len(chunk)
+
+        except Exception as error:
+            cursor.execute("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION bantu_batch")
+            print(f'Table: {table} | Rows: {len(chunk)} | Error: {error}')
+            metrics.error(table, error)
+            if not _is_row_error(error):
+                conn.rollback()
+                raise
+
+    conn.commit()
+    
+    return rows_inserted
@@ -1,14 +1,14 @@
 from datetime import datetime
-from collections import deque
 
-from pymssql import OperationalError, ProgrammingError, IntegrityError
-
-from sql.Interfaces import Column, Foreign_Key, sqlserver_to_sqlite_types_dict
-from sql.sqlserver.connectionimpl import get_connection, get_trusted_connection
+from sql.batching import chunked
+from sql.Interfaces import Column, Foreign_Key, Index, sqlserver_to_sqlite_types_dict
+from sql.SchemaCatalog import SchemaCatalog, get_catalog, invalidate_catalog
+from sql.sqlserver.connectionimpl import get_connection, get_trusted_connection, pymssql
 from bdatetime.bdatetime import is_julian
 
 SYSTEM_DATABASES = ('master', 'model', 'tempdb', 'msdb')
-CREATION_DEQUE = deque()
+
+DDL_BATCH_SIZE = 100        # Scripts sent, and committed, together.
 
 def db_structure(server_ip, user, pwd):
     
@@ -47,6 +47,7 @@ def get_databases(conn):
             continue
         DBs.append(DB)
     
+    invalidate_catalog(conn)
     conn.close()
     
     return DBs
@@ -76,7 +77,7 @@ def get_tables(conn):
     
     return tables
 
-def get_columns(conn, table_name):
+def query_columns(conn, table_name):
     
     columns = []
     sql = ''' SELECT TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, IS_NULLABLE, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, DATETIME_PRECISION
@@ -90,27 +91,14 @@ def get_columns(conn, table_name):
         row = cursor.fetchall()
 
         for item in row:
-            # Adding values
-            column = Column(
-                TABLE_NAME=item[0],    
-                COLUMN_NAME=item[1], 
-                ORDINAL_POSITION=item[2], 
-                IS_NULLABLE=item[3] != 'NO', 
-                DATA_TYPE=item[4], 
-                CHARACTER_MAXIMUM_LENGTH=item[5], 
-                DATETIME_PRECISION=item[6],
-                IS_PK=None,             # This doesn't exist in Sql Server
-                DEFAULT_VALUE=None      # This doesn't exist in Sql Server
-                )
-            
-            columns.append(column)
+            columns.append(_to_column(item))
             
         return columns
     
     except Exception as e:
         print(e)
 
-def get_primary_key(conn, table_name):
+def query_primary_key(conn, table_name):
     
     primary_key = None
     sql = '''
@@ -135,7 +123,7 @@ def get_primary_key(conn, table_name):
     except Exception as e:
         print(e)
     
-def get_foreign_keys(conn, table_name):
+def query_foreign_keys(conn, table_name):
     
     foreign_keys = []
     
@@ -155,23 +143,133 @@ def get_foreign_keys(conn, table_name):
     row = cursor.fetchall()
 
     for item in row:
-        fk = Foreign_Key(
-            REFERENCED_TABLE_NAME=item[0], 
-            REFERENCED_COLUMN_NAME=item[1], 
-            REFERENCING_TABLE_NAME=item[2], 
-            REFERENCING_COLUMN_NAME=item[3],
-            CONSTRAINT_NAME=item[4], 
-            ID=None,                            # NOT EXISTS
-            SEQ=None,                           # NOT EXISTS
-            ON_UPDATE=None,                     # NOT EXISTS
-            ON_DELETE=None,                     # NOT EXISTS
-            MATCH=None                          # NOT EXISTS
-            ) 
+        fk = _to_foreign_key(item)
         if fk.REFERENCING_TABLE_NAME == table_name:
             foreign_keys.append(fk)
         
     return foreign_keys
 
+def _to_column(item) -> Column:
+    
+    return Column(
+        TABLE_NAME=item[0],    
+        COLUMN_NAME=item[1], 
+        ORDINAL_POSITION=item[2], 
+        IS_NULLABLE=item[3] != 'NO', 
+        DATA_TYPE=item[4], 
+        CHARACTER_MAXIMUM_LENGTH=item[5], 
+        DATETIME_PRECISION=item[6],
+        IS_PK=None,             # This doesn't exist in Sql Server
+        DEFAULT_VALUE=None      # This doesn't exist in Sql Server
+        )
+
+def _to_foreign_key(item) -> Foreign_Key:
+    
+    return Foreign_Key(
+        REFERENCED_TABLE_NAME=item[0], 
+        REFERENCED_COLUMN_NAME=item[1], 
+        REFERENCING_TABLE_NAME=item[2], 
+        REFERENCING_COLUMN_NAME=item[3],
+        CONSTRAINT_NAME=item[4], 
+        ID=None,                            # NOT EXISTS
+        SEQ=None,                           # NOT EXISTS
+        ON_UPDATE=None,                     # NOT EXISTS
+        ON_DELETE=None,                     # NOT EXISTS
+        MATCH=None                          # NOT EXISTS
+        ) 
+
+def load_catalog(conn) -> SchemaCatalog:
+    '''Reads columns, primary keys and foreign keys of all tables with one query each.'''
+    columns = {}
+    primary_keys = {}
+    foreign_keys = {}
+    
+    cursor = conn.cursor()
+    cursor.execute(''' SELECT TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, IS_NULLABLE, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, DATETIME_PRECISION
+                        FROM INFORMATION_SCHEMA.COLUMNS 
+                        ORDER BY TABLE_NAME, ORDINAL_POSITION;
+                   ''')
+    for item in cursor.fetchall():
+        columns.setdefault(item[0], []).append(_to_column(item))
+    
+    cursor.execute('''
+            SELECT K.TABLE_NAME, K.COLUMN_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS T 
+            JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE K
+            ON K.CONSTRAINT_NAME=T.CONSTRAINT_NAME  
+            WHERE T.CONSTRAINT_TYPE='PRIMARY KEY'
+            ORDER BY K.TABLE_NAME, K.ORDINAL_POSITION;
+    ''')
+    for item in cursor.fetchall():
+        primary_keys.setdefault(item[0], item[1])       # First key column, as query_primary_key does.
+    
+    cursor.execute('''
+            SELECT KCU1.TABLE_NAME AS ReferencedTableName,    
+                KCU1.COLUMN_NAME AS ReferencedColumnName,    
+                KCU2.TABLE_NAME AS ReferencingTableName,    
+                KCU2.COLUMN_NAME AS ReferencingColumnName,
+                KCU2.CONSTRAINT_NAME AS ConstraintName
+            FROM INFORMATION_SCHEMA.REFERENTIAL_CONSTRAINTS AS RC
+            INNER JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS KCU1 ON RC.UNIQUE_CONSTRAINT_NAME= KCU1.CONSTRAINT_NAME
+            INNER JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS KCU2 ON RC.CONSTRAINT_NAME  = KCU2.CONSTRAINT_NAME;
+        ''')
+    for item in cursor.fetchall():
+        fk = _to_foreign_key(item)
+        foreign_keys.setdefault(fk.REFERENCING_TABLE_NAME, []).append(fk)
+        
+    return SchemaCatalog(columns, primary_keys, foreign_keys)
+
+def get_schema_catalog(conn) -> SchemaCatalog:
+    
+    return get_catalog(conn, load_catalog)
+
+def get_columns(conn, table_name):
+    
+    catalog = get_schema_catalog(conn)
+    if table_name not in catalog:       # Created after the snapshot was taken.
+        return query_columns(conn, table_name)
+    
+    return list(catalog.get_columns(table_name))
+
+def get_primary_key(conn, table_name):
+    
+    catalog = get_schema_catalog(conn)
+    if table_name not in catalog:
+        return query_primary_key(conn, table_name)
+    
+    return catalog.get_primary_key(table_name)
+
+def get_foreign_keys(conn, table_name):
+    
+    catalog = get_schema_catalog(conn)
+    if table_name not in catalog:
+        return query_foreign_keys(conn, table_name)
+    
+    return list(catalog.get_foreign_keys(table_name))
+
+def get_indexes(conn) -> dict:
+    '''Table -> [Index] of the rowstore indexes of all tables, primary keys excluded. Included columns and
+    filtered indexes have no SQLite equivalent and are left out.'''
+    cursor = conn.cursor()
+    cursor.execute('''
+            SELECT T.name, I.name, I.is_unique, C.name, IC.is_descending_key
+            FROM sys.indexes AS I
+            INNER JOIN sys.tables AS T ON T.object_id = I.object_id
+            INNER JOIN sys.index_columns AS IC ON IC.object_id = I.object_id AND IC.index_id = I.index_id
+            INNER JOIN sys.columns AS C ON C.object_id = IC.object_id AND C.column_id = IC.column_id
+            WHERE I.is_primary_key = 0 AND I.type IN (1, 2) AND I.has_filter = 0 AND IC.is_included_column = 0 AND T.is_ms_shipped = 0
+            ORDER BY T.name, I.name, IC.key_ordinal;
+        ''')
+    
+    columns = {}
+    for item in cursor.fetchall():
+        columns.setdefault((item[0], item[1], bool(item[2])), []).append((item[3], bool(item[4])))
+    
+    indexes = {}
+    for (table_name, index_name, is_unique), index_columns in columns.items():
+        indexes.setdefault(table_name, []).append(Index(table_name, index_name, is_unique, tuple(index_columns)))
+    
+    return indexes
+
 def enable_identity_insert(conn, table_name, enable):
     
     switch = 'OFF'
@@ -187,6 +285,13 @@ def enable_identity_insert(conn, table_name, enable):
         print(error)
         raise
 
+def has_identity(conn, table_name) -> bool:
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM sys.identity_columns WHERE object_id = OBJECT_ID(%s)", (f'dbo.{table_name}', ))
+    
+    return cursor.fetchone()[0] > 0
+
 def enable_foreign_keys(conn, table_name):
     
     fks = get_foreign_keys(conn, table_name)
@@ -258,7 +363,7 @@ def generate_create_table_script(database, table, columns, primary_key, foreign_
     script = f'USE {database}' \
         '\n' \
         'GO\n\n' \
-        f'/****** Object:  Table [dbo].[{table}]    Script Date: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')} ******/' + '\n' \
+        f'/****** Object:  Table [dbo].[{table}]    Script Date: {datetime.now().strftime("%d.%m.%Y %H:%M:%S")} ******/' + '\n' \
         'SET ANSI_NULLS ON\n' \
         'GO\n\n' \
         'SET QUOTED_IDENTIFIER ON\n' \
@@ -309,7 +414,7 @@ def generate_create_table_script(database, table, columns, primary_key, foreign_
     
     return script
 
-def build_create_table_script(table, columns, primary_key, foreign_keys, build_fk_constraints=True):
+def build_create_table_script(table, columns, primary_key, foreign_keys, build_fk_constraints=True, build_pk_constraint=True):
 
     script =  f'CREATE TABLE [dbo].[{table}] (\n'
     
@@ -336,7 +441,7 @@ def build_create_table_script(table, columns, primary_key, foreign_keys, build_f
             
         script += ',\n'
 
-    if primary_key:
+    if primary_key and build_pk_constraint:
         script += f'CONSTRAINT [PK_{table}] PRIMARY KEY CLUSTERED ([{primary_key}] ASC)\n'
     else:
         script = script[0:len(script) - 2]
@@ -348,11 +453,26 @@ def build_create_table_script(table, columns, primary_key, foreign_keys, build_f
         
     return script
 
+def build_primary_key_script(table, primary_key) -> str:
+    
+    return f'ALTER TABLE [dbo].[{table}] ADD CONSTRAINT [PK_{table}] PRIMARY KEY CLUSTERED ([{primary_key}] ASC);\n'
+
+def build_create_index_script(index) -> str:
+    '''SQLite names the indexes of UNIQUE constraints sqlite_autoindex_<table>_<n>; they become UQ_<table>_<n>.'''
+    name = index.INDEX_NAME
+    if name.startswith('sqlite_autoindex_'):
+        name = f"UQ_{index.TABLE_NAME}_{name.rsplit('_', 1)[-1]}"
+    
+    unique = "UNIQUE " if index.IS_UNIQUE else ""
+    columns = ", ".join(f"[{column}] " + ("DESC" if descending else "ASC") for column, descending in index.COLUMNS)
+    
+    return f'CREATE {unique}NONCLUSTERED INDEX [{name}] ON [dbo].[{index.TABLE_NAME}] ({columns});\n'
+
 def build_foreign_key_script(foreign_keys) -> str:
     
     script = ""
     for fk in foreign_keys:
-        script = f'ALTER TABLE [dbo].[{fk.REFERENCING_TABLE_NAME}]  WITH CHECK ADD  CONSTRAINT [{fk.CONSTRAINT_NAME}] FOREIGN KEY([{fk.REFERENCING_COLUMN_NAME}])' + '\n'
+        script += f'ALTER TABLE [dbo].[{fk.REFERENCING_TABLE_NAME}]  WITH CHECK ADD  CONSTRAINT [{fk.CONSTRAINT_NAME}] FOREIGN KEY([{fk.REFERENCING_COLUMN_NAME}])' + '\n'
         script += f'REFERENCES [dbo].[{fk.REFERENCED_TABLE_NAME}] ([{fk.REFERENCED_COLUMN_NAME}]);' + '\n\n'
         script += f'ALTER TABLE [dbo].[{fk.REFERENCING_TABLE_NAME}] CHECK CONSTRAINT [{fk.CONSTRAINT_NAME}];' + '\n'
 
@@ -401,6 +521,7 @@ def exec_create_database(conn, script) -> bool:
     
     conn.autocommit(True)
     cursor = conn.cursor()
+    invalidate_catalog(conn)
     
     try:
         cursor.execute(script)
@@ -414,18 +535,19 @@ def exec_create_database(conn, script) -> bool:
 def exec_script(conn, script):
     
     cursor = conn.cursor()
+    invalidate_catalog(conn)
     try:
         cursor.execute(script)
         conn.commit()
-    except OperationalError as o_error:
+    except pymssql.OperationalError as o_error:
         print(f'SQL: {script} | Error: {o_error}')
         conn.rollback()
         raise
-    except ProgrammingError as p_error:
+    except pymssql.ProgrammingError as p_error:
         print(f'SQL: {script} | Error: {p_error}')
         conn.rollback()
         raise
-    except IntegrityError as i_error:
+    except pymssql.IntegrityError as i_error:
         print(f'SQL: {script} | Error: {i_error}')
         conn.rollback()
         raise
@@ -434,6 +556,11 @@ def exec_script(conn, script):
         conn.rollback()
         raise
     
+def exec_scripts(conn, scripts, batch_size=DDL_BATCH_SIZE):
+    '''Executes scripts as batches of batch_size scripts, each batch in one round trip and one transaction.'''
+    for batch in chunked(scripts, batch_size):
+        exec_script(conn, '\n'.join(batch))
+
 def _get_schema(conn):
     
     DBs = []
@@ -448,5 +575,6 @@ def _get_schema(conn):
             continue
         DBs.append(DB[0])
     
+    invalidate_catalog(conn)
     conn.close()
     return DBs
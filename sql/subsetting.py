@@ -0,0 +1,183 @@
+import fnmatch
+
+from sql.Interfaces import Table_Filter
+
+SAMPLE_BUCKETS = 10000      # Sampling resolution: 0.01 percent.
+NO_ROWS = '1 = 0'
+MAX_CONDITION_LENGTH = 20000     # Characters of a referencing table's condition above which its keys are staged.
+MAX_CONDITION_DEPTH = 6          # Subqueries nested in it from which they are staged; SQLite's parser overflows at about 10.
+
+class Subset:
+    '''Which tables, columns and rows DataClone copies. The row conditions are SQL run inside the source query, so
+    rows left out are never read:
+    - include_tables / exclude_tables: table name patterns (fnmatch, case-insensitive); no include pattern selects every table.
+    - columns: {table: [column, ...]} projection; the other columns are copied as NULL. The primary key is always kept,
+      leaving out a NOT NULL column is an error.
+    - predicates: {table: SQL condition in the source database's dialect}.
+    - sample_percent, samples ({table: percent}): keep about that percentage of the rows, picked by a hash of the
+      primary key, so every run picks the same rows.
+    - fk_closure: tables referenced by a selected table are copied too, and a filtered table also gets the rows the
+      copied rows of its referencing tables point at, so the foreign keys hold in the destination. Self-references
+      and rows reached only through a reference cycle are not followed.'''
+
+    def __init__(self, include_tables=(), exclude_tables=(), columns=None, predicates=None, sample_percent=None, samples=None,
+                 fk_closure=True):
+
+        self.include_tables = tuple(include_tables or ())
+        self.exclude_tables = tuple(exclude_tables or ())
+        self.columns = dict(columns or {})
+        self.predicates = dict(predicates or {})
+        self.sample_percent = sample_percent
+        self.samples = dict(samples or {})
+        self.fk_closure = fk_closure
+
+        for percent in [sample_percent, *self.samples.values()]:
+            if percent is not None and not 0 <= percent <= 100:
+                raise ValueError(f"Sample percentage must be between 0 and 100, got {percent}")
+
+    def is_selected(self, table) -> bool:
+
+        name = table.lower()
+        if self.include_tables and not any(fnmatch.fnmatchcase(name, pattern.lower()) for pattern in self.include_tables):
+            return False
+
+        return not any(fnmatch.fnmatchcase(name, pattern.lower()) for pattern in self.exclude_tables)
+
+    def _own_condition(self, table, pk, build_key_hash):
+        '''The table's predicate and sample, or None for every row.'''
+        conditions = []
+        if self.predicates.get(table):
+            conditions.append(self.predicates[table])
+
+        percent = self.samples.get(table, self.sample_percent)
+        if percent is not None and percent < 100:
+            if pk:
+                conditions.append(f"{build_key_hash(pk)} % {SAMPLE_BUCKETS} < {round(percent * SAMPLE_BUCKETS / 100)}")
+            else:
+                print(f"{table}: no primary key to sample the rows by; not sampled.")
+
+        return " AND ".join(f"({condition})" for condition in conditions) if conditions else None
+
+    def _omitted_columns(self, table, columns, pk) -> tuple:
+
+        if table not in self.columns:
+            return ()
+
+        names = [column.COLUMN_NAME for column in columns]
+        unknown = set(self.columns[table]) - set(names)
+        if unknown:
+            raise ValueError(f"Columns {sorted(unknown)} not found in {table}")
+
+        omitted = tuple(column for column in columns if column.COLUMN_NAME not in self.columns[table] and column.COLUMN_NAME != pk)
+        not_nullable = [column.COLUMN_NAME for column in omitted if not column.IS_NULLABLE]
+        if not_nullable:
+            raise ValueError(f"Columns {not_nullable} of {table} are NOT NULL; they cannot be copied as NULL")
+
+        return tuple(column.COLUMN_NAME for column in omitted)
+
+    def plan(self, tables, get_foreign_keys, get_primary_key, get_columns, build_key_hash, stage_keys=None) -> dict:
+        '''{table: Table_Filter} of the tables to copy out of tables, the source database's tables. The get_* functions
+        take a table name; build_key_hash is the source dataimpl's. stage_keys(table, columns, condition), the source
+        dataimpl's stage_keys bound to a connection, replaces a referencing table's condition longer than
+        MAX_CONDITION_LENGTH, or nesting MAX_CONDITION_DEPTH subqueries, by a table of the keys it selects; without it
+        the condition is nested as it is.'''
+        foreign_keys = {table: get_foreign_keys(table) for table in tables}
+        selected = [table for table in tables if self.is_selected(table)]
+        referenced_only = set()
+
+        if self.fk_closure:
+            stack = list(selected)
+            while stack:
+                for fk in foreign_keys[stack.pop()]:
+                    parent = fk.REFERENCED_TABLE_NAME
+                    if parent in foreign_keys and parent not in selected:
+                        selected.append(parent)
+                        referenced_only.add(parent)
+                        stack.append(parent)
+
+        pks = {table: get_primary_key(table) for table in selected}
+        own_conditions = {table: NO_ROWS if table in referenced_only else self._own_condition(table, pks[table], build_key_hash)
+                          for table in selected}
+
+        # {parent: {(child, constraint): [fk, ...]}} of the references between selected tables.
+        references = {table: {} for table in selected}
+        for child in selected:
+            for fk in foreign_keys[child]:
+                parent = fk.REFERENCED_TABLE_NAME
+                if parent in references and parent != child:
+                    references[parent].setdefault((child, fk.CONSTRAINT_NAME or fk.ID), []).append(fk)
+
+        conditions = {}     # Table -> its condition, built once and reused by every table referencing it.
+        depths = {}         # Table -> subqueries nested in its condition.
+        visiting = set()
+
+        def source(child, fks, child_condition):
+            '''(FROM source, condition or None, depth) of the referencing rows of child, staged when child_condition is too
+            long or too deeply nested.'''
+            if stage_keys and child_condition and (len(child_condition) > MAX_CONDITION_LENGTH or depths[child] >= MAX_CONDITION_DEPTH):
+                columns = list(dict.fromkeys(fk.REFERENCING_COLUMN_NAME for fk in fks))
+                return f"{stage_keys(child, columns, child_condition)} AS [{child}]", None, 0
+
+            return f"[{child}]", child_condition, depths[child]
+
+        def condition(table):
+            if table in conditions:
+                return conditions[table]
+
+            own = own_conditions[table]
+            depths[table] = 0
+            if own is None or not self.fk_closure:
+                conditions[table] = own
+                return own
+
+            visiting.add(table)
+            parts = [own] if own != NO_ROWS else []
+            for (child, _), fks in references[table].items():
+                if child in visiting:
+                    continue        # Reached through a reference cycle.
+                child_source, child_condition, depth = source(child, fks, condition(child))
+                depths[table] = max(depths[table], depth + 1)
+                if len(fks) == 1:
+                    # Not correlated, so the referenced keys are collected once instead of probed for every row.
+                    fk = fks[0]
+                    where = f" WHERE {child_condition}" if child_condition else ""
+                    parts.append(f"[{table}].[{fk.REFERENCED_COLUMN_NAME or pks[table]}] IN (SELECT [{child}].[{fk.REFERENCING_COLUMN_NAME}] FROM {child_source}{where})")
+                else:
+                    join = " AND ".join(f"[{child}].[{fk.REFERENCING_COLUMN_NAME}] = [{table}].[{fk.REFERENCED_COLUMN_NAME or pks[table]}]" for fk in fks)
+                    parts.append(f"EXISTS (SELECT 1 FROM {child_source} WHERE {join}" + (f" AND ({child_condition})" if child_condition else "") + ")")
+            visiting.discard(table)
+
+            conditions[table] = " OR ".join(f"({part})" for part in parts) if parts else NO_ROWS
+            return conditions[table]
+
+        return {table: Table_Filter(table, condition(table), self._omitted_columns(table, get_columns(table), pks[table]))
+                for table in selected}
+
+def _parse_items(items, name) -> dict:
+    '''['Table=Value', ...] -> {Table: Value}'''
+    values = {}
+    for item in items or ():
+        table, sep, value = item.partition('=')
+        if not sep or not table or not value:
+            raise ValueError(f"Expected Table={name}, got {item}")
+        values[table] = value
+
+    return values
+
+def parse_subset(include_tables=None, exclude_tables=None, columns=None, where=None, sample=None, fk_closure=True):
+    '''Subset from the command line items (-columns Table=A,B, -where Table=Condition, -sample Percent or
+    Table=Percent), or None when none of them is given.'''
+    if not any((include_tables, exclude_tables, columns, where, sample)):
+        return None
+
+    sample_percent = None
+    samples = {}
+    for item in sample or ():
+        if '=' in item:
+            samples.update({table: float(percent) for table, percent in _parse_items([item], 'Percent').items()})
+        else:
+            sample_percent = float(item)
+
+    return Subset(include_tables, exclude_tables,
+                  {table: [name.strip() for name in names.split(',')] for table, names in _parse_items(columns, 'Column,...').items()},
+                  _parse_items(where, 'Condition'), sample_percent, samples, fk_closure)
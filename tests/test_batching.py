@@ -0,0 +1,48 @@
+import sqlite3
+
+from sql.batching import BatchController
+from sql.DataClone import _CommitTracker
+from sql.sqlite import dataimpl as sqlite_data
+
+class _Checkpoints:
+
+    def __init__(self):
+
+        self.saved = []
+
+    def save(self, key_range, rows_read, last_row):
+
+        self.saved.append((key_range, rows_read, last_row))
+
+def test_summary_records_batch_lengths():
+
+    controller = BatchController(100, adaptive=False)
+    assert [len(batch) for batch in controller.batches(range(250))] == [100, 100, 50]
+    assert controller.summary() == {'batches': 3, 'first': 100, 'min': 50, 'max': 100, 'last': 50, 'total': 250}
+
+def test_stream_batches_grow_past_read_batches():
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE [T] ([Id] INTEGER PRIMARY KEY, [Value] TEXT)')
+    checkpoints = _Checkpoints()
+    tracker = _CommitTracker(checkpoints)
+    read = [(None, [(key, str(key)) for key in range(start, start + 10)], (start + 9, )) for start in range(0, 1000, 10)]
+    controller = BatchController(10, 2, 'T', target_seconds=60)        # Fast writes: every batch may double.
+
+    assert sqlite_data.insert_batched(conn, 'T', tracker.rows(read), controller=controller, on_commit=tracker.on_commit) == 1000
+    assert controller.summary()['max'] > 10
+    assert checkpoints.saved[-1] == (None, 1000, (999, ))
+
+def test_tracker_checkpoints_each_key_range():
+
+    checkpoints = _Checkpoints()
+    tracker = _CommitTracker(checkpoints)
+    items = [((0, 9), [1, 2], 'a'), ((10, 19), [3], 'b'), ((0, 9), [4], 'c'), ((10, 19), [5, 6], 'd')]
+    rows = list(tracker.rows(items))
+
+    tracker.on_commit(3, rows[2])
+    assert checkpoints.saved == [((0, 9), 2, 'a'), ((10, 19), 1, 'b')]
+    tracker.on_commit(5, rows[4])      # Inside the last batch: checkpointed at the end of the one before.
+    assert checkpoints.saved[2:] == [((0, 9), 3, 'c')]
+    tracker.on_commit(6, rows[5])
+    assert checkpoints.saved[3:] == [((10, 19), 3, 'd')]
@@ -0,0 +1,44 @@
+import datetime
+import math
+
+import pytest
+
+from bdatetime import bdatetime
+from bdatetime.bdatetime import from_julian, from_julian_many, to_julian_many, MIN_JULIAN, MAX_JULIAN
+
+# from_julian_many converts chunks of 16 values or more through NumPy and shorter ones value by value; both paths
+# must agree on every value, including the ones no datetime can hold.
+
+NUMPY_CHUNK = 16
+
+def _both_paths(values):
+
+    short = [from_julian_many([value])[0] for value in values]
+    long = from_julian_many(list(values) * NUMPY_CHUNK)[:len(values)]
+    return short, long
+
+def test_paths_agree_in_range():
+
+    dts = [datetime.datetime(1, 1, 1), datetime.datetime(1970, 1, 1, 0, 0, 0, 1), datetime.datetime(2025, 6, 3, 12, 8, 12, 500000),
+           datetime.datetime(9999, 12, 31, 23, 59, 59)]
+    juls = to_julian_many(dts) + [None, MIN_JULIAN, 2451545.0]
+
+    short, long = _both_paths(juls)
+
+    assert short == long
+    assert short[:len(dts)] == [from_julian(jul) for jul in juls[:len(dts)]]
+
+@pytest.mark.parametrize('value', [1.0, MIN_JULIAN - 1, MAX_JULIAN, MAX_JULIAN + 1e6, -1e12, math.inf, math.nan])
+def test_paths_agree_out_of_range(value):
+
+    for values in ([value], [2451545.0] * NUMPY_CHUNK + [value]):
+        with pytest.raises((OverflowError, ValueError)):
+            from_julian_many(values)
+
+def test_numpy_path_used():
+
+    if bdatetime._get_numpy() is None:
+        pytest.skip("numpy not installed")
+
+    result = from_julian_many([2451545.0] * NUMPY_CHUNK)
+    assert all(isinstance(dt, datetime.datetime) for dt in result)
@@ -0,0 +1,22 @@
+import datetime
+
+from sql.converters import _julian_to_datetime, _julian_to_date, _julian_to_datetime_many
+
+# Numbers in a SQLite column that maps to a SQL Server date/time column are converted only when they are Julian days
+# a datetime can hold; anything else is passed through, as it was before the converter plans.
+
+JD_2000 = 2451545.0     # 2000-01-01 12:00
+
+def test_scalar_converters_pass_non_julian_values():
+
+    assert _julian_to_datetime(JD_2000) == datetime.datetime(2000, 1, 1, 12)
+    assert _julian_to_date(JD_2000) == datetime.date(2000, 1, 1)
+    for val in (1.0, 5, -1e12, True, '2020-01-01'):
+        assert _julian_to_datetime(val) == val
+        assert _julian_to_date(val) == val
+
+def test_batch_converter_passes_non_julian_values():
+
+    for size in (2, 40):        # Below and above the NumPy chunk size of from_julian_many.
+        values = [JD_2000] * (size - 2) + [1.0, None]
+        assert _julian_to_datetime_many(values) == [datetime.datetime(2000, 1, 1, 12)] * (size - 2) + [1.0, None]
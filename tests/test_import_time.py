@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+from benchmarks.import_time import DEFAULT_BUDGETS_MS, LAZY_MODULES, ROOT
+
+def _import_times(module) -> dict:
+    '''Cumulative microseconds of each module imported by module, as reported by python -X importtime.'''
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT, capture_output=True, text=True,
+                            check=True).stderr
+
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+def test_main_imports_no_lazy_modules_within_budget():
+
+    times = _import_times('main')
+    assert 'main' in times
+
+    loaded = {name.split('.')[0] for name in times}
+    assert not loaded & set(LAZY_MODULES)
+    assert times['main'] / 1000 <= DEFAULT_BUDGETS_MS['main']
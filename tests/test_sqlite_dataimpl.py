@@ -0,0 +1,50 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from bdatetime.bdatetime import to_julian
+from sql.checksums import text_hash
+from sql.sqlite import connectionimpl as sqlite_connection
+from sql.sqlite import dataimpl as sqlite_data
+
+def _table(tmp_path):
+
+    conn = sqlite_connection.get_connection(str(tmp_path / 'insert.db'))
+    conn.execute('CREATE TABLE [T] ([Id] INTEGER PRIMARY KEY AUTOINCREMENT, [Name] TEXT)')
+    conn.commit()
+
+    return conn
+
+def test_insert_many_skips_rejected_statements(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(sqlite_data, 'rows_per_statement', lambda *args, **kwargs: 2)
+    conn = _table(tmp_path)
+
+    assert sqlite_data.insert_many(conn, 'T', [(1, 'a'), (2, 'b'), (3, 'c'), (1, 'duplicate'), (5, 'e')]) == 3
+    assert conn.execute('SELECT [Id] FROM [T] ORDER BY [Id]').fetchall() == [(1, ), (2, ), (5, )]
+    conn.close()
+
+def test_insert_many_raises_other_errors(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(sqlite_data, 'rows_per_statement', lambda *args, **kwargs: 2)
+    conn = _table(tmp_path)
+
+    with pytest.raises(sqlite3.Error):
+        sqlite_data.insert_many(conn, 'T', [(1, 'a'), (2, 'b'), (3, {'not': 'bindable'})])
+    assert conn.execute('SELECT COUNT(*) FROM [T]').fetchone() == (0, )      # Nothing half-inserted.
+    conn.close()
+
+def test_chunk_digest_renders_values_as_sqlserver(tmp_path):
+
+    conn = sqlite_connection.get_connection(str(tmp_path / 'digest.db'))
+    conn.execute('CREATE TABLE [T] ([Id] INTEGER PRIMARY KEY AUTOINCREMENT, [Price] NUMERIC, [Created] REAL, [Note] TEXT)')
+    conn.executemany('INSERT INTO [T] VALUES (?, ?, ?, ?)', [(1, '12.50', to_julian(datetime.datetime(2024, 1, 2, 3, 4, 5, 678000)), 'a'),
+                                                             (2, None, None, None)])
+    kinds = ('int', 'number', 'datetime', 'text')
+
+    # The texts SQL Server renders through sql.sqlserver.dataimpl.DIGEST_EXPRESSIONS.
+    texts = ['v1\x1fv4029000000000000\x1fv2024-01-02 03:04:05.678\x1fva', 'v2\x1fn\x1fn\x1fn']
+    assert sqlite_data.get_chunk_digest(conn, 'T', ['Id', 'Price', 'Created', 'Note'], kinds) == (2, sum(map(text_hash, texts)))
+    assert sqlite_data.get_chunk_digest(conn, 'T', ['Id', 'Price', 'Created', 'Note'], kinds, (2, 2), 'Id') == (1, text_hash(texts[1]))
+    conn.close()
@@ -0,0 +1,119 @@
+import hashlib
+
+import pytest
+
+from sql import subsetting
+from sql.subsetting import Subset
+from sql.sqlite import connectionimpl as sqlite_connection
+from sql.sqlite import dataimpl as sqlite_data
+from sql.sqlite import schemaimpl as sqlite_schema
+from sql.sqlserver import dataimpl as sqlserver_data
+
+DEPTH = 12
+
+def _chain(path, rows=100):
+    '''T0 <- T1 <- ... <- T{DEPTH}, each table referencing the one before through two foreign keys, so every level
+    nests the condition of the next one twice.'''
+    conn = sqlite_connection.get_connection(str(path))
+    conn.execute('CREATE TABLE [T0] ([Id] INTEGER PRIMARY KEY AUTOINCREMENT)')
+    conn.executemany('INSERT INTO [T0] ([Id]) VALUES (?)', [(key, ) for key in range(1, rows + 1)])
+    for level in range(1, DEPTH + 1):
+        conn.execute(f'CREATE TABLE [T{level}] ([Id] INTEGER PRIMARY KEY AUTOINCREMENT, [A] INTEGER REFERENCES [T{level - 1}] ([Id]), '
+                     f'[B] INTEGER REFERENCES [T{level - 1}] ([Id]))')
+        conn.executemany(f'INSERT INTO [T{level}] ([Id], [A], [B]) VALUES (?, ?, ?)', [(key, key, rows + 1 - key) for key in range(1, rows + 1)])
+    conn.commit()
+
+    return conn
+
+def _plan(conn, stage_keys=None, predicate='[Id] <= 3'):
+
+    subset = Subset(include_tables=[f'T{DEPTH}'], predicates={f'T{DEPTH}': predicate})      # The others only as referenced.
+    return subset.plan(sqlite_schema.get_tables(conn), lambda table: sqlite_schema.get_foreign_keys(conn, table),
+                       lambda table: sqlite_schema.get_primary_key(conn, table), lambda table: sqlite_schema.get_columns(conn, table),
+                       sqlite_data.build_key_hash, stage_keys)
+
+def _keys(conn, table, condition):
+
+    return sorted(row[0] for batch in sqlite_data.iter_rows(conn, table, condition=condition) for row in batch)
+
+def test_long_conditions_are_staged(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(subsetting, 'MAX_CONDITION_LENGTH', 500)
+    conn = _chain(tmp_path / 'chain.db')
+    staged = _plan(conn, lambda table, columns, condition: sqlite_data.stage_keys(conn, table, columns, condition))
+    nested = _plan(conn)
+
+    assert max(len(table_filter.CONDITION) for table_filter in staged.values()) < 2000
+    assert len(nested['T0'].CONDITION) > 100 * len(staged['T0'].CONDITION)      # Too deep for SQLite's parser, too.
+    assert _keys(conn, f'T{DEPTH}', staged[f'T{DEPTH}'].CONDITION) == [1, 2, 3]
+    for level in range(DEPTH):      # A keeps the keys, B maps them to 101 - key.
+        assert _keys(conn, f'T{level}', staged[f'T{level}'].CONDITION) == [1, 2, 3, 98, 99, 100]
+
+def test_staged_keys_are_read_by_other_connections(tmp_path):
+
+    rows = 10000        # Far more keys than would fit into MAX_CONDITION_LENGTH as literals.
+    conn = _chain(tmp_path / 'chain.db', rows)
+    staged = []
+
+    def stage_keys(table, columns, condition):
+        staged.append(sqlite_data.stage_keys(conn, table, columns, condition))
+        return staged[-1]
+
+    filters = _plan(conn, stage_keys, f'[Id] <= {rows // 2}')
+    assert staged
+    assert max(len(table_filter.CONDITION) for table_filter in filters.values()) < subsetting.MAX_CONDITION_LENGTH
+
+    reader = sqlite_connection.get_connection(str(tmp_path / 'chain.db'))
+    assert len(_keys(reader, 'T0', filters['T0'].CONDITION)) == rows
+
+    sqlite_data.drop_staged_keys(conn, staged)
+    tables = {row[0] for row in reader.execute(f"SELECT name FROM [{sqlite_connection.STAGING_SCHEMA}].sqlite_master")}
+    assert not tables & {name.split('.')[1].strip('[]') for name in staged}
+    reader.close()
+    conn.close()
+
+def test_stage_keys_without_rows(tmp_path):
+
+    conn = _chain(tmp_path / 'chain.db')
+    source = sqlite_data.stage_keys(conn, 'T1', ['A'], '1 = 0')
+    assert conn.execute(f'SELECT COUNT(*) FROM {source}').fetchone() == (0, )
+    sqlite_data.drop_staged_keys(conn, [source])
+
+def _bands(keys, num_of_keys, num_of_bands=10) -> list:
+
+    counts = [0] * num_of_bands
+    for key in keys:
+        counts[(key - 1) * num_of_bands // num_of_keys] += 1
+
+    return counts
+
+def test_sqlite_sample_spreads_over_the_keys(tmp_path):
+
+    conn = _chain(tmp_path / 'chain.db', 20000)
+    condition = Subset(sample_percent=10)._own_condition('T0', 'Id', sqlite_data.build_key_hash)
+    assert all(150 < count < 250 for count in _bands(_keys(conn, 'T0', condition), 20000))
+    conn.close()
+
+def _sqlserver_key_hash(key) -> int:
+    '''sqlserver_data.build_key_hash of an integer key, as SQL Server computes it: the NVARCHAR text is UTF-16LE.'''
+    return int.from_bytes(hashlib.sha256(str(key).encode('utf-16-le')).digest()[:7], 'big')
+
+def test_sqlserver_sample_spreads_over_the_keys():
+
+    assert "HASHBYTES('SHA2_256', CAST([Id] AS NVARCHAR(4000)))" in sqlserver_data.build_key_hash('Id')
+    sample = [key for key in range(1, 100001) if _sqlserver_key_hash(key) % subsetting.SAMPLE_BUCKETS < subsetting.SAMPLE_BUCKETS // 10]
+    assert all(50 < count < 150 for count in _bands(sample, 100000, 100))      # CHECKSUM: bands of 1000 and of 0.
+
+def test_projection_keeps_not_null_columns(tmp_path):
+
+    conn = sqlite_connection.get_connection(str(tmp_path / 'projection.db'))
+    conn.execute('CREATE TABLE [T] ([Id] INTEGER PRIMARY KEY AUTOINCREMENT, [Name] TEXT NOT NULL, [Note] TEXT)')
+
+    def plan(columns):
+        return Subset(columns={'T': columns}).plan(['T'], lambda table: (), lambda table: sqlite_schema.get_primary_key(conn, table),
+                                                   lambda table: sqlite_schema.get_columns(conn, table), sqlite_data.build_key_hash)
+
+    assert plan(['Name'])['T'].OMITTED_COLUMNS == ('Note', )
+    with pytest.raises(ValueError, match='Name'):
+        plan(['Note'])
+    conn.close()